@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+import logging
+
+import metrics
+from tracing import span
+from http_client import HttpClient
+from log_setup import log_payload
+
+logger = logging.getLogger(__name__)
+
+# 接続先（負荷試験などでスタブサーバーに向けるときは APEX_API_BASE で上書きする）
+APEX_API_BASE = os.getenv("APEX_API_BASE", "https://api.mozambiquehe.re")
+MAPROTATION_URL = APEX_API_BASE + "/maprotation?auth={api_key}&version=2"
+PREDATOR_URL = APEX_API_BASE + "/predator?auth={api_key}"
+
+# ローテーション終了時刻が取れなかった場合のキャッシュ秒数
+MAPROTATION_FALLBACK_TTL = 60
+# 終了時刻を過ぎても API 側が古いデータを返すことがあるので、最低限この秒数はキャッシュする
+MAPROTATION_MIN_TTL = 5
+# マップの取得に失敗した後、取り直しを始めずに前回のデータを返し続ける秒数
+MAPROTATION_RETRY_AFTER = 30
+# ローテーションの終了時刻を過ぎたデータを、取り直せるまで返し続けてよい秒数（過ぎたら取得を待つ）
+MAPROTATION_MAX_STALE = int(os.getenv("MAPROTATION_MAX_STALE", "600"))
+# プレデターボーダーのキャッシュ秒数（環境変数 PREDATOR_BORDER_TTL で上書き可）
+PREDATOR_BORDER_TTL = int(os.getenv("PREDATOR_BORDER_TTL", "300"))
+# 取得に失敗した後、再取得を試みずに古い値を返し続ける秒数
+PREDATOR_BORDER_RETRY_AFTER = 30
+# バックグラウンド先読みでプレデターボーダーを取り直す間隔（TTL より短くしておく）
+PREDATOR_BORDER_REFRESH_INTERVAL = int(os.getenv("PREDATOR_BORDER_REFRESH_INTERVAL", str(PREDATOR_BORDER_TTL * 4 // 5)))
+# 先読みに失敗したときに再試行するまでの秒数
+PREFETCH_RETRY_AFTER = 30
+
+# mozambiquehe.re 用の HTTP クライアント（接続を使い回し、落ちているときはすぐ諦める）
+apex_http = HttpClient(
+    connect_timeout=float(os.getenv("APEX_HTTP_CONNECT_TIMEOUT", "3.05")),
+    read_timeout=float(os.getenv("APEX_HTTP_READ_TIMEOUT", "10")),
+    retries=int(os.getenv("APEX_HTTP_RETRIES", "2")),
+)
+
+# 上流ごと（maprotation / predator）の取得時間と失敗数。リトライを含めた1回の取得を1件と数える
+upstream_seconds = metrics.histogram(
+    "bot_upstream_request_duration_seconds", "Apex API の取得にかかった時間", ("upstream",))
+upstream_errors = metrics.counter("bot_upstream_errors_total", "Apex API の取得の失敗数", ("upstream",))
+cache_requests = metrics.cache_requests
+
+# 英語マップ名→日本語マップ名の辞書
+MAP_TRANSLATIONS = {
+	"World's Edge": "ワールズエッジ",
+	"Fragment East": "フラグメント・イースト",
+	"Fragment West": "フラグメント・ウエスト",
+	"Fragment": "フラグメント",
+	"Storm Point": "ストームポイント",
+	"Broken Moon": "ブロークンムーン",
+	"Olympus": "オリンパス",
+	"Kings Canyon": "キングスキャニオン",
+	"Thunderdome": "サンダードーム",
+	"Overflow": "オーバーフロー",
+	"Habitat 4": "生息地4",
+	"Encore": "アンコール",
+	"Production Yard": "生産工場",
+	"Skulltown": "スカルタウン",
+	"Monument": "モニュメント",
+	"E-District": "エレクトロ地区",
+	"Siphon": "ラバサイフォン",
+	"Estates": "エステート",
+	"Control": "コントロール", # モード名
+	"Gun Run": "ガンゲーム",
+	"Team Deathmatch": "チームデスマッチ",
+	"Unknown": "不明、エラー"
+}
+
+def translate_map_name(name):
+    return MAP_TRANSLATIONS.get(name, name)
+
+
+def fetch_map_rotation(api_key):
+    """mozambiquehe.re の /maprotation を叩いて JSON をそのまま返す。"""
+    url = MAPROTATION_URL.format(api_key=api_key)
+    with upstream_seconds.time("maprotation", errors=upstream_errors), span("apex.maprotation"):
+        data = apex_http.get_json(url)
+    log_payload(logger, "APIレスポンス", data)
+    return data
+
+
+# 取り直せずに前回取得した内容を返すときに、返信の末尾に付ける注意書き（?マップ・?ボーダー 共通）
+STALE_NOTICE = "\n（※最新の取得に失敗したため、前回取得した値を表示しています）"
+
+
+class _Flight:
+    """実行中の取得1回分。待っているスレッドはここで結果を受け取る。"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class MapRotationCache:
+    """
+    マップローテーションの取得結果を、現在のローテーションが終わるまで使い回すキャッシュ。
+    残り時間は返信のたびにキャッシュした終了時刻から計算し直す。
+
+    上流からの取得はロックの外で1回ずつ行い、取れたら入れ替える。期限が切れていても、
+    取り直している間や取得に失敗した後は前回のデータを「古い値」として返す（取り直しは別のスレッドで始める）。
+    返信が上流を待つのは、まだ一度も取れていないときと、期限から max_stale 秒以上経ったときだけ。
+    """
+
+    def __init__(self, fetcher, retry_after=MAPROTATION_RETRY_AFTER, max_stale=MAPROTATION_MAX_STALE,
+                 clock=time.time):
+        self._fetcher = fetcher
+        self._retry_after = retry_after
+        self._max_stale = max_stale
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._flight = None
+        self._data = None
+        self._expires_at = 0.0
+        self._retry_at = 0.0
+
+    @property
+    def expires_at(self):
+        return self._expires_at
+
+    def cached(self):
+        """get() が上流を待たずに返せるか（期限切れでも max_stale 秒以内なら前回のデータを返せる）"""
+        return self._data is not None and self._clock() < self._expires_at + self._max_stale
+
+    def get(self):
+        """
+        (データ, 現在時刻, 古い値かどうか) を返す。期限切れなら前回のデータを返しつつ取り直しを始める。
+        期限から max_stale 秒以上経っていたら取得を待ち、失敗したら例外を投げる。
+        """
+        now = self._clock()
+        with self._lock:
+            data = self._data
+            if data is not None and now < self._expires_at:
+                cache_requests.inc("map_rotation", "hit")
+                return data, now, False
+            if now >= self._expires_at + self._max_stale:
+                data = None
+            refresh = data is not None and self._flight is None and now >= self._retry_at
+
+        if data is not None:
+            cache_requests.inc("map_rotation", "stale")
+            if refresh:
+                threading.Thread(target=self._refresh_in_background, name="maprotation-refresh", daemon=True).start()
+            return data, now, True
+
+        cache_requests.inc("map_rotation", "miss")
+        flight = self._join_flight()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value, self._clock(), False
+
+    def refresh(self):
+        """期限に関係なく取得し直す。失敗した場合は例外を投げる（前回のデータは残る）。"""
+        flight = self._join_flight()
+        if flight.error is not None:
+            raise flight.error
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning("マップの取得に失敗しました（前回のデータを返し続けます）: %s", e)
+
+    def _join_flight(self):
+        """実行中の取得があればその完了を待ち、無ければ自分で取得する。"""
+        with self._lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+
+        if leader:
+            self._run(flight)
+        else:
+            flight.done.wait()
+        return flight
+
+    def _run(self, flight):
+        try:
+            data = self._fetcher()
+        except Exception as e:
+            with self._lock:
+                self._retry_at = self._clock() + self._retry_after
+                flight.error = e
+                self._flight = None
+        else:
+            now = self._clock()
+            with self._lock:
+                self._store(data, now)
+                flight.value = data
+                self._flight = None
+        finally:
+            flight.done.set()
+
+    def store(self, data):
+        """別の経路（非同期の先読みなど）で取得したデータをキャッシュに入れる。"""
+        now = self._clock()
+        with self._lock:
+            self._store(data, now)
+
+    def _store(self, data, now):
+        self._data = data
+        self._expires_at = rotation_expiry(data, now)
+
+
+def rotation_expiry(data, now):
+    """一番早く終わる「現在の」ローテーションの終了時刻を返す。"""
+    ends = []
+    if isinstance(data, dict):
+        for key in ("battle_royale", "ranked", "ltm"):
+            section = data.get(key)
+            if not isinstance(section, dict) or not isinstance(section.get("current"), dict):
+                continue
+            end = section["current"].get("end")
+            if isinstance(end, (int, float)):
+                ends.append(end)
+    if not ends:
+        return now + MAPROTATION_FALLBACK_TTL
+    return max(min(ends), now + MAPROTATION_MIN_TTL)
+
+
+def remaining_timer(current, now):
+    """キャッシュした終了時刻から "HH:MM:SS" 形式の残り時間を計算する。"""
+    end = current.get("end")
+    if not isinstance(end, (int, float)):
+        return current.get("remainingTimer", "不明")
+    secs = max(0, int(end - now))
+    return f"{secs // 3600:02d}:{secs % 3600 // 60:02d}:{secs % 60:02d}"
+
+
+def build_map_rotation_text(data, now):
+    """/maprotation の JSON から ?マップ の返信テキストを組み立てる。"""
+    reply_lines = []
+
+    if "battle_royale" in data:
+        br = data["battle_royale"]
+        reply_lines.append("\U0001F5FA カジュアル")
+        reply_lines.append(f"現在のマップ: {translate_map_name(br['current']['map'])}（あと{remaining_timer(br['current'], now)}）")
+        reply_lines.append(f"次のマップ: {translate_map_name(br['next']['map'])}")
+        reply_lines.append("")
+
+    if "ranked" in data:
+        rk = data["ranked"]
+        reply_lines.append("\U0001F3C6 ランクリーグ")
+        reply_lines.append(f"現在のマップ: {translate_map_name(rk['current']['map'])}（あと{remaining_timer(rk['current'], now)}）")
+        reply_lines.append(f"次のマップ: {translate_map_name(rk['next']['map'])}")
+        reply_lines.append("")
+
+    if "ltm" in data:
+        ltm = data["ltm"]
+        cur_mode = ltm["current"]
+        next_mode = ltm["next"]
+        known_mix = ["Control", "Gun Run", "Team Deathmatch"]
+        if cur_mode["eventName"] in known_mix:
+            reply_lines.append("\U0001F3AE ミックステープ")
+            reply_lines.append(f"現在のモード: {translate_map_name(cur_mode['eventName'])}（マップ: {translate_map_name(cur_mode['map'])}、あと{remaining_timer(cur_mode, now)}）")
+            reply_lines.append(f"次のモード: {translate_map_name(next_mode['eventName'])}（マップ: {translate_map_name(next_mode['map'])}）")
+            reply_lines.append("")
+        else:
+            reply_lines.append("⏱ 期間限定モード")
+            reply_lines.append(f"現在: {translate_map_name(cur_mode['eventName'])}（マップ: {translate_map_name(cur_mode['map'])}、あと{remaining_timer(cur_mode, now)}）")
+            reply_lines.append(f"次: {translate_map_name(next_mode['eventName'])}（マップ: {translate_map_name(next_mode['map'])}）")
+            reply_lines.append("")
+    else:
+        reply_lines.append("⏱ 期間限定モード")
+        reply_lines.append("現在: ❌ 開催されていません")
+
+    return "\n".join(reply_lines)
+
+
+def fetch_predator_border(apex_api_key: str) -> str:
+    """
+    mozambiquehe.re の /predator エンドポイントを叩き、
+    プラットフォーム別のボーダー情報を文字列で返す。
+    失敗時は例外を投げる。
+    """
+    if not apex_api_key:
+        raise ValueError("APEX_API_KEY が設定されていません。")
+
+    url = PREDATOR_URL.format(api_key=apex_api_key)
+    with upstream_seconds.time("predator", errors=upstream_errors), span("apex.predator"):
+        data = apex_http.get_json(url)
+    return format_predator_border(data)
+
+
+def format_predator_border(data) -> str:
+    """/predator の JSON からプラットフォーム別のボーダー情報の文字列を組み立てる。"""
+    # API の応答形式はいくつかのバリエーションがあるので柔軟に探索する
+    if isinstance(data, dict):
+        if "RP" in data and isinstance(data["RP"], dict):
+            container = data["RP"]
+        elif "rp" in data and isinstance(data["rp"], dict):
+            container = data["rp"]
+        elif "predator" in data and isinstance(data["predator"], dict):
+            container = data["predator"]
+        else:
+            container = data  # すでにプラットフォーム辞書の場合
+    else:
+        raise ValueError("APIの返却形式が想定外です。")
+
+    # 表示順とラベル（必要なら追加でマップ）
+    platform_order = [("PC", "PC"), ("PS4", "PlayStation"), ("X1", "Xbox")]
+    lines = ["【プレデターボーダー】"]
+
+    for key, label in platform_order:
+        if key not in container:
+            continue
+        p = container[key]
+        if not isinstance(p, dict):
+            continue
+        # よくあるフィールド名を順に探す
+        val = p.get("val") or p.get("value") or p.get("border")
+        total_masters = p.get("totalMasters") or p.get("totalMastersAndPreds") or p.get("total_masters")
+        total_preds = p.get("totalPredators") or p.get("total_predators")
+
+        lines.append(
+            f"{label}: {val if val is not None else '不明'} RP（マスター数: {total_masters if total_masters is not None else '不明'} / プレデター数: {total_preds if total_preds is not None else '不明'}）"
+        )
+
+    # もし上で何も追加されていない場合は、取得したキーを列挙してフォールバック表示
+    if len(lines) == 1:
+        for k, v in container.items():
+            if isinstance(v, dict):
+                val = v.get("val") or v.get("value") or "不明"
+            else:
+                val = "不明"
+            lines.append(f"{k}: {val}")
+
+    return "\n".join(lines)
+
+
+class PredatorBorderCache:
+    """
+    プレデターボーダーの返信テキストを TTL 付きでキャッシュする。
+    同時に来たキャッシュミスは1回の取得にまとめ、取得に失敗したときは
+    前回取得できた値を「古い値」として返す。
+    """
+
+    def __init__(self, fetcher, ttl=PREDATOR_BORDER_TTL, retry_after=PREDATOR_BORDER_RETRY_AFTER, clock=time.monotonic):
+        self._fetcher = fetcher
+        self._ttl = ttl
+        self._retry_after = retry_after
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._flight = None
+        self._value = None
+        self._stale = False
+        self._fresh_until = 0.0
+
+    def fresh(self):
+        """get() が上流を待たずに返せるか"""
+        return self._value is not None and self._clock() < self._fresh_until
+
+    def get(self):
+        """(テキスト, 古い値かどうか) を返す。古い値すら無い場合は例外を投げる。"""
+        with self._lock:
+            if self._value is not None and self._clock() < self._fresh_until:
+                cache_requests.inc("predator_border", "stale" if self._stale else "hit")
+                return self._value, self._stale
+
+        cache_requests.inc("predator_border", "miss")
+        flight = self._join_flight()
+        if flight.error is None:
+            return flight.value, False
+        if flight.value is not None:
+            return flight.value, True
+        raise flight.error
+
+    def refresh(self):
+        """期限に関係なく取得し直す。失敗した場合は例外を投げる（古い値は残る）。"""
+        flight = self._join_flight()
+        if flight.error is not None:
+            raise flight.error
+
+    def _join_flight(self):
+        """実行中の取得があればその完了を待ち、無ければ自分で取得する。"""
+        with self._lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+
+        if leader:
+            self._run(flight)
+        else:
+            flight.done.wait()
+        return flight
+
+    def store(self, value):
+        """別の経路（非同期の先読みなど）で取得した値をキャッシュに入れる。"""
+        with self._lock:
+            self._store(value)
+
+    def record_failure(self, error):
+        """別の経路での取得失敗を記録する。古い値があればしばらくそれを返し続ける。"""
+        with self._lock:
+            self._record_failure(error)
+
+    def _store(self, value):
+        self._value = value
+        self._stale = False
+        self._fresh_until = self._clock() + self._ttl
+
+    def _record_failure(self, error):
+        logger.warning("ボーダー取得に失敗しました: %s", error)
+        if self._value is not None:
+            # しばらくは上流を叩かずに古い値を返す
+            self._stale = True
+            self._fresh_until = self._clock() + self._retry_after
+
+    def _run(self, flight):
+        try:
+            value = self._fetcher()
+        except Exception as e:
+            with self._lock:
+                self._record_failure(e)
+                flight.error = e
+                flight.value = self._value
+                self._flight = None
+        else:
+            with self._lock:
+                self._store(value)
+                flight.value = value
+                self._flight = None
+        finally:
+            flight.done.set()
+
+
+class ApexPrefetcher:
+    """
+    ?マップ と ?ボーダー のデータをバックグラウンドで先読みするスレッド。
+    マップはローテーションが切り替わる時刻ちょうどに、ボーダーは一定間隔で取り直すので、
+    Webhook 側はキャッシュを読むだけで済む。
+    """
+
+    def __init__(self, map_cache, border_cache, border_interval=PREDATOR_BORDER_REFRESH_INTERVAL,
+                 retry_after=PREFETCH_RETRY_AFTER, clock=time.time):
+        self._map_cache = map_cache
+        self._border_cache = border_cache
+        self._border_interval = border_interval
+        self._retry_after = retry_after
+        self._clock = clock
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="apex-prefetch", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        next_map = next_border = 0.0
+        while not self._stop.is_set():
+            now = self._clock()
+            if now >= next_map:
+                next_map = self._refresh_map(now)
+            if now >= next_border:
+                next_border = self._refresh_border(now)
+            self._stop.wait(max(0.0, min(next_map, next_border) - self._clock()))
+
+    def _refresh_map(self, now):
+        try:
+            self._map_cache.refresh()
+        except Exception as e:
+            logger.error("マップ先読みエラー: %s", e)
+            return now + self._retry_after
+        return self._map_cache.expires_at
+
+    def _refresh_border(self, now):
+        try:
+            self._border_cache.refresh()
+        except Exception as e:
+            logger.error("ボーダー先読みエラー: %s", e)
+            return now + self._retry_after
+        return now + self._border_interval
@@ -2,11 +2,16 @@
 
 import os
 import sys
-import requests
-import sqlite3
+import atexit
+import signal
 import re
-from flask import Flask, request, abort
-from linebot.v3 import WebhookHandler
+from functools import partial
+from log_setup import setup_logging, add_log_context, log_payload
+# ログの書き出しスレッドは他のモジュールの atexit より後に止めたいので、それらを import する前に始める
+setup_logging()
+
+from flask import Flask, Response, request, abort
+from linebot.v3 import SignatureValidator, WebhookParser
 from linebot.v3.messaging import (
 	Configuration, ApiClient, MessagingApi,
 	ReplyMessageRequest, TextMessage, ImageMessage
@@ -15,6 +20,27 @@ from linebot.v3.webhooks import (
 	MessageEvent, TextMessageContent
 )
 from linebot.v3.exceptions import InvalidSignatureError
+import metrics
+import tracing
+from tracing import span
+from webhook_queue import EventHandlers, WebhookEventQueue
+from commands import CommandRouter
+from replies import PrebuiltReply, prebuild_reply, send_prebuilt_reply
+from knowledge import KnowledgeBase
+from dictionary import (
+    add_dictionary_entry,
+    delete_dictionary_entry,
+    vote_dictionary_delete,
+    DICTIONARY_DELETE_VOTES,
+    lookup_dictionary_entry,
+    list_dictionary_entries,
+    search_dictionary_entries,
+    suggest_dictionary_terms,
+)
+from apex_api import (
+	MapRotationCache, PredatorBorderCache, ApexPrefetcher, STALE_NOTICE,
+	fetch_map_rotation, fetch_predator_border, build_map_rotation_text
+)
 
 app = Flask(__name__)
 
@@ -25,1123 +51,105 @@ if channel_secret is None or channel_access_token is None:
 	print("環境変数が足りません")
 	sys.exit(1)
 
-handler = WebhookHandler(channel_secret)
-configuration = Configuration(access_token=channel_access_token)
-import sqlite3
-
-# DBに接続する関数
-def get_db_connection():
-    conn = sqlite3.connect("dictionary.db")
-    conn.row_factory = sqlite3.Row
-    return conn
-
-# 辞書を追加する関数
-def add_dictionary_entry(term, content, user_id, is_private):
-    conn = get_db_connection()
-    conn.execute(
-        "INSERT OR REPLACE INTO dictionary (term, content, added_by, is_private) VALUES (?, ?, ?, ?)",
-        (term, content, user_id, int(is_private))
-    )
-    conn.commit()
-    conn.close()
-
-# 辞書を削除する関数
-def delete_dictionary_entry(term, user_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM dictionary WHERE term = ?", (term,))
-    row = cursor.fetchone()
-    if row and row["added_by"] == user_id:
-        cursor.execute("DELETE FROM dictionary WHERE term = ?", (term,))
-        conn.commit()
-        conn.close()
-        return True
-    conn.close()
-    return False
-
-# 英語マップ名→日本語マップ名の辞書
-MAP_TRANSLATIONS = {
-	"World's Edge": "ワールズエッジ",
-	"Fragment East": "フラグメント・イースト",
-	"Fragment West": "フラグメント・ウエスト",
-	"Fragment": "フラグメント",
-	"Storm Point": "ストームポイント",
-	"Broken Moon": "ブロークンムーン",
-	"Olympus": "オリンパス",
-	"Kings Canyon": "キングスキャニオン",
-	"Thunderdome": "サンダードーム",
-	"Overflow": "オーバーフロー",
-	"Habitat 4": "生息地4",
-	"Encore": "アンコール",
-	"Production Yard": "生産工場",
-	"Skulltown": "スカルタウン",
-	"Monument": "モニュメント",
-	"E-District": "エレクトロ地区",
-	"Siphon": "ラバサイフォン",
-	"Estates": "エステート",
-	"Control": "コントロール", # モード名
-	"Gun Run": "ガンゲーム",
-	"Team Deathmatch": "チームデスマッチ",
-	"Unknown": "不明、エラー"
-}
-
-def fetch_predator_border(apex_api_key: str) -> str:
-    """
-    mozambiquehe.re の /predator エンドポイントを叩き、
-    プラットフォーム別のボーダー情報を文字列で返す。
-    失敗時は例外を投げる。
-    """
-    if not apex_api_key:
-        raise ValueError("APEX_API_KEY が設定されていません。")
-
-    url = f"https://api.mozambiquehe.re/predator?auth={apex_api_key}"
-    resp = requests.get(url, timeout=10)
-    resp.raise_for_status()
-    data = resp.json()
-
-    # API の応答形式はいくつかのバリエーションがあるので柔軟に探索する
-    if isinstance(data, dict):
-        if "RP" in data and isinstance(data["RP"], dict):
-            container = data["RP"]
-        elif "rp" in data and isinstance(data["rp"], dict):
-            container = data["rp"]
-        elif "predator" in data and isinstance(data["predator"], dict):
-            container = data["predator"]
-        else:
-            container = data  # すでにプラットフォーム辞書の場合
-    else:
-        raise ValueError("APIの返却形式が想定外です。")
-
-    # 表示順とラベル（必要なら追加でマップ）
-    platform_order = [("PC", "PC"), ("PS4", "PlayStation"), ("X1", "Xbox")]
-    lines = ["【プレデターボーダー】"]
-
-    for key, label in platform_order:
-        if key not in container:
-            continue
-        p = container[key]
-        if not isinstance(p, dict):
-            continue
-        # よくあるフィールド名を順に探す
-        val = p.get("val") or p.get("value") or p.get("border")
-        total_masters = p.get("totalMasters") or p.get("totalMastersAndPreds") or p.get("total_masters")
-        total_preds = p.get("totalPredators") or p.get("total_predators")
-
-        lines.append(
-            f"{label}: {val if val is not None else '不明'} RP（マスター数: {total_masters if total_masters is not None else '不明'} / プレデター数: {total_preds if total_preds is not None else '不明'}）"
-        )
-
-    # もし上で何も追加されていない場合は、取得したキーを列挙してフォールバック表示
-    if len(lines) == 1:
-        for k, v in container.items():
-            if isinstance(v, dict):
-                val = v.get("val") or v.get("value") or "不明"
-            else:
-                val = "不明"
-            lines.append(f"{k}: {val}")
-
-    return "\n".join(lines)
-
-# 武器の返答辞書
-WEAPON_RESPONSES = {
-	"?ハボック": (
-		"🔫 ハボックライフル\n"
-		"- 短縮名: ハボック\n"
-		"- 武器種: アサルトライフル\n"
-		"- 使用アモ: エネルギーアモ\n"
-		"- 製造元(共同開発): 시완(Siwhan) Industries\n"
-		"- 製造元(共同開発): Wonyeon\n"
-		"- 射撃モード: フルオート(/セミオート)\n"
-		"- 連射速度: 11.2発/秒\n"
-		"- ダメージ: 素20 頭26 脚15\n"
-		"- 装填数: 素18 白21 青25 紫29\n"
-		"- リロード時間(秒): 素3.20 白3.09 青2.99 紫2.88\n"
-		"- スピンアップ時間(秒): 素0.42 タボチャ0.01\n"
-		"- 弾速: 約774メートル/秒\n"
-		"- 初取り出しモーション時間: 1.5秒\n"
-		"- ヘッドショット有効距離: 300メートル\n"
-		"- ADS時移動速度倍率: x0.5"
-	),
-	"?ヘムロック": (
-		"🔫 ヘムロックバーストAR\n"
-		"- 短縮名: ヘムロック\n"
-		"- 武器種: アサルトライフル\n"
-		"- 使用アモ: ヘビーアモ\n"
-		"- 製造元: Wonyeon\n"
-		"- 射撃モード: 3点バースト/セミオート\n"
-		"- 連射速度(バースト): 15.5発/秒\n"
-		"- バースト連射ディレイ: 0.28秒\n"
-		"- 連射速度(セミオート): 6.4発/秒\n"
-		"- ダメージ: 素20 頭26 脚15\n"
-		"- 装填数: 素21 白24 青27 紫30\n"
-		"- タクティカルリロード時間(秒): 素2.40 白2.32 青2.24 紫2.16\n"
-		"- フルリロード時間(秒): 素2.85 白2.76 青2.66 紫2.57\n"
-		"- 弾速: 約698メートル/秒\n"
-		"- 初取り出しモーション時間: 1.25秒\n"
-		"- ヘッドショット有効距離: 300メートル\n"
-		"- ADS時移動速度倍率: x0.5"
-	),
-	"?フラットライン": (
-		"🔫 VK-47フラットライン\n"
-		"- 短縮名: フラットライン\n"
-		"- 武器種: アサルトライフル\n"
-		"- 使用アモ: ヘビーアモ\n"
-		"- 製造元: Wonyeon\n"
-		"- 射撃モード: フルオート/セミオート\n"
-		"- 連射速度(共通): 10発/秒\n"
-		"- 連射速度(アンビル・セミオート): 2.9発/秒\n"
-		"- ダメージ: 素19 頭25 脚14\n"
-		"- 装填数: 素19 白23 青27 紫29\n"
-		"- タクティカルリロード時間(秒): 素2.40 白2.32 青2.24 紫2.16\n"
-		"- フルリロード時間(秒): 素3.10 白3.00 青2.89 紫2.79\n"
-		"- 弾速: 約609メートル/秒\n"
-		"- 初取り出しモーション時間: 1.25秒\n"
-		"- ヘッドショット有効距離: 300メートル\n"
-		"- ADS時移動速度倍率: x0.5"
-	),
-	"?R-301": (
-		"🔫 R-301カービン\n"
-		"- 短縮名: R-301\n"
-		"- 武器種: アサルトライフル\n"
-		"- 使用アモ: ライトアモ\n"
-		"- 製造元: Lastimosa Armory\n"
-		"- 射撃モード: フルオート/セミオート\n"
-		"- 連射速度(共通): 13.5発/秒\n"
-		"- 連射速度(アンビル・セミオート): 3.5発/秒\n"
-		"- ダメージ: 素14 頭28 脚11\n"
-		"- 装填数: 素21 白23 青28 紫31\n"
-		"- タクティカルリロード時間(秒): 素2.40 白2.32 青2.24 紫2.16\n"
-		"- フルリロード時間(秒): 素3.2 白3.09 青2.99 紫2.88\n"
-		"- 弾速: 約736メートル/秒\n"
-		"- 初取り出しモーション時間: 1.1秒\n"
-		"- ヘッドショット有効距離: 300メートル\n"
-		"- ADS時移動速度倍率: x0.5"
-	),
-	"?ネメシス": (
-		"🔫 ネメシスバーストAR\n"
-		"- 短縮名: ネメシス\n"
-		"- 武器種: アサルトライフル\n"
-		"- 使用アモ: エネルギーアモ\n"
-		"- 製造元(デザイナー): ランパート\n"
-		"- 製造元: The Sisters\n"
-		"- 射撃モード: 4点バースト\n"
-		"- 連射速度(共通): 18発/秒\n"
-		"- バースト連射ディレイ(開始時): 0.31秒\n"
-		"- バースト連射ディレイ(最大時): 0.19秒\n"
-		"- ダメージ: 素17 頭22 脚13\n"
-		"- 装填数: 素20 白24 青28 紫32\n"
-		"- タクティカルリロード時間(秒): 素2.70 白2.61 青2.52 紫2.43\n"
-		"- フルリロード時間(秒): 素3.00 白2.90 青2.80 紫2.70\n"
-		"- 弾速: 約812メートル/秒\n"
-		"- 初取り出しモーション時間: 1.3秒\n"
-		"- ヘッドショット有効距離: 300メートル\n"
-		"- ADS時移動速度倍率: x0.5"
-	),
-	"?オルタネーター": (
-		"🔫 オルタネーターSMG\n"
-		"- 短縮名: オルタネーター\n"
-		"- 武器種: サブマシンガン\n"
-		"- 使用アモ: ライトアモ\n"
-		"- 製造元: Burrell Defense\n"
-		"- 射撃モード: フルオート\n"
-		"- 連射速度: 10発/秒\n"
-		"- ダメージ: 素18 頭23 脚14\n"
-		"- 装填数: 素20 白24 青27 紫29\n"
-		"- タクティカルリロード時間(秒): 素1.90 白1.84 青1.77 紫1.71\n"
-		"- フルリロード時間(秒): 素2.23 白2.16 青2.08 紫2.01\n"
-		"- 弾速: 約482メートル/秒\n"
-		"- 初取り出しモーション時間: 1.2秒\n"
-		"- ヘッドショット有効距離: 38メートル\n"
-		"- ADS時移動速度倍率: x0.75"
-	),
-	"?プラウラー": (
-		"🔫 プラウラーバーストPDW\n"
-		"- 短縮名: プラウラー\n"
-		"- 武器種: サブマシンガン\n"
-		"- 使用アモ: ヘビーアモ\n"
-		"- 製造元: Lastimosa Armory\n"
-		"- 射撃モード: 5点バースト/フルオート\n"
-		"- 連射速度(バースト): 21発/秒\n"
-		"- バースト射撃ディレイ: 0.28秒\n"
-		"- 連射速度(フルオート): 13.25発/秒\n"
-		"- ダメージ: 素16 頭20 脚13\n"
-		"- 装填数: 素20 白25 青30 紫35\n"
-		"- タクティカルリロード時間(秒): 素2.00 白1.93 青1.87 紫1.80\n"
-		"- フルリロード時間(秒): 素2.60 白2.51 青2.43 紫2.34\n"
-		"- 弾速: 約457メートル/秒\n"
-		"- 初取り出しモーション時間: 1.4秒\n"
-		"- ヘッドショット有効距離: 38メートル\n"
-		"- ADS時移動速度倍率: x0.75"
-	),
-	"?R-99": (
-		"🔫 R-99 SMG\n"
-		"- 短縮名: R-99\n"
-		"- 武器種: サブマシンガン\n"
-		"- 使用アモ: ライトアモ\n"
-		"- 製造元: Lastimosa Armory\n"
-		"- 射撃モード: フルオート\n"
-		"- 連射速度: 18発/秒\n"
-		"- ダメージ: 素13 頭16 脚10\n"
-		"- 装填数: 素18 白21 青24 紫27\n"
-		"- タクティカルリロード時間(秒): 素1.80 白1.74 青1.68 紫1.62\n"
-		"- フルリロード時間(秒): 素2.45 白2.37 青2.29 紫2.21\n"
-		"- 弾速: 約482メートル/秒\n"
-		"- 初取り出しモーション時間: 1.0秒\n"
-		"- ヘッドショット有効距離: 38メートル\n"
-		"- ADS時移動速度倍率: x0.825"
-	),
-	"?ボルト": (
-		"🔫 ボルトSMG\n"
-		"- 短縮名: ボルト\n"
-		"- 武器種: サブマシンガン\n"
-		"- 使用アモ: エネルギーアモ\n"
-		"- 製造元: 不詳\n"
-		"- 射撃モード: フルオート\n"
-		"- 連射速度: 12発/秒\n"
-		"- ダメージ: 素16 頭20 脚12\n"
-		"- 装填数: 素20 白22 青24 紫27\n"
-		"- タクティカルリロード時間(秒): 素1.44 白1.39 青1.34 紫1.3\n"
-		"- フルリロード時間(秒): 素2.03 白1.96 青1.89 紫1.83\n"
-		"- 弾速: 約596メートル/秒\n"
-		"- 初取り出しモーション時間: 1.0秒\n"
-		"- ヘッドショット有効距離: 38メートル\n"
-		"- ADS時移動速度倍率: x0.75"
-	),
-	"?CAR": (
-		"🔫 C.A.R. SMG\n"
-		"- 短縮名: CAR\n"
-		"- 武器種: サブマシンガン\n"
-		"- 使用アモ: ヘビーアモ/ライトアモ\n"
-		"- 製造元: 시완(Siwhan) Industries\n"
-		"- 射撃モード: フルオート\n"
-		"- 連射速度: 15.4発/秒\n"		
-		"- ダメージ: 素14 頭18 脚11\n"
-		"- 装填数: 素20 白23 青25 紫28\n"
-		"- タクティカルリロード時間(秒): 素1.70 白1.64 青1.59 紫1.53\n"
-		"- フルリロード時間(秒): 素2.13 白2.06 青1.99 紫1.92\n"
-		"- 弾速: 約456メートル/秒\n"
-		"- 初取り出しモーション時間: 1.1秒\n"
-		"- ヘッドショット有効距離: 38メートル\n"
-		"- ADS時移動速度倍率: x0.75"
-	),
-	"?ディヴォーション": (
-		"🔫 ディヴォーションLMG\n"
-		"- 短縮名: ディヴォーション\n"
-		"- 武器種: ライトマシンガン\n"
-		"- 使用アモ: エネルギーアモ\n"
-		"- 製造元: 不詳\n"
-		"- 射撃モード: フルオート\n"
-		"- 連射速度(初速): 5発/秒\n"
-		"- 連射速度(タボチャ初速): 6.8発/秒\n"
-		"- 連射速度(最大): 15発/秒\n"
-		"- 最大連射速度までの時間: 不詳\n"
-		"- 最大連射速度までの時間(タボチャ): 0.85秒\n"
-		"- ダメージ: 素16 頭20 脚14\n"
-		"- 装填数: 素36 白40 青44 紫52\n"
-		"- タクティカルリロード時間(秒): 素2.80 白2.71 青2.52 (紫 不詳)\n"
-		"- フルリロード時間(秒): 素3.63 白3.51 青3.27 (紫 不詳)\n"
-		"- 弾速: 約850メートル/秒\n"
-		"- 初取り出しモーション時間: 1.45秒\n"
-		"- ヘッドショット有効距離: 57メートル\n"
-		"- ADS時移動速度倍率: x0.4"
-	),
-	"?L-スター": (
-		"🔫 L-スターEMG\n"
-		"- 短縮名: L-スター\n"
-		"- 武器種: ライトマシンガン\n"
-		"- 使用アモ: エネルギーアモ\n"
-		"- 製造元: Wonyeon\n"
-		"- 射撃モード: フルオート\n"
-		"- 連射速度: 10発/秒\n"		
-		"- ダメージ: 素19 頭24 脚16\n"
-		"- 連射時オーバーヒートする弾数: 素24 白26 青28 紫30\n"
-		"- クールダウン開始時間: 0.08秒\n"
-		"- 標準ストック、拡張マガジンによるクールダウン率倍率: 素100% 白96.7% 青93.3% 紫(金)90%\n"
-		"- オーバーヒート時クール(秒): 素1.19 白1.15 青1.11 紫1.07 金0.83\n"
-		"- リロード時間(秒): 現在はなし、不詳\n"
-		"- 弾速: 約610メートル/秒\n"
-		"- 初取り出しモーション時間: 1.45秒\n"
-		"- ヘッドショット有効距離: 57メートル\n"
-		"- ADS時移動速度倍率: x0.4"
-	),
-	"?スピットファイア": (
-		"🔫 M600スピットファイア\n"
-		"- 短縮名: スピットファイア\n"
-		"- 武器種: ライトマシンガン\n"
-		"- 使用アモ: ライトアモ\n"
-		"- 製造元: 시완(Siwhan) Industries\n"
-		"- 射撃モード: フルオート\n"
-		"- 連射速度: 9発/秒\n"		
-		"- ダメージ: 素21 頭26 脚18\n"
-		"- 装填数: 素35 白40 青45 紫50\n"
-		"- タクティカルリロード時間(秒): 素3.40 白3.29 青3.17 紫3.06\n"
-		"- フルリロード時間(秒): 素4.20 白4.06 青3.92 紫3.78\n"
-		"- 弾速: 約697メートル/秒\n"
-		"- 初取り出しモーション時間: 1.45秒\n"
-		"- ヘッドショット有効距離: 57メートル\n"
-		"- ADS時移動速度倍率: x0.4"
-	),
-	"?ランページ": (
-		"🔫 ランページLMG\n"
-		"- 短縮名: ランページ\n"
-		"- 武器種: ライトマシンガン\n"
-		"- 使用アモ: ヘビーアモ\n"
-		"- 製造元(デザイナー): ランパート\n"
-		"- 製造元: SWCC\n"
-		"- 特殊ギミック: チャージ\n"
-		"- 射撃モード: フルオート\n"
-		"- 連射速度: 5発/秒\n"
-		"- 連射速度(チャージ時): 6.5発/秒\n"
-		"- ダメージ: 素29 頭36 脚25\n"
-		"- 装填数: 素28 白32 青36 紫40\n"
-		"- タクティカルリロード時間(秒): 素3.10 白3.00 青2.89 紫2.79\n"
-		"- フルリロード時間(秒): 素4.00 白3.87 青3.73 紫3.60\n"
-		"- チャージ時間: 3.7秒\n"
-		"- チャージ持続時間: 90秒\n"
-		"- チャージ時射撃1発ごとの持続時間減少量: 0.6秒/射撃\n"
-		"- 弾速: 約672メートル/秒\n"
-		"- 初取り出しモーション時間: 1.45秒\n"
-		"- ヘッドショット有効距離: 57メートル\n"
-		"- ADS時移動速度倍率: x0.4"
-	),
-	"?G7スカウト": (
-		"🔫 G7スカウト\n"
-		"- 短縮名: G7スカウト\n"
-		"- 武器種: マークスマン\n"
-		"- 使用アモ: ライトアモ\n"
-		"- 製造元: Lastimosa Armory\n"
-		"- 射撃モード: セミオート(/2点バースト)\n"
-		"- 連射速度: 3.9発/秒\n"
-		"- 連射速度(バースト): 10発/秒\n"
-		"- バースト射撃ディレイ: 0.375秒\n"
-		"- ダメージ: 素36 頭58 脚27\n"
-		"- 装填数: 素10 白15 青18 紫20\n"
-		"- タクティカルリロード時間(秒): 素2.40 白2.32 青2.24 紫2.16\n"
-		"- フルリロード時間(秒): 素3.00 白2.90 青2.80 紫2.70\n"
-		"- 弾速: 約761メートル/秒\n"
-		"- 初取り出しモーション時間: 1.42秒\n"
-		"- ヘッドショット有効距離: 450メートル\n"
-		"- ADS時移動速度倍率: x0.425"
-	),
-	"?トリプルテイク": (
-		"🔫 トリプルテイク\n"
-		"- 短縮名: トリプルテイク\n"
-		"- 武器種: マークスマン\n"
-		"- 使用アモ: ミシックエネルギーアモ (エネルギーアモ)\n"
-		"- 製造元: Burrell Defense\n"
-		"- 射撃モード: セミオート\n"
-		"- 連射速度: 1.75発/秒\n"
-		"- チョーク速度: 0.5秒\n"
-		"- ダメージ: 素23x3 頭37x3 脚21x3\n"
-		"- 装填数: 12発\n"
-		"- 予備弾薬: 72発\n"
-		"- タクティカルリロード時間(秒): 2.60\n"
-		"- フルリロード時間(秒): 3.40\n"
-		"- 弾速: 約812メートル/秒\n"
-		"- 初取り出しモーション時間: 1.42秒\n"
-		"- ヘッドショット有効距離: 450メートル\n"
-		"- ADS時移動速度倍率: x0.425"
-	),
-	"?30-30": (
-		"🔫 30-30リピーター\n"
-		"- 短縮名: G7スカウト\n"
-		"- 武器種: マークスマン\n"
-		"- 使用アモ: ヘビーアモ\n"
-		"- 製造元: Holdener Arms\n"
-		"- 射撃モード: セミオート\n"
-		"- 連射速度: 3.85発/秒\n"
-		"- チャージ時間: 0.35秒\n"
-		"- ADS後チャージ開始ディレイ: 0.3秒\n"
-		"- ダメージ: 素43~65 頭69~104 脚37~55\n"
-		"- スカピ装着時頭ダメージ: 86~130ダメージ\n"
-		"- 装填数: 素6 白7 青8 紫10\n"
-		"- リロード時間(1発目): (通常)0.33秒 (フル)0.75秒\n"
-		"- リロード時間: 0.4秒/1発\n"
-		"- 弾速: 約736メートル/秒\n"
-		"- 初取り出しモーション時間: 1.4秒\n"
-		"- ヘッドショット有効距離: 300メートル\n"
-		"- ADS時移動速度倍率: x0.425"
-	),
-	"?ボセック": (
-		"🏹 ボセックコンパウンドボウ\n"
-		"- 短縮名: ボセック\n"
-		"- 武器種: マークスマン\n"
-		"- 使用アモ: アロー\n"
-		"- 製造元: 不詳\n"
-		"- 射撃モード: セミオート\n"
-		"- 連射速度: 3.0発/秒\n"
-		"- 最大チャージ連射速度: 1.15発/秒\n"
-		"- チャージ時間: 0.54秒\n"
-		"- 射撃に必要な最低チャージ割合: 15%\n"
-		"- チャージレベル(0から5): 0%, 10%, 20%, 35%, 55%, 100%\n"
-		"- ADS後チャージ開始ディレイ: 0.3秒\n"
-		"- ダメージ(レベル1): 素35 頭56 脚28\n"
-		"- ダメージ(レベル2): 素42 頭67 脚33\n"
-		"- ダメージ(レベル3): 素47 頭75 脚37\n"
-		"- ダメージ(レベル4): 素54 頭86 脚43\n"
-		"- ダメージ(レベル5): 素65 頭106 脚52\n"
-		"- 装填数: 40発\n"
-		"- 弾速: 約254~711メートル/秒\n"
-		"- 初取り出しモーション時間: 1.4秒\n"
-		"- ヘッドショット有効距離: 300メートル\n"
-		"- ADS時移動速度倍率(Lv0~5): x0.85 x0.82 x0.78 x0.73 x0.66 x0.50"
-	),
-	"?チャージライフル": (
-		"🔫 チャージライフル\n"
-		"- 武器種: スナイパーライフル\n"
-		"- 使用アモ: スナイパーアモ\n"
-		"- 製造元: Vinson Dynamics\n"
-		"- 射撃モード: セミオート/フルオート\n"
-		"- 連射速度(セミオート): 0.43発/秒\n"
-		"- 連射速度(フルオート): 1.4発/秒\n"	
-		"- チャージ時間(セミオート): 0.85秒\n"
-		"- チャージ時間(フルオート): 約0.5秒\n"
-		"- ダメージ(セミオート): 素75-110 頭135-198 脚68-99\n"
-		"- ダメージ(フルオート): 素56-83 頭101-149 脚50-74\n"
-		"- 装填数: 素6 白7 青8 紫9\n"
-		"- タクティカルリロード時間(秒): 素3.50 白3.38 青3.27 紫3.15\n"
-		"- フルリロード時間(秒): 素4.60 白4.45 青4.29 紫4.14\n"
-		"- 弾速: 約864メートル/秒\n"
-		"- 初取り出しモーション時間: 1.5秒\n"
-		"- ヘッドショット有効距離: 不詳(おそらく無限)\n"
-		"- ADS時移動速度倍率: x0.35"
-	),
-	"?ロングボウ": (
-		"🔫 ロングボウDMR\n"
-		"- 武器種: スナイパーライフル\n"
-		"- 短縮名: ロングボウ\n"
-		"- 使用アモ: スナイパーアモ\n"
-		"- 製造元: Wonyeon\n"
-		"- 射撃モード: セミオート\n"
-		"- 連射速度: 1.3発/秒\n"
-		"- ダメージ *(スカピ): 素60 頭108(頭129) 脚48\n"
-		"- 装填数: 素6 白8 青10 紫12\n"
-		"- タクティカルリロード時間(秒): 素2.66 白2.58 青2.48 紫2.39\n"
-		"- フルリロード時間(秒): 素3.66 白3.54 青3.41 紫3.29\n"
-		"- 弾速: 約774メートル/秒\n"
-		"- 初取り出しモーション時間: 1.6秒\n"
-		"- ヘッドショット有効距離: 750メートル\n"
-		"- ADS時移動速度倍率: x0.35"
-	),
-	"?センチネル": (
-		"🔫 センチネル\n"
-		"- 武器種: スナイパーライフル\n"
-		"- 使用アモ: スナイパーアモ\n"
-		"- 製造元: Paradinha Arsenal\n"
-		"- 射撃モード: セミオート\n"
-		"- 連射速度: 約0.51発/秒\n"
-		"- リチャンバー時間: 1.6秒\n"
-		"- 増幅時間: 150秒\n"
-		"- 射撃による増幅時間の減少量: 14秒/発\n"
-		"- ダメージ(通常): 素70 頭126 脚63\n"
-		"- ダメージ(増幅): 素88 頭158 脚72\n"
-		"- 装填数: 素4 白5 青6 紫7\n"
-		"- タクティカルリロード時間(秒): 素3.00 白2.90 青2.80 紫2.70\n"
-		"- フルリロード時間(秒): 素4.00 白3.87 青3.73 紫3.60\n"
-		"- 弾速: 約787メートル/秒\n"
-		"- 初取り出しモーション時間: 1.6秒\n"
-		"- ヘッドショット有効距離: 750メートル\n"
-		"- ADS時移動速度倍率: x0.35"
-	),
-	"?クレーバー": (
-		"🔫 クレーバー.50スナイパー\n"
-		"- 武器種: スナイパーライフル\n"
-		"- 短縮名: クレーバー\n"
-		"- 使用アモ: ミシックスナイパーアモ\n"
-		"- 製造元: Lastimosa Armory\n"
-		"- 射撃モード: セミオート\n"
-		"- 連射速度: 約0.42発/秒\n"
-		"- リチャンバー時間: 1.6秒 (ADS中リチャンバー不可)\n"
-		"- ダメージ: 素150 頭210 脚120\n"
-		"- 装填数: 4発\n"
-		"- 予備弾薬数: 12発\n"
-		"- タクティカルリロード時間: 3.2秒\n"
-		"- フルリロード時間: 4.3秒\n"
-		"- 弾速: 約749メートル/秒\n"
-		"- 初取り出しモーション時間: 1.5秒\n"
-		"- ヘッドショット有効距離: 750メートル\n"
-		"- ADS時移動速度倍率: x0.35"
-	),
-	"?EVA-8": (
-		"🔫 EVA-8オート\n"
-		"- 武器種: ショットガン\n"
-		"- 短縮名: EVA-8\n"
-		"- 使用アモ: ショットガンシェル(アモ)\n"
-		"- 製造元: Wonyeon\n"
-		"- 射撃モード: フルオート\n"
-		"- 連射速度: 素3.1 白3.35 青約3.57 紫金3.85発/秒\n"
-		"- 発射ペレット数: 8ペレット\n"
-		"- １ペレット当りのダメージ: 6ダメージ\n"
-		"- 最大ダメージ: 48ダメージ\n"
-		"- 装填数: 8弾\n"
-		"- タクティカルリロード時間(秒): 素2.75 白2.65 青2.56 紫2.48\n"
-		"- フルリロード時間(秒): 素3.00 白2.9 青2.79 紫2.7\n"
-		"- 弾速: 約406メートル/秒\n"
-		"- 初取り出しモーション時間: 1.35秒\n"
-		"- ヘッドショット有効距離: 38メートル (ただし判定なし)\n"
-		"- ADS時移動速度倍率: x0.9"
-	),
-	"?マスティフ": (
-		"🔫 マスティフショットガン\n"
-		"- 武器種: ショットガン\n"
-		"- 短縮名: マスティフ\n"
-		"- 使用アモ: ショットガンシェル(アモ)\n"
-		"- 製造元: Lastimosa Armory\n"
-		"- 射撃モード: セミオート\n"
-		"- 連射速度: 素1.1 白約1.22 青約1.27 紫金約1.32発/秒\n"
-		"- 発射ペレット数: 6ペレット\n"
-		"- １ペレット当りのダメージ: 胴16ダメージ\n"
-		"- 最大ダメージ: 96ダメージ\n"
-		"- 装填数: 5弾\n"
-		"- タクティカルリロード時間(秒): 素2.75 白2.65 青2.56 紫2.48\n"
-		"- リロード時間(1発目): (通常)0.90秒 (フル)1.6秒\n"
-		"- リロード時間(2発目以降): 0.51秒/1発\n"
-		"- リロード時間(最後の1発): 0.55秒/1発\n"
-		"- 弾速: 約305メートル/秒\n"
-		"- 初取り出しモーション時間: 1.25秒\n"
-		"- ヘッドショット有効距離: 38メートル (ただし判定なし)\n"
-		"- ADS時移動速度倍率: x0.9"
-	),
-	"?モザンビーク": (
-		"🔫 モザンビークショットガン\n"
-		"＊アキンボ状態性能は下記参照\n"
-		"- 武器種: ショットガン\n"
-		"- 短縮名: モザンビーク\n"
-		"- 使用アモ: ショットガンシェル(アモ)\n"
-		"- 製造元: Altamirano Armory\n"
-		"- 射撃モード: フルオート\n"
-		"- 連射速度: 素約2.7 白約2.93 青約3.1 紫金3.2発/秒\n"
-		"- 発射ペレット数: 3ペレット\n"
-		"- １ペレット当りのダメージ: 素・脚17 頭21\n"
-		"- 胴体の最大ダメージ: 51ダメージ\n"
-		"- 装填数: 5弾\n"
-		"- タクティカルリロード時間(秒): 2.10秒\n"
-		"- フルリロード時間(秒): 2.60秒\n"
-		"- 弾速: 約254メートル/秒\n"
-		"- 初取り出しモーション時間: 1秒\n"
-		"- 取り出しモーション時間: 0.2秒\n"
-		"- ヘッドショット有効距離: 38メートル\n"
-		"- ADS時移動速度倍率: x1.0\n"
-		"- \n"
-		"🔫 モザンビーク-二丁拳銃\n"
-		"＊シングル状態性能は上記参照\n"
-		"- 武器種: ショットガン\n"
-		"- 短縮名: モザンビーク\n"
-		"- 使用アモ: ショットガンシェル(アモ)\n"
-		"- 製造元: Altamirano Armory\n"
-		"- 射撃モード: フルオート(二丁/シングル切替有)\n"
-		"- 連射速度: 素約2.92 白約3.22 青3.35 紫金3.5発/秒\n"
-		"- 発射ペレット数: 3ペレット\n"
-		"- １ペレット当りのダメージ: 素・脚17 頭21\n"
-		"- 胴体の最大ダメージ: 51ダメージ\n"
-		"- 装填数: 10弾\n"
-		"- タクティカルリロード時間(秒): 2.50秒\n"
-		"- フルリロード時間(秒): 3.00秒\n"
-		"- 弾速: 約254メートル/秒\n"
-		"- 初取り出しモーション時間: 1.09秒\n"
-		"- 取り出しモーション時間: 1秒\n"
-		"- ヘッドショット有効距離: 38メートル\n"
-		"- ADS時移動速度倍率: x1.0"
-		"- 備考: アキンボ状態時にADSすると、スコープは仕様不可だがペレットの拡散は狭まる。"
-	),
-	"?ピースキーパー": (
-		"🔫 ピースキーパー\n"
-		"- 武器種: ショットガン\n"
-		"- 短縮名: ピースキーパー\n"
-		"- 使用アモ: ミシックショットガンシェル\n"
-		"- 製造元: 不詳\n"
-		"- 射撃モード: セミオート\n"
-		"- 連射速度: 約0.83/秒\n"
-		"- リチャンバー時間: 0.95秒\n"		
-		"- 発射ペレット数: 9ペレット\n"
-		"- １ペレット当りのダメージ: 素・脚12ダメージ 頭15ダメージ\n"
-		"- 胴最大ダメージ: 108ダメージ\n"
-		"- チャージ速度: 0.6秒\n"
-		"- 装填数: 5弾^\n"
-		"- 予備弾薬数: 20弾^\n"
-		"- タクティカルリロード時間: 2.45秒\n"
-		"- フルリロード時間: 3.35秒\n"
-		"- 弾速: 約508メートル/秒\n"
-		"- 初取り出しモーション時間: 1.4秒\n"
-		"- ヘッドショット有効距離(通常): 100メートル\n"
-		"- ヘッドショット有効距離(チャージ時): 300メートル\n"
-		"- ADS時移動速度倍率: x0.9"
-	),
-	"?RE-45": (
-		"🔫 RE-45オート\n"
-		"- 短縮名: RE-45\n"
-		"- 武器種: ピストル\n"
-		"- 使用アモ: ライトアモ\n"
-		"- 製造元: Paradinha Arsenal\n"
-		"- 射撃モード: フルオート\n"
-		"- 連射速度: 9発/秒\n"		
-		"- ダメージ: 素14 頭18 脚12\n"
-		"- 装填数: 素20 白21 青23 紫26\n"
-		"- タクティカルリロード時間: 1.5秒\n"
-		"- フルリロード時間(秒): 1.95\n"
-		"- 弾速: 約495メートル/秒\n"
-		"- 初取り出しモーション時間: 1.1秒\n"
-		"- ヘッドショット有効距離: 38メートル\n"
-		"- ADS時移動速度倍率: x1.0"
-	),
-	"?P2020": (
-		"🔫 P2020\n"
-		"＊アキンボ状態性能は下記参照\n"
-		"- 武器種: ピストル\n"
-		"- 使用アモ: ライトアモ\n"
-		"- 製造元: Lastimosa Armory\n"
-		"- 射撃モード: セミオート\n"
-		"- 連射速度: 7発/秒\n"
-		"- ダメージ: 素24 頭30 脚22\n"
-		"- 装填数: 素8 白9 青10 紫11\n"
-		"- リロード時間: 1.25秒\n"
-		"- 弾速: 約470メートル/秒\n"
-		"- 初取り出しモーション時間: 1.1秒\n"
-		"- 取り出しモーション時間: 0.225秒\n"
-		"- ヘッドショット有効距離: 38メートル\n"
-		"- ADS時移動速度倍率: x1.0\n"
-		"- \n"
-		"🔫 P2020-二丁拳銃\n"
-		"- 短縮名: P2020\n"
-		"- 武器種: ピストル\n"
-		"- 使用アモ: ライトアモ\n"
-		"- 製造元: Lastimosa Armory\n"
-		"- 射撃モード: フルオート(二丁/シングル切替有)\n"
-		"- 連射速度: 8発/秒\n"
-		"- ダメージ: 素24 頭30 脚22\n"
-		"- 装填数: 素16 白18 青20 紫22\n"
-		"- タクティカルリロード時間(秒): 2.10秒\n"
-		"- フルリロード時間(秒): 2.60秒\n"
-		"- 弾速: 約470メートル/秒\n"
-		"- 初取り出しモーション時間: 1.2秒\n"
-		"- 取り出しモーション時間: 1秒\n"
-		"- ヘッドショット有効距離: 38メートル\n"
-		"- ADS時移動速度倍率: x1.0\n"
-		"- 備考: アキンボ状態時にADSすると、スコープは仕様不可だが弾の拡散は狭まる。"
-	),
-	"?ウィングマン": (
-		"🔫 ウィングマン\n"
-		"- 短縮名: ウィングマン\n"
-		"- 武器種: ピストル\n"
-		"- 使用アモ: スナイパーアモ\n"
-		"- 製造元: Paradinha Arsenal\n"
-		"- 射撃モード: フルオート\n"
-		"- 連射速度: 2.8発/秒\n"		
-		"- ダメージ*(スカピ): 素48 頭72(頭96) 脚43\n"
-		"- 装填数: 素5 白6 青7 紫8\n"
-		"- リロード時間: 2.1秒\n"
-		"- 弾速: 約457メートル/秒\n"
-		"- 初取り出しモーション時間: 1.45秒\n"
-		"- ヘッドショット有効距離: 254メートル\n"
-		"- ADS時移動速度倍率: x1.0"
-	)
-}
-
-# レジェンドの返答辞書
-LEGEND_RESPONSES = {
-	"?バンガロール": (
-		"バンガロール\n"
-		"「あなたの選んだ武器で、勝ってあげる。」\n"
-		"職業軍人\n"
-		"\n"
-		"本名: アニータ・ウィリアムズ\n"
-		"年齢: 40歳\n"
-		"生年: 2695年\n"
-		"性別: 女性\n"
-		"身長: 183cm\n"
-		"体重: 82kg\n"
-		"母星: グリッドアイアン\n"
-		"レジェンド説明文: 「?バンガロール説明文」で表示\n"
-		"\n"
-		"クラス: アサルト\n"
-		"パッシブアビリティ: 「駆け足」\n"
-		"スプリント中に被弾すると、移動速度が短時間向上する\n"
-		"(詳細な情報は「?駆け足」で表示)\n"
-		"\n"
-		"戦術アビリティ：「スモークランチャー」\n"
-		"発煙缶を高速射出し、着弾時の爆発で煙の壁を作り出す。\n"
-		"(詳細な情報は「?スモークランチャー」で表示)\n"
-		"\n"
-		"アルティメットアビリティ: 「ローリングサンダー」\n"
-		"一帯をゆっくりと巡る支援砲撃を要請する。\n"
-		"(詳細な情報は「?ローリングサンダー」で表示)"
-	)
-}
-
-# アビリティの返答辞書
-ABILITY_RESPONSES = {
-	"?駆け足": (
-		"バンガロールのパッシブアビリティ\n"
-		"スプリント中に被弾すると、移動速度が短時間向上する。\n"
-		"\n"
-		"発動条件: スプリント中に自身に攻撃が命中する\n"
-		"発動条件2: スプリント中に、敵の銃弾や手榴弾、アビリティなどが自身からおよそ半径5メートル以内を通過した際\n"
-		"効果時間: 2秒\n"
-		"移動速度倍率: x1.3\n"
-		"自我のおまけ情報: ジブのドームシールド(半径5m)内だとだいたい発動するよ！"
-	),
-	"?スモークランチャー": (
-		"バンガロールの戦術アビリティ\n"
-		"発煙缶を高速射出し、着弾時の爆発で煙の壁を作り出す。\n"
-		"\n"
-		"- 最大スタック数: 2\n"
-		"- クールタイム: 35秒 (対応アップグレード選択で-5秒)\n"
-		"- スモーク半径(1つ当り): 6.5m\n"
-		"- 効果時間: 8秒\n"
-		"- 起爆時のダメージ: 10\n"
-		"- 弾速(初速): 63.5メートル/毎秒\n"
-		"- 戦術ボタンを長押しで発射を遅らせることができる。\n"
-		"- コントローラーのエイムアシストを無効化することができる。\n"
-		"- 着弾後、発射方向垂直に３つに分裂し起爆する。\n"
-		"- 起爆から8秒経過後の3秒間ではわずかに薄くなるのみで視界不良は続き、次の1秒間で完全に消散する。\n"
-		"- 同じスモーク内の20m以内にいるプレイヤーのアウトラインを白く強調表示する。\n"
-		"- 基本スキャン効果のある能力を防ぐことはできない。"
-		"- 自我おまけ情報: 起爆後のスモークは半径6.5mの円形が3つ、それぞれ別の当たり判定(ゲーム内では見えないが内部で存在)になるため、スモーク内から同じスモーク内にいるように見える敵にからピンを刺しても敵ピンが刺さらなかったりする。\n"
-		" この各スモークの当たり判定は一方向なもので、外側から内側には壁があるように判定が遮断されるが、内側から外側へは遮断されない。\n"
-		" そのため、スモークの内側から敵ピンを連打すると(擬似的に)一方的に敵のことを視認できたり、スモークの内側から外側の敵を撃つ場合にはエイムアシストが発動する。"
-	),
-	"?ローリングサンダー": (
-		"バンガロールのアルティメットアビリティ\n"
-		"一帯をゆっくりと巡る支援砲撃を要請する。\n"
-		"発動するとフレア弾を構え、攻撃キーで投擲。\n"
-		"\n"
-		"- クールタイム: 270秒 (対応アップグレード選択で-60秒)\n"
-		"- 発動からリチャージ開始までの時間: 40秒\n"
-		"- 爆発時ダメージ: 30\n"
-		"- 爆発半径: 8.9メートル\n"
-		"- 設置ミサイル数: 36 (6x6)\n"
-		"- フレアの着弾2秒後から、前面およそ70mの範囲に規則的にミサイルを振り注ぎ、各ミサイルが着弾6秒後に爆発する。\n"
-		"- 爆発に巻き込まれると、ダメージに加え6秒間の移動速度低下(-25%)と視界不良を受ける。\n"
-		"- 爆発は自分に当たる。味方に当たった際ははダメージ以外の効果を与える。"
-	)
-}
-
-#武器返信の添付画像
-WEAPON_IMAGES = {
-	"?ハボック": "https://apexlegends.wiki.gg/images/e/ec/HAVOC_Rifle.png",
-	"?ヘムロック": "https://apexlegends.wiki.gg/images/7/74/Hemlok_Burst_AR.png",
-	"?フラットライン": "https://apexlegends.wiki.gg/images/f/f1/VK-47_Flatline.png",
-	"?R-301": "https://apexlegends.wiki.gg/images/f/f1/R-301_Carbine.png",
-	"?ネメシス": "https://apexlegends.wiki.gg/images/b/b8/Nemesis_Burst_AR.png",
-	"?オルタネーター": "https://apexlegends.wiki.gg/images/e/e9/Alternator_SMG.png",
-	"?プラウラー": "https://apexlegends.wiki.gg/images/b/bf/Prowler_Burst_PDW.png",
-	"?R-99": "https://apexlegends.wiki.gg/images/d/d5/R-99_SMG.png",
-	"?ボルト": "https://apexlegends.wiki.gg/images/6/60/Volt_SMG.png",
-	"?CAR": "https://apexlegends.wiki.gg/images/1/13/C.A.R._SMG.png",
-	"?ディヴォーション": "https://apexlegends.wiki.gg/images/8/8c/Devotion_LMG.png",
-	"?L-スター": "https://apexlegends.wiki.gg/images/0/01/L-STAR_EMG.png",
-	"?スピットファイア": "https://apexlegends.wiki.gg/images/f/f2/M600_Spitfire.png",
-	"?ランページ": "https://apexlegends.wiki.gg/images/2/20/Rampage_LMG.png",
-	"?G7スカウト": "https://apexlegends.wiki.gg/images/e/eb/G7_Scout.png",
-	"?トリプルテイク": "https://apexlegends.wiki.gg/images/d/d9/Triple_Take.png",
-	"?30-30": "https://apexlegends.wiki.gg/images/8/86/30-30_Repeater.png",
-	"?ボセック": "https://apexlegends.wiki.gg/images/0/02/Bocek_Compound_Bow.png",
-	"?チャージライフル": "https://apexlegends.wiki.gg/images/2/2b/Charge_Rifle.png",
-	"?ロングボウ": "https://apexlegends.wiki.gg/images/4/46/Longbow_DMR.png",
-	"?センチネル": "https://apexlegends.wiki.gg/images/9/91/Sentinel.png",
-	"?クレーバー": "https://apexlegends.wiki.gg/images/f/f5/Kraber_.50-Cal_Sniper.png",
-	"?EVA-8": "https://apexlegends.wiki.gg/images/9/97/EVA-8_Auto.png",
-	"?マスティフ": "https://apexlegends.wiki.gg/images/c/c9/Mastiff_Shotgun.png",
-	"?モザンビーク": "https://apexlegends.wiki.gg/images/a/ae/Mozambique_Shotgun.png",
-	"?ピースキーパー": "https://apexlegends.wiki.gg/images/6/64/Peacekeeper.png",
-	"?RE-45": "https://apexlegends.wiki.gg/images/2/25/RE-45_Auto.png",
-	"?P2020": "https://apexlegends.wiki.gg/images/c/c1/P2020.png",
-	"?ウィングマン": "https://apexlegends.wiki.gg/images/0/09/Wingman.png",
-	# 必要に応じて追加
-}
-
-#レジェンド返信の添付画像
-LEGEND_IMAGES = {
-	# "?ハボック": "https://apexlegends.wiki.gg/images/e/ec/HAVOC_Rifle.png",
-	# a
-}
-
-#レジェンド返信の添付画像
-ABILITY_IMAGES = {
-	# "?駆け足": "https://apexlegends.wiki.gg/images/e/ec/HAVOC_Rifle.png",
-}
+# イベントの種類 → 処理関数（キューのワーカーがパース済みのイベントをここから振り分ける）
+handlers = EventHandlers()
+# 署名検証とパースを別々に測れるよう、検証は parse_webhook() で済ませてからこちらでパースする
+signature_validator = SignatureValidator(channel_secret)
+payload_parser = WebhookParser(channel_secret, skip_signature_verification=lambda: True)
+# LINE_API_ENDPOINT は負荷試験でスタブサーバーに向けるときだけ指定する
+configuration = Configuration(access_token=channel_access_token, host=os.getenv("LINE_API_ENDPOINT"))
+# 返信で同時に使う接続数（ワーカーのスレッド数に合わせる）
+configuration.connection_pool_maxsize = int(os.getenv("LINE_API_POOL_SIZE", "10"))
+
+# LINE Messaging API のクライアントはプロセスで1つだけ作り、全イベントで使い回す
+api_client = ApiClient(configuration)
+line_bot_api = MessagingApi(api_client)
+
+def close_line_api_client():
+	api_client.close()
+	api_client.rest_client.pool_manager.clear()
+
+atexit.register(close_line_api_client)
+
+# ?マップ はローテーションが切り替わるまで同じ結果を使い回す
+map_rotation_cache = MapRotationCache(lambda: fetch_map_rotation(os.getenv("APEX_API_KEY")))
+# ?ボーダー は一定時間キャッシュし、同時アクセスは1回の取得にまとめる
+predator_border_cache = PredatorBorderCache(lambda: fetch_predator_border(os.getenv("APEX_API_KEY")))
+# バックグラウンドで ?マップ / ?ボーダー を先読みしておく（APEX_PREFETCH=0 で無効）
+APEX_PREFETCH_ENABLED = os.getenv("APEX_PREFETCH", "1") != "0"
+apex_prefetcher = ApexPrefetcher(map_rotation_cache, predator_border_cache)
+
+# Webhook のイベントはキューに積んでワーカースレッドで処理する（WEBHOOK_WORKERS=0 でその場で処理）
+event_queue = WebhookEventQueue(
+	handlers,
+	workers=int(os.getenv("WEBHOOK_WORKERS", "4")),
+	maxsize=int(os.getenv("WEBHOOK_QUEUE_SIZE", "100")),
+	put_timeout=float(os.getenv("WEBHOOK_QUEUE_TIMEOUT", "0.5")),
+)
 
-def translate_map_name(name):
-	return MAP_TRANSLATIONS.get(name, name)
+def start_workers():
+	"""先読みと Webhook ワーカーのスレッドを起動する（python app.py のときだけ。ASGI 版は自前で行う）"""
+	if APEX_PREFETCH_ENABLED:
+		apex_prefetcher.start()
+	event_queue.start()
+	# 終了時はキューに残ったイベントを処理してから止める（LINE クライアントより先に実行される）
+	atexit.register(event_queue.shutdown, float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "20")))
+
+# /metrics で出すメトリクス（command はコマンドの振り分けのキー。辞書引きなどは "(fallback)"）
+command_seconds = metrics.histogram(
+	"bot_command_duration_seconds", "コマンドの処理時間（LINE への返信は含まない）", ("command",))
+command_errors = metrics.counter("bot_command_errors_total", "例外で終わったコマンドの数", ("command",))
+line_reply_seconds = metrics.histogram("bot_line_reply_duration_seconds", "LINE の返信 API の呼び出し時間", ("kind",))
+line_reply_errors = metrics.counter("bot_line_reply_errors_total", "LINE の返信 API の失敗数", ("kind",))
+metrics.gauge("bot_webhook_queue_depth", "処理待ちの Webhook ペイロード数", lambda: event_queue.depth)
 
 @app.route("/callback", methods=['POST'])
 def callback():
 	signature = request.headers['X-Line-Signature']
 	body = request.get_data(as_text=True)
-	app.logger.info("Request body: " + body)
 
+	# 署名検証とパースだけ行い、処理はワーカーに任せてすぐに返す
+	trace = tracing.start_trace()
 	try:
-		handler.handle(body, signature)
+		with tracing.activate(trace):
+			payload = parse_webhook(body, signature)
 	except InvalidSignatureError:
 		abort(400)
+	# 本文にはメッセージがそのまま入っているので、LOG_PAYLOAD_SAMPLE_RATE の割合だけ出す
+	log_payload(app.logger, "Webhook の本文", body)
+
+	if not event_queue.submit(payload, trace):
+		app.logger.warning("イベントを受け付けられませんでした（キュー: %d件）", event_queue.depth)
+		abort(503)
 
 	return "OK"
 
-@handler.add(MessageEvent, message=TextMessageContent)
+def parse_webhook(body, signature):
+	"""署名を検証して WebhookPayload を返す（署名が合わなければ InvalidSignatureError）"""
+	with span("verify"):
+		valid = signature_validator.validate(body, signature)
+	if not valid:
+		raise InvalidSignatureError("Invalid signature. signature=" + signature)
+	with span("parse"):
+		return payload_parser.parse(body, signature, as_payload=True)
+
+@app.route("/metrics")
+def export_metrics():
+	if not metrics.authorized(request.headers.get("Authorization")):
+		abort(401)
+	return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@handlers.add(MessageEvent, message=TextMessageContent)
 def handle_message(event):
-	user_message = event.message.text
-	messages = None  # 最初に定義しておく
-
-	with ApiClient(configuration) as api_client:
-		line_bot_api = MessagingApi(api_client)
-
-		# ?マップの処理
-		if user_message == "?マップ":
-			api_key = os.getenv("APEX_API_KEY")
-			url = f"https://api.mozambiquehe.re/maprotation?auth={api_key}&version=2"
-
-			try:
-				response = requests.get(url)
-				data = response.json()
-				app.logger.info("APIレスポンス: %s", data)
-
-				reply_lines = []
-
-				if "battle_royale" in data:
-					br = data["battle_royale"]
-					reply_lines.append("\U0001F5FA カジュアル")
-					reply_lines.append(f"現在のマップ: {translate_map_name(br['current']['map'])}（あと{br['current']['remainingTimer']}）")
-					reply_lines.append(f"次のマップ: {translate_map_name(br['next']['map'])}")
-					reply_lines.append("")
-
-				if "ranked" in data:
-					rk = data["ranked"]
-					reply_lines.append("\U0001F3C6 ランクリーグ")
-					reply_lines.append(f"現在のマップ: {translate_map_name(rk['current']['map'])}（あと{rk['current']['remainingTimer']}）")
-					reply_lines.append(f"次のマップ: {translate_map_name(rk['next']['map'])}")
-					reply_lines.append("")
-
-				if "ltm" in data:
-					ltm = data["ltm"]
-					cur_mode = ltm["current"]
-					next_mode = ltm["next"]
-					known_mix = ["Control", "Gun Run", "Team Deathmatch"]
-					if cur_mode["eventName"] in known_mix:
-						reply_lines.append("\U0001F3AE ミックステープ")
-						reply_lines.append(f"現在のモード: {translate_map_name(cur_mode['eventName'])}（マップ: {translate_map_name(cur_mode['map'])}、あと{cur_mode['remainingTimer']}）")
-						reply_lines.append(f"次のモード: {translate_map_name(next_mode['eventName'])}（マップ: {translate_map_name(next_mode['map'])}）")
-						reply_lines.append("")
-					else:
-						reply_lines.append("⏱ 期間限定モード")
-						reply_lines.append(f"現在: {translate_map_name(cur_mode['eventName'])}（マップ: {translate_map_name(cur_mode['map'])}、あと{cur_mode['remainingTimer']}）")
-						reply_lines.append(f"次: {translate_map_name(next_mode['eventName'])}（マップ: {translate_map_name(next_mode['map'])}）")
-						reply_lines.append("")
-				else:
-					reply_lines.append("⏱ 期間限定モード")
-					reply_lines.append("現在: ❌ 開催されていません")
-
-				reply_text = "\n".join(reply_lines)
-				messages = [TextMessage(text=reply_text)]
-
-			except Exception as e:
-				app.logger.error(f"APIエラー: {e}")
-				messages = [TextMessage(text="APIの取得に失敗しました。後でもう一度試してください。")]
-
-		# プレデターボーダー表示
-		elif user_message == "?ボーダー":
-			api_key = os.getenv("APEX_API_KEY")
-			try:
-				border_text = fetch_predator_border(api_key)
-				messages = [TextMessage(text=border_text)]
-			except Exception as e:
-				app.logger.error("ボーダー取得エラー: %s", e)
-				messages = [TextMessage(text="プレデターボーダーの取得に失敗しました。後でもう一度試してください。")]
-
-		# 武器情報の応答
-		elif user_message in WEAPON_RESPONSES:
-			reply_text = WEAPON_RESPONSES[user_message]
-			messages = [TextMessage(text=reply_text)]
-			image_url = WEAPON_IMAGES.get(user_message)
-			if image_url:
-				messages.append(ImageMessage(
-					original_content_url=image_url,
-					preview_image_url=image_url
-				))
-				
-		# レジェンド情報の応答
-		elif user_message in LEGEND_RESPONSES:
-			reply_text = LEGEND_RESPONSES[user_message]
-			messages = [TextMessage(text=reply_text)]
-			image_url = LEGEND_IMAGES.get(user_message)
-			if image_url:
-				messages.append(ImageMessage(
-					original_content_url=image_url,
-					preview_image_url=image_url
-				))
-				
-		# アビリティ情報の応答
-		elif user_message in ABILITY_RESPONSES:
-			reply_text = ABILITY_RESPONSES[user_message]
-			messages = [TextMessage(text=reply_text)]
-			# image_url = ABILITY_IMAGES.get(user_message)
-			# if image_url:
-			#	messages.append(ImageMessage(
-			#		original_content_url=image_url,
-			#		preview_image_url=image_url
-			#	))
-
-		# 辞書機能の処理
-		elif user_message.startswith("辞書 "):
-		    args = user_message.split(maxsplit=2)
-		    if len(args) < 2:
-		        messages = [TextMessage(text="辞書コマンドの形式が正しくありません。")]
-		    else:
-		        subcmd = args[1]
-		        # 追加コマンド
-		        if subcmd == "追加" and len(args) == 3:
-		            parts = args[2].split(maxsplit=1)
-		            if len(parts) < 2:
-		                messages = [TextMessage(text="「辞書 追加 単語 内容」の形式で送信してください。")]
-		            else:
-		                term = parts[0]
-		                content = parts[1]
-		                is_private = False
-		                if content.endswith("--s") or content.endswith("-self"):
-		                    is_private = True
-		                    content = content.rsplit(maxsplit=1)[0]  # 最後の --s を除去
-		                add_dictionary_entry(term, content, event.source.user_id, is_private)
-		                messages = [TextMessage(text=f"「{term}」を辞書に追加しました。{'（自分専用）' if is_private else ''}")]
-		        # 削除コマンド
-		        elif subcmd == "削除" and len(args) == 3:
-		            term = args[2]
-		            if delete_dictionary_entry(term, event.source.user_id):
-		                messages = [TextMessage(text=f"「{term}」を削除しました。")]
-		            else:
-		                messages = [TextMessage(text=f"削除できませんでした。自分が追加した単語のみ削除できます。")]
-		        else:
-		            messages = [TextMessage(text="「辞書 追加 単語 内容」または「辞書 削除 単語」の形式で送信してください。")]
-
-		# 📌 呼び出し機能（単語だけ送信）
-		elif True:
-		    conn = get_db_connection()
-		    cursor = conn.cursor()
-		    term = user_message.strip()
-		    user_id = event.source.user_id
-		
-		    cursor.execute(
-		        "SELECT content FROM dictionary WHERE term = ? AND (is_private = 0 OR added_by = ?)",
-		        (term, user_id)
-		    )
-		    row = cursor.fetchone()
-		    conn.close()
-		
-		    if row:
-		        reply_text = f"{term}：{row['content']}"
-		        messages = [TextMessage(text=reply_text)]
-
-		# 「辞書」のみ または 「辞書 [頭文字] [ページ数]」で一覧表示
-		elif user_message.strip().startswith("辞書"):
-		    match = re.match(r"辞書(?:\s+([^\d\s])?)?(?:\s+(\d+))?", user_message.strip())
-		    initial = match.group(1) if match else None
-		    page = int(match.group(2)) if match and match.group(2) else 1
-		
-		    conn = get_db_connection()
-		    cursor = conn.cursor()
-		    user_id = event.source.user_id
-		
-		    # 条件付きクエリ作成
-		    sql = "SELECT term, content, added_by, is_private FROM dictionary WHERE (is_private = 0 OR added_by = ?)"
-		    params = [user_id]
-		    if initial:
-		        sql += " AND term LIKE ?"
-		        params.append(initial + "%")
-		    
-		    sql += " ORDER BY term ASC"
-		    cursor.execute(sql, params)
-		    rows = cursor.fetchall()
-		    conn.close()
-		
-		    if not rows:
-		        messages = [TextMessage(text="一致する単語が見つかりませんでした。")]
-		    else:
-		        per_page = 10
-		        total_pages = (len(rows) + per_page - 1) // per_page
-		        page = max(1, min(page, total_pages))
-		        start = (page - 1) * per_page
-		        end = start + per_page
-		        display_rows = rows[start:end]
-		
-		        reply_lines = [f"📘 登録単語一覧（{page}/{total_pages}ページ）"]
-		        for row in display_rows:
-		            privacy = "（自分専用）" if row["is_private"] and row["added_by"] == user_id else ""
-		            if not row["is_private"] or row["added_by"] == user_id:
-		                reply_lines.append(f"・{row['term']}：{row['content']}{privacy}")
-		        messages = [TextMessage(text="\n".join(reply_lines))]
-
-		if user_message == "時間割":
-			reply_text = (
-				"月曜日の時間割は、\n"
-				"1,理科\n"
-				"2,音楽\n"
-				"3,英語\n"
-				"4,社会\n"
-				"5,国語\n"
-				"6,総合\n"
-				" \n"
-				"火曜日の時間割は、\n"
-				"1,数学\n"
-				"2,理科\n"
-				"3,英語\n"
-				"4,書写\n"
-				"5,保健体育\n"
-				"6,学活\n"
-				" \n"
-				"水曜日の時間割は、\n"
-				"1,美術\n"
-				"2,社会\n"
-				"3,国語\n"
-				"4,数学\n"
-				"5,理科\n"
-				"6,道徳\n"
-				" \n"
-				"木曜日の時間割は、\n"
-				"1,社会\n"
-				"2,数学\n"
-				"3,体育\n"
-				"4,体育\n"
-				"5,英語\n"
-				"6,総合\n"
-				"\n"
-				"金曜日の時間割は、\n"
-				"1,数学\n"
-				"2,国語\n"
-				"3,家庭科\n"
-				"4,技術\n"
-				"5,英語\n"
-				"6,なし\n"
-				"\n"
-				"となっております♪\n"
-				"特別授業や変更となっている日は 、\n"
-				"他の人に聞いたり教えたりしてくださいね。"
-			)
-			messages = [TextMessage(text=reply_text)]
-		
-		elif user_message == "?ヘルプ":
-			reply_text = (
-				"使用できるコマンド一覧：\n"
-				"・?ヘルプ - コマンドの一覧を表示\n"
-				"・?マップ - 現在のカジュアル・ランク・ミックステープのマップを表示\n"
-				"以下武器情報表示\n"
-				"・?ハボック ・?フラットライン\n"
-				"・?ヘムロック ・?R-301\n"
-				"・?ネメシス\n"
-				"・?オルタネーター ・?プラウラー\n"
-				"・?R-99 ・?ボルト\n"
-				"・?CAR\n"
-				"・?ディヴォーション ・?L-スター\n"
-				"・?スピットファイア ・?ランページ\n"
-				"・?G7スカウト ・?トリプルテイク\n"
-				"・?30-30 ・?ボセック\n"
-				"・?チャージライフル ・?ロングボウ\n"
-				"・?クレーバー ・?センチネル\n"
-				"・?EVA-8 ・?マスティフ\n"
-				"・?ピースキーパー ・?モザンビーク\n"
-				"・?RE-45 ・?ウィングマン"
-			)
-			messages = [TextMessage(text=reply_text)]
-				
-		# messages が定義された場合のみ返信
-		if messages:
+	messages = build_reply(event)
+
+	# 静的な返信は組み立て済みの JSON をそのまま送る
+	if isinstance(messages, PrebuiltReply):
+		with line_reply_seconds.time("prebuilt", errors=line_reply_errors), span("line_reply"):
+			send_prebuilt_reply(api_client, event.reply_token, messages)
+	# messages が定義された場合のみ返信
+	elif messages:
+		with line_reply_seconds.time("sdk", errors=line_reply_errors), span("line_reply"):
 			line_bot_api.reply_message(
 				ReplyMessageRequest(
 					reply_token=event.reply_token,
@@ -1149,12 +157,300 @@ def handle_message(event):
 				)
 			)
 
+def build_reply(event):
+	"""
+	テキストメッセージに対する返信メッセージのリストを返す（返信しない場合は None）。
+	静的なコマンドは起動時に組み立て済みの PrebuiltReply を返す。
+	"""
+	func, arg, command = command_router.match(event.message.text)
+	if func is None:
+	    return None
+	return run_command(func, event, arg, command)
+
+def run_command(func, event, arg, command):
+	"""command_router.match() で当たった処理関数を、ログとメトリクスを付けて実行する"""
+	# ログとメトリクスには当たったコマンド（「辞書 追加 」など）だけを残し、発言そのものは残さない
+	command = command or "(fallback)"
+	add_log_context(command=command)
+	with command_seconds.time(command, errors=command_errors), span("dispatch"):
+	    return func(event, arg)
+
+# メッセージ → 処理関数の振り分け表（完全一致は dict、引数付きコマンドは接頭辞で引く）
+command_router = CommandRouter()
+
+# DB や上流 API を待たずに返せる処理関数 → 今そうなっているかを返す関数
+_inline_commands = {}
+
+def inline_command(ready=None):
+	"""待たずに返せる処理関数として登録するデコレーター（ready を渡すと、それが真のときだけ）"""
+	def decorator(func):
+	    _inline_commands[func] = ready or (lambda: True)
+	    return func
+	return decorator
+
+def runs_inline(func):
+	"""処理関数がその場で返せるか。ASGI 版はこれが偽のもの（辞書や Apex API の取得）だけをスレッドで実行する。"""
+	ready = _inline_commands.get(func)
+	return ready is not None and ready()
+
+# ?マップの処理
+@command_router.command("?マップ")
+@inline_command(map_rotation_cache.cached)
+def reply_map_rotation(event, key):
+	try:
+		data, now, stale = map_rotation_cache.get()
+		reply_text = build_map_rotation_text(data, now)
+		if stale:
+			reply_text += STALE_NOTICE
+		return [TextMessage(text=reply_text)]
+
+	except Exception as e:
+		app.logger.error(f"APIエラー: {e}")
+		return [TextMessage(text="APIの取得に失敗しました。後でもう一度試してください。")]
+
+# プレデターボーダー表示
+@command_router.command("?ボーダー")
+@inline_command(predator_border_cache.fresh)
+def reply_predator_border(event, key):
+	try:
+		border_text, stale = predator_border_cache.get()
+		if stale:
+			border_text += STALE_NOTICE
+		return [TextMessage(text=border_text)]
+	except Exception as e:
+		app.logger.error("ボーダー取得エラー: %s", e)
+		return [TextMessage(text="プレデターボーダーの取得に失敗しました。後でもう一度試してください。")]
+
+# 静的な返信はメッセージの検証と JSON 化を起動時に済ませておき、毎回同じものを返す
+def reply_static(reply, event, key):
+	return reply
+
+def add_static_command(key, reply):
+	command_router.add(key, inline_command()(partial(reply_static, reply)))
+
+# 武器・レジェンド・アビリティ情報の応答（画像があれば一緒に送る）
+def build_entry_reply(text, image_url):
+	messages = [TextMessage(text=text)]
+	if image_url:
+		messages.append(ImageMessage(
+			original_content_url=image_url,
+			preview_image_url=image_url
+		))
+	return prebuild_reply(messages)
+
+# データは data/knowledge.json から最初に引かれたときに読み込み、ファイルが更新されたら読み直す
+knowledge_base = KnowledgeBase(build=build_entry_reply)
+
+@inline_command()
+def reply_knowledge(event, key):
+	return knowledge_base.get(key)
+
+command_router.add_table(knowledge_base, reply_knowledge)
+
+TIMETABLE_TEXT = (
+		"月曜日の時間割は、\n"
+		"1,理科\n"
+		"2,音楽\n"
+		"3,英語\n"
+		"4,社会\n"
+		"5,国語\n"
+		"6,総合\n"
+		" \n"
+		"火曜日の時間割は、\n"
+		"1,数学\n"
+		"2,理科\n"
+		"3,英語\n"
+		"4,書写\n"
+		"5,保健体育\n"
+		"6,学活\n"
+		" \n"
+		"水曜日の時間割は、\n"
+		"1,美術\n"
+		"2,社会\n"
+		"3,国語\n"
+		"4,数学\n"
+		"5,理科\n"
+		"6,道徳\n"
+		" \n"
+		"木曜日の時間割は、\n"
+		"1,社会\n"
+		"2,数学\n"
+		"3,体育\n"
+		"4,体育\n"
+		"5,英語\n"
+		"6,総合\n"
+		"\n"
+		"金曜日の時間割は、\n"
+		"1,数学\n"
+		"2,国語\n"
+		"3,家庭科\n"
+		"4,技術\n"
+		"5,英語\n"
+		"6,なし\n"
+		"\n"
+		"となっております♪\n"
+		"特別授業や変更となっている日は 、\n"
+		"他の人に聞いたり教えたりしてくださいね。"
+)
+
+HELP_TEXT = (
+		"使用できるコマンド一覧：\n"
+		"・?ヘルプ - コマンドの一覧を表示\n"
+		"・?マップ - 現在のカジュアル・ランク・ミックステープのマップを表示\n"
+		"以下武器情報表示\n"
+		"・?ハボック ・?フラットライン\n"
+		"・?ヘムロック ・?R-301\n"
+		"・?ネメシス\n"
+		"・?オルタネーター ・?プラウラー\n"
+		"・?R-99 ・?ボルト\n"
+		"・?CAR\n"
+		"・?ディヴォーション ・?L-スター\n"
+		"・?スピットファイア ・?ランページ\n"
+		"・?G7スカウト ・?トリプルテイク\n"
+		"・?30-30 ・?ボセック\n"
+		"・?チャージライフル ・?ロングボウ\n"
+		"・?クレーバー ・?センチネル\n"
+		"・?EVA-8 ・?マスティフ\n"
+		"・?ピースキーパー ・?モザンビーク\n"
+		"・?RE-45 ・?ウィングマン"
+)
+
+add_static_command("時間割", prebuild_reply([TextMessage(text=TIMETABLE_TEXT)]))
+add_static_command("?ヘルプ", prebuild_reply([TextMessage(text=HELP_TEXT)]))
+
+# 辞書機能の処理
+# 辞書に無い言葉が送られたときに近い単語を「もしかして」で出すか
+SUGGEST_ON_MISS = os.getenv("DICTIONARY_SUGGEST_ON_MISS", "0") == "1"
+SUGGEST_MIN_LENGTH = 3
+
+@command_router.prefix("辞書 追加 ")
+def reply_dictionary_add(event, arg):
+	parts = arg.split(maxsplit=1)
+	if len(parts) < 2:
+	    return [TextMessage(text="「辞書 追加 単語 内容」の形式で送信してください。")]
+	term = parts[0]
+	content = parts[1]
+	is_private = False
+	if content.endswith("--s") or content.endswith("-self"):
+	    is_private = True
+	    content = content.rsplit(maxsplit=1)[0]  # 最後の --s を除去
+	add_dictionary_entry(term, content, event.source.user_id, is_private)
+	return [TextMessage(text=f"「{term}」を辞書に追加しました。{'（自分専用）' if is_private else ''}")]
+
+@command_router.prefix("辞書 削除 ")
+def reply_dictionary_delete(event, term):
+	# 「辞書 削除  foo」のように空白が続いても、前の形（split() で区切る）と同じく foo を消す
+	term = term.strip()
+	user_id = event.source.user_id
+	deleted = delete_dictionary_entry(term, user_id)
+	if deleted is not None:
+	    return [TextMessage(text=f"「{term}」を削除しました。{'（自分専用）' if deleted else ''}")]
+	# 他の人が公開した単語は、削除の票が集まったら消す
+	vote = vote_dictionary_delete(term, user_id)
+	if vote is None:
+	    return [TextMessage(text=f"削除できませんでした。自分が追加した単語のみ削除できます。")]
+	voted, votes = vote
+	if votes >= DICTIONARY_DELETE_VOTES:
+	    return [TextMessage(text=f"「{term}」の削除の票が{DICTIONARY_DELETE_VOTES}票集まったので削除しました。")]
+	if not voted:
+	    return [TextMessage(text=f"「{term}」の削除にはすでに投票しています。（{votes}/{DICTIONARY_DELETE_VOTES}票）")]
+	return [TextMessage(text=f"「{term}」の削除に投票しました。（{votes}/{DICTIONARY_DELETE_VOTES}票）")]
+
+# 「辞書 検索 語」で単語と内容から探す（空白で区切ると、すべてを含むものを探す）
+@command_router.prefix("辞書 検索 ")
+def reply_dictionary_search(event, query):
+	query = query.strip()
+	user_id = event.source.user_id
+	rows = search_dictionary_entries(query, user_id)
+
+	if not rows:
+	    reply_text = f"「{query}」に一致する単語が見つかりませんでした。"
+	    suggestions = suggest_dictionary_terms(query, user_id)
+	    if suggestions:
+	        reply_text += "\nもしかして: " + " ".join(f"「{term}」" for term in suggestions)
+	    return [TextMessage(text=reply_text)]
+
+	reply_lines = [f"🔍「{query}」の検索結果"]
+	for row in rows:
+	    privacy = "（自分専用）" if row["is_private"] else ""
+	    reply_lines.append(f"・{row['term']}：{shorten(row['content'])}{privacy}")
+	return [TextMessage(text="\n".join(reply_lines))]
+
+# 検索結果では長い内容を1行に収める
+def shorten(text, width=40):
+	text = " ".join(text.split())
+	return text if len(text) <= width else text[:width - 1] + "…"
+
+# 「辞書 」で始まるがサブコマンドの形に合わないもの（「辞書  追加」のように「辞書」の後の空白が
+# 連続している場合もここで拾い直す。サブコマンドの後の空白は、それぞれの処理で詰める）
+# 「辞書 [頭文字] [ページ数]」の一覧表示もここから振り分ける
+@command_router.prefix("辞書 ")
+def reply_dictionary_command(event, arg):
+	args = arg.split(maxsplit=1)
+	if len(args) < 1:
+	    return [TextMessage(text="辞書コマンドの形式が正しくありません。")]
+	subcmd = args[0]
+	if subcmd == "追加" and len(args) == 2:
+	    return reply_dictionary_add(event, args[1])
+	if subcmd == "削除" and len(args) == 2:
+	    return reply_dictionary_delete(event, args[1])
+	if subcmd == "検索" and len(args) == 2:
+	    return reply_dictionary_search(event, args[1])
+	if subcmd == "検索":
+	    return [TextMessage(text="「辞書 検索 語」の形式で送信してください。")]
+	if subcmd not in ("追加", "削除"):
+	    messages = reply_dictionary_list(event, arg)
+	    if messages is not None:
+	        return messages
+	return [TextMessage(text="「辞書 追加 単語 内容」または「辞書 削除 単語」の形式で送信してください。")]
+
+# 📌 呼び出し機能（単語だけ送信）
+@command_router.fallback
+def reply_dictionary_lookup(event, term):
+	# 登録されていない言葉（普通の会話）はメモリ上のキャッシュだけで判定する
+	content = lookup_dictionary_entry(term, event.source.user_id)
+
+	if content is not None:
+	    reply_text = f"{term}：{content}"
+	    return [TextMessage(text=reply_text)]
+
+	# 普通の会話にまで反応しないよう、既定では「もしかして」は出さない
+	if SUGGEST_ON_MISS and len(term) >= SUGGEST_MIN_LENGTH:
+	    suggestions = suggest_dictionary_terms(term, event.source.user_id)
+	    if suggestions:
+	        return [TextMessage(text="もしかして: " + " ".join(f"「{s}」" for s in suggestions))]
+	return None
+
+# 「辞書」のみ または 「辞書 [頭文字] [ページ数]」で一覧表示
+DICTIONARY_LIST_ARGS = re.compile(r"(?:([^\d\s])(?:\s+|$))?(\d+)?")
+
+@command_router.command("辞書")
+def reply_dictionary_index(event, key):
+	return reply_dictionary_list(event, "")
+
+def reply_dictionary_list(event, arg):
+	match = DICTIONARY_LIST_ARGS.fullmatch(arg)
+	if match is None:
+	    return None
+	initial = match.group(1)
+	page = int(match.group(2)) if match.group(2) else 1
+
+	user_id = event.source.user_id
+	rows, page, total_pages = list_dictionary_entries(initial, page, user_id)
+
+	if not rows:
+	    return [TextMessage(text="一致する単語が見つかりませんでした。")]
+	else:
+	    reply_lines = [f"📘 登録単語一覧（{page}/{total_pages}ページ）"]
+	    for row in rows:
+	        privacy = "（自分専用）" if row["is_private"] and row["added_by"] == user_id else ""
+	        reply_lines.append(f"・{row['term']}：{row['content']}{privacy}")
+	    return [TextMessage(text="\n".join(reply_lines))]
 
 
 if __name__ == "__main__":
+	# SIGTERM でも atexit が走るようにして、キューを処理し切ってから終了する
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	start_workers()
 	port = int(os.environ.get("PORT", 5000))
 	app.run(host="0.0.0.0", port=port)
-
-
-
-
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio で動かす ASGI 版のエントリーポイント。
+
+    $ pip install uvicorn
+    $ uvicorn asgi_app:application --host 0.0.0.0 --port $PORT
+
+コマンドの中身は app.py の build_reply() をそのまま使う。
+Webhook の受付・Apex API の先読み・LINE への返信はイベントループ上で行い、
+組み立て済みの静的な返信やキャッシュに入っている ?マップ などはそのままループ上で返し、
+辞書（SQLite / PostgreSQL）や Apex API の取得を待つコマンドだけを専用のスレッドプールに逃がす。
+"""
+
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import os
+import time
+import logging
+
+import aiohttp
+from linebot.v3.exceptions import InvalidSignatureError
+from linebot.v3.messaging import AsyncApiClient, AsyncMessagingApi, ReplyMessageRequest
+from linebot.v3.webhooks import MessageEvent, TextMessageContent
+
+import app as bot
+import metrics
+from http_client import RETRY_STATUSES
+import tracing
+from tracing import span
+from log_setup import log_context, log_payload
+from replies import PrebuiltReply, async_send_prebuilt_reply
+from apex_api import (
+    MAPROTATION_URL, PREDATOR_URL, PREDATOR_BORDER_REFRESH_INTERVAL, PREFETCH_RETRY_AFTER,
+    apex_http, format_predator_border, upstream_seconds, upstream_errors
+)
+
+logger = logging.getLogger(__name__)
+
+# 同時に処理するイベント数の上限（超える分は 503 を返して LINE に再送してもらう）
+MAX_CONCURRENCY = int(os.getenv("ASGI_MAX_CONCURRENCY", "1000"))
+# 辞書や Apex API を待つコマンドを実行するスレッド数（既定のプールは CPU 数 + 4 しかない）
+BLOCKING_WORKERS = int(os.getenv("ASGI_BLOCKING_WORKERS", "16"))
+# 終了時に処理中のイベントを待つ秒数
+DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "20"))
+# 返信はイベントループから並行して送るので、接続プールは同期モードより大きくしておく
+LINE_API_POOL_SIZE = int(os.getenv("LINE_API_POOL_SIZE", "100"))
+
+
+class AsyncApexPrefetcher:
+    """ApexPrefetcher の asyncio 版。aiohttp で取得して app.py のキャッシュに入れる。"""
+
+    def __init__(self, map_cache, border_cache, border_interval=PREDATOR_BORDER_REFRESH_INTERVAL,
+                 retry_after=PREFETCH_RETRY_AFTER):
+        self._map_cache = map_cache
+        self._border_cache = border_cache
+        self._border_interval = border_interval
+        self._retry_after = retry_after
+
+    async def run(self):
+        timeout = aiohttp.ClientTimeout(sock_connect=3.05, sock_read=10)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            next_map = next_border = 0.0
+            while True:
+                now = time.time()
+                if now >= next_map:
+                    next_map = await self._refresh_map(session, now)
+                if now >= next_border:
+                    next_border = await self._refresh_border(session, now)
+                await asyncio.sleep(max(0.0, min(next_map, next_border) - time.time()))
+
+    async def _get_json(self, session, upstream, url):
+        with upstream_seconds.time(upstream, errors=upstream_errors), span("apex." + upstream):
+            return await self._fetch_json(session, url)
+
+    async def _fetch_json(self, session, url):
+        """apex_http.get_json() と同じ決まりで取得する（4xx は上流が生きているとみなし、429/5xx と接続エラーはリトライ）。"""
+        apex_http.breaker.before_call()
+        attempt = 0
+        while True:
+            try:
+                async with session.get(url) as resp:
+                    await resp.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt < apex_http.retries:
+                    logger.info("HTTPリトライ(%d): %s", attempt + 1, e)
+                    await asyncio.sleep(apex_http.retry_delay(attempt))
+                    attempt += 1
+                    continue
+                apex_http.breaker.record_failure()
+                raise
+
+            if resp.status in RETRY_STATUSES:
+                if attempt < apex_http.retries:
+                    await asyncio.sleep(apex_http.retry_delay(attempt, resp.headers.get("Retry-After")))
+                    attempt += 1
+                    continue
+                apex_http.breaker.record_failure()
+                resp.raise_for_status()
+
+            apex_http.breaker.record_success()
+            resp.raise_for_status()
+            # 本文は読み込み済みなので、接続を返した後でも json() で取り出せる
+            return await resp.json(content_type=None)
+
+    async def _refresh_map(self, session, now):
+        try:
+            data = await self._get_json(session, "maprotation", MAPROTATION_URL.format(api_key=os.getenv("APEX_API_KEY")))
+        except Exception as e:
+            logger.error("マップ先読みエラー: %s", e)
+            return now + self._retry_after
+        self._map_cache.store(data)
+        return self._map_cache.expires_at
+
+    async def _refresh_border(self, session, now):
+        try:
+            data = await self._get_json(session, "predator", PREDATOR_URL.format(api_key=os.getenv("APEX_API_KEY")))
+            self._border_cache.store(format_predator_border(data))
+        except Exception as e:
+            logger.error("ボーダー先読みエラー: %s", e)
+            self._border_cache.record_failure(e)
+            return now + self._retry_after
+        return now + self._border_interval
+
+
+class BotApplication:
+    """/callback と /metrics だけを持つ最小限の ASGI アプリケーション。"""
+
+    def __init__(self):
+        self._line_api = None
+        self._api_client = None
+        self._prefetch_task = None
+        self._tasks = set()
+        self._executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def startup(self):
+        if self._line_api is not None:
+            return
+        self._executor = ThreadPoolExecutor(BLOCKING_WORKERS, thread_name_prefix="asgi-blocking")
+        # app.py のスレッド（先読み・Webhook ワーカー）は使わず（start_workers() を呼ばない）、ループ上で同じことをする
+        configuration = copy.deepcopy(bot.configuration)
+        configuration.connection_pool_maxsize = LINE_API_POOL_SIZE
+        self._api_client = AsyncApiClient(configuration)
+        self._line_api = AsyncMessagingApi(self._api_client)
+        if bot.APEX_PREFETCH_ENABLED:
+            prefetcher = AsyncApexPrefetcher(bot.map_rotation_cache, bot.predator_border_cache)
+            self._prefetch_task = asyncio.create_task(prefetcher.run())
+
+    async def shutdown(self):
+        if self._prefetch_task is not None:
+            self._prefetch_task.cancel()
+        # 処理中のイベントを返信し終えてから閉じる
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=DRAIN_TIMEOUT)
+        if self._api_client is not None:
+            await self._api_client.close()
+            self._api_client = self._line_api = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        if scope["path"] == "/metrics" and scope["method"] == "GET":
+            await self._metrics(scope, send)
+            return
+        if scope["path"] != "/callback" or scope["method"] != "POST":
+            await _respond(send, 404, b"Not Found")
+            return
+        await self.startup()
+
+        trace = tracing.start_trace()
+        body = await _read_body(receive)
+        signature = dict(scope["headers"]).get(b"x-line-signature", b"").decode("latin-1")
+        try:
+            with tracing.activate(trace):
+                payload = bot.parse_webhook(body.decode("utf-8"), signature)
+        except InvalidSignatureError:
+            await _respond(send, 400, b"Bad Request")
+            return
+        log_payload(logger, "Webhook の本文", body.decode("utf-8"))
+
+        # タスクを作る前に数えて、処理中のイベントが上限を超えるなら受け付けない
+        if len(self._tasks) + len(payload.events) > MAX_CONCURRENCY:
+            logger.warning("イベントを受け付けられませんでした（処理中: %d件）", len(self._tasks))
+            await _respond(send, 503, b"Service Unavailable")
+            return
+        # 返信はバックグラウンドのタスクで行い、Webhook にはすぐ 200 を返す
+        for event in payload.events:
+            task = asyncio.create_task(self._handle_event(event, trace))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        await _respond(send, 200, b"OK")
+
+    async def _metrics(self, scope, send):
+        authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+        if not metrics.authorized(authorization):
+            await _respond(send, 401, b"Unauthorized")
+            return
+        await _respond(send, 200, metrics.render().encode("utf-8"), metrics.CONTENT_TYPE)
+
+    async def _handle_event(self, event, trace=None):
+        if not (isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent)):
+            return
+        with log_context(event_id=getattr(event, "webhook_event_id", None), event_type=event.type), \
+                tracing.event_trace(trace):
+            started = time.perf_counter()
+            try:
+                func, arg, command = bot.command_router.match(event.message.text)
+                if func is None:
+                    messages = None
+                elif bot.runs_inline(func):
+                    messages = bot.run_command(func, event, arg, command)
+                else:
+                    # run_in_executor はコンテキストを引き継がないので、ログの event_id や記録中のトレースごと渡す
+                    context = contextvars.copy_context()
+                    messages = await asyncio.get_running_loop().run_in_executor(
+                        self._executor, context.run, bot.run_command, func, event, arg, command)
+                if isinstance(messages, PrebuiltReply):
+                    with bot.line_reply_seconds.time("prebuilt", errors=bot.line_reply_errors), span("line_reply"):
+                        await async_send_prebuilt_reply(self._api_client, event.reply_token, messages)
+                elif messages:
+                    with bot.line_reply_seconds.time("sdk", errors=bot.line_reply_errors), span("line_reply"):
+                        await self._line_api.reply_message(
+                            ReplyMessageRequest(reply_token=event.reply_token, messages=messages)
+                        )
+            except Exception:
+                logger.exception("イベント処理中にエラーが発生しました")
+                return
+            logger.info("イベントを処理しました", extra={"elapsed_ms": round((time.perf_counter() - started) * 1000, 2)})
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _respond(send, status, body, content_type="text/plain; charset=utf-8"):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+application = BotApplication()
+metrics.gauge("bot_asgi_events_in_flight", "処理中（返信待ちを含む）のイベント数", lambda: len(application._tasks))
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+複数プロセスで同じ dictionary.db を使ったときに、辞書キャッシュが古い内容を返さないかの確認。
+
+    $ python bench/cache_coherence.py --workers 4 --rounds 500
+
+ワーカープロセスを立てて、どれか1つに追加・削除をさせては全員に引かせ、
+親プロセスが持っている正解と食い違ったら失敗として終了コード 1 で抜ける。
+途中で1つのワーカーをしばらく休ませ、その間に変更履歴が消される
+（追いつけずにキャッシュを丸ごと捨てる）場合も確かめる。
+"""
+
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OWNER = "U-owner"
+OTHER = "U-other"
+
+
+def create_db(path):
+    sys.path.insert(0, ROOT)
+    import migrations
+
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn)
+    conn.close()
+
+
+def worker(db_path, log_size, commands, results):
+    # dictionary を読み込む前に環境変数を決めておく（spawn なので親の import は引き継がない）
+    os.environ["DICTIONARY_DB_PATH"] = db_path
+    os.environ["DATABASE_URL"] = ""
+    os.environ["DICTIONARY_CHANGE_LOG_SIZE"] = str(log_size)
+    sys.path.insert(0, ROOT)
+    import dictionary
+
+    while True:
+        command = commands.get()
+        if command is None:
+            break
+        op, args = command
+        if op == "add":
+            dictionary.add_dictionary_entry(*args)
+            results.put(None)
+        elif op == "delete":
+            results.put(dictionary.delete_dictionary_entry(*args))
+        elif op == "lookup":
+            results.put([dictionary.lookup_dictionary_entry(term, user_id) for term, user_id in args])
+
+
+class Pool:
+    def __init__(self, db_path, workers, log_size):
+        ctx = multiprocessing.get_context("spawn")
+        self.commands = [ctx.Queue() for _ in range(workers)]
+        self.results = [ctx.Queue() for _ in range(workers)]
+        self.processes = [
+            ctx.Process(target=worker, args=(db_path, log_size, c, r), daemon=True)
+            for c, r in zip(self.commands, self.results)
+        ]
+        for p in self.processes:
+            p.start()
+
+    def call(self, i, op, *args):
+        self.commands[i].put((op, args))
+        return self.results[i].get(timeout=30)
+
+    def close(self):
+        for c in self.commands:
+            c.put(None)
+        for p in self.processes:
+            p.join(timeout=10)
+
+
+def expected(model, term, user_id):
+    # 自分専用の登録があればそちらが見える
+    for owner in (user_id, ""):
+        if (term, owner) in model:
+            return model[term, owner]
+    return None
+
+
+def write(pool, model, i, terms, step, rng):
+    term = rng.choice(terms)
+    if any(t == term for t, _ in model) and rng.random() < 0.3:
+        pool.call(i, "delete", term, OWNER)
+        # 自分専用があればそちらだけ消える
+        if model.pop((term, OWNER), None) is None:
+            model.pop((term, ""), None)
+    else:
+        is_private = rng.random() < 0.2
+        content = f"{term}-{step}"
+        pool.call(i, "add", term, content, OWNER, is_private)
+        model[term, OWNER if is_private else ""] = content
+
+
+def check(pool, model, workers, queries):
+    mismatches = []
+    for i in workers:
+        got = pool.call(i, "lookup", *queries)
+        for (term, user_id), value in zip(queries, got):
+            want = expected(model, term, user_id)
+            if value != want:
+                mismatches.append((i, term, user_id, value, want))
+    return mismatches
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=500)
+    parser.add_argument("--terms", type=int, default=20)
+    parser.add_argument("--log-size", type=int, default=50, help="DICTIONARY_CHANGE_LOG_SIZE（小さくして履歴の削除も起こす）")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    terms = [f"term{i}" for i in range(args.terms)]
+    queries = [(t, u) for t in terms + ["not-registered"] for u in (OWNER, OTHER)]
+    everyone = range(args.workers)
+
+    tmpdir = tempfile.mkdtemp(prefix="dictionary-coherence-")
+    db_path = os.path.join(tmpdir, "dictionary.db")
+    create_db(db_path)
+    pool = Pool(db_path, args.workers, args.log_size)
+    model = {}
+    mismatches = []
+    started = time.perf_counter()
+    try:
+        # 全員のキャッシュを温めてから書き込みを始める
+        mismatches += check(pool, model, everyone, queries)
+
+        for step in range(args.rounds):
+            write(pool, model, rng.randrange(args.workers), terms, step, rng)
+            mismatches += check(pool, model, everyone, queries)
+
+        # ワーカー 0 を休ませている間に、変更履歴が消えるほど書き込む
+        others = range(1, args.workers) if args.workers > 1 else everyone
+        for step in range(args.rounds, args.rounds + args.log_size * 3 + 100):
+            write(pool, model, rng.choice(others), terms, step, rng)
+        mismatches += check(pool, model, everyone, queries)
+    finally:
+        pool.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - started
+    print(f"workers={args.workers} rounds={args.rounds} lookups={len(queries) * args.workers * (args.rounds + 2)} "
+          f"elapsed={elapsed:.1f}s mismatches={len(mismatches)}")
+    for i, term, user_id, value, want in mismatches[:20]:
+        print(f"  worker {i}: {term!r} ({user_id}) -> {value!r}, expected {want!r}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+メッセージがどのコマンドに振り分けられ、どんな返信になるかの確認。
+
+    $ python bench/command_routes.py
+
+空白の入り方が違うだけのメッセージ（「辞書 削除  foo」など）が、以前の if/elif の
+split() で区切っていたときと同じ処理になるかを、一時 DB を使って app.build_reply() で確かめる。
+どれかが期待と食い違ったら終了コード 1 で抜ける。
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (説明, 送る人, メッセージ, 期待する返信の先頭)。上から順に送る
+CASES = [
+    ("追加", "U1", "辞書 追加 foo 内容", "「foo」を辞書に追加しました。"),
+    ("サブコマンドの後の空白が2つ（削除）", "U1", "辞書 削除  foo", "「foo」を削除しました。"),
+    ("サブコマンドの後の空白が2つ（追加）", "U1", "辞書 追加  foo  内容", "「foo」を辞書に追加しました。"),
+    ("引いた内容", "U1", "foo", "foo：内容"),
+    ("サブコマンドの後の空白が2つ（検索）", "U1", "辞書 検索  foo", "🔍「foo」の検索結果"),
+    ("「辞書」の後の空白が2つ（削除）", "U1", "辞書  削除 foo", "「foo」を削除しました。"),
+    ("消えている", "U1", "辞書 削除 foo", "削除できませんでした。"),
+    ("単語と内容の間が改行", "U1", "辞書 追加 bar\n内容", "「bar」を辞書に追加しました。"),
+    ("前後の空白", "U1", "  辞書 削除 bar  ", "「bar」を削除しました。"),
+    ("形式が違う", "U1", "辞書 削除", "「辞書 追加 単語 内容」または「辞書 削除 単語」の形式で送信してください。"),
+]
+
+
+def reply_text(app, user_id, text):
+    event = SimpleNamespace(message=SimpleNamespace(text=text), source=SimpleNamespace(user_id=user_id))
+    messages = app.build_reply(event)
+    if not messages:
+        return None
+    return messages[0].text
+
+
+def main():
+    tmpdir = tempfile.mkdtemp(prefix="command-routes-")
+    os.environ.update(
+        DATABASE_URL="",
+        DICTIONARY_DB_PATH=os.path.join(tmpdir, "dictionary.db"),
+        LINE_CHANNEL_SECRET="bench-channel-secret",
+        LINE_CHANNEL_ACCESS_TOKEN="bench-token",
+        APEX_PREFETCH="0",
+        WEBHOOK_WORKERS="0",
+        LOG_LEVEL="WARNING",
+    )
+    sys.path.insert(0, ROOT)
+    import app
+    import dictionary
+
+    failed = 0
+    try:
+        for name, user_id, text, want in CASES:
+            got = reply_text(app, user_id, text)
+            ok = got is not None and got.startswith(want)
+            failed += not ok
+            print(f"{'ok' if ok else 'NG'}  {name}")
+            if not ok:
+                print(f"      {text!r} → {got!r}（期待値 {want!r} で始まる返信）")
+    finally:
+        dictionary.writer.shutdown(10)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
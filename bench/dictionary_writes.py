@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+辞書の追加のスループット比較（その場で書く / ライタースレッドにまとめて書く）。
+
+    $ python bench/dictionary_writes.py --threads 16 --adds 500
+
+Webhook ワーカーが「辞書 追加」を同時に処理している状況を、スレッドごとに
+add_dictionary_entry() を呼び続けることで再現し、1秒あたりの追加数を比べる。
+モードごとに別プロセス・別の一時 DB で測る。
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import SUPPRESS, ArgumentParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "direct": {"DICTIONARY_WRITE_BEHIND": "0"},
+    "batched": {"DICTIONARY_WRITE_BEHIND": "1", "DICTIONARY_WRITE_DELAY_MS": "0"},
+    "batched-2ms": {"DICTIONARY_WRITE_BEHIND": "1", "DICTIONARY_WRITE_DELAY_MS": "2"},
+}
+
+
+def child(threads, adds):
+    sys.path.insert(0, ROOT)
+    import dictionary
+
+    # スキーマの作成は測らない
+    with dictionary.connection():
+        pass
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads + 1)
+
+    def run(n):
+        mine = []
+        barrier.wait()
+        for i in range(adds):
+            started = time.perf_counter()
+            dictionary.add_dictionary_entry(f"term-{n}-{i % 50}", f"content {i}", f"U{n}", i % 5 == 0)
+            mine.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(mine)
+
+    workers = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        "adds": len(latencies),
+        "elapsed": elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--adds", type=int, default=500, help="スレッドあたりの追加数")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--synchronous", default="NORMAL", help="SQLite の synchronous（FULL だとコミットごとに fsync）")
+    parser.add_argument("--child", action="store_true", help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.threads, args.adds)
+        return
+
+    print(f"threads={args.threads} adds/thread={args.adds} synchronous={args.synchronous}")
+    print(f"{'mode':<12} {'adds/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode in args.modes.split(","):
+        tmpdir = tempfile.mkdtemp(prefix="dictionary-writes-")
+        env = dict(
+            os.environ,
+            DATABASE_URL="",
+            DICTIONARY_DB_PATH=os.path.join(tmpdir, "dictionary.db"),
+            SQLITE_SYNCHRONOUS=args.synchronous,
+            **MODES[mode],
+        )
+        try:
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child",
+                 "--threads", str(args.threads), "--adds", str(args.adds)],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        result = json.loads(out.strip().splitlines()[-1])
+        print(f"{mode:<12} {result['adds'] / result['elapsed']:>10.0f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+webhook_queue.EventHandlers が処理関数に渡す引数の確認。
+
+    $ python bench/event_dispatch.py
+
+WebhookHandler と同じく、受け取れる位置引数の数に合わせて (event, destination) / (event) / ()
+で呼ぶこと、*args なら2つ渡すこと、bound method や functools.partial も数え違えないこと、
+メッセージの種類 → イベントの種類 → default の順に処理関数を探すことを確かめる。
+どれかが期待と食い違ったら終了コード 1 で抜ける。
+"""
+
+import functools
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from linebot.v3.webhooks import (  # noqa: E402
+    FollowEvent,
+    MessageEvent,
+    StickerMessageContent,
+    TextMessageContent,
+    UnfollowEvent,
+)
+
+from webhook_queue import EventHandlers  # noqa: E402
+
+DESTINATION = "Ubench"
+
+# 処理関数が受け取った引数をここに積む
+calls = []
+
+
+def two(event, destination):
+    calls.append((event, destination))
+
+
+def one(event):
+    calls.append((event,))
+
+
+def none():
+    calls.append(())
+
+
+def varargs(*args):
+    calls.append(args)
+
+
+def event_and_varargs(event, *args):
+    calls.append((event, *args))
+
+
+def with_keyword(event, destination=None, *, extra=None):
+    calls.append((event, destination))
+
+
+def tagged(tag, event):
+    calls.append((event,))
+
+
+class Recorder:
+    def on_event(self, event):
+        calls.append((event,))
+
+    def on_event_with_destination(self, event, destination):
+        calls.append((event, destination))
+
+
+# (説明, 処理関数, 渡されるはずの引数の数)
+ARG_CASES = [
+    ("(event, destination)", two, 2),
+    ("(event)", one, 1),
+    ("()", none, 0),
+    ("*args", varargs, 2),
+    ("(event, *args)", event_and_varargs, 2),
+    ("キーワード専用引数は数えない", with_keyword, 2),
+    ("bound method (event)", Recorder().on_event, 1),
+    ("bound method (event, destination)", Recorder().on_event_with_destination, 2),
+    ("partial で1つ埋めた (tag, event)", functools.partial(tagged, "t"), 1),
+    ("lambda (event)", lambda event: calls.append((event,)), 1),
+]
+
+
+def text_event():
+    return MessageEvent.construct(message=TextMessageContent.construct(text="x"))
+
+
+def sticker_event():
+    return MessageEvent.construct(message=StickerMessageContent.construct())
+
+
+def routing_handlers():
+    handlers = EventHandlers()
+    handlers.add(MessageEvent, message=TextMessageContent)(lambda event: calls.append("text"))
+    handlers.add(MessageEvent)(lambda event: calls.append("message"))
+    handlers.add(FollowEvent)(lambda event: calls.append("follow"))
+    handlers.default()(lambda event: calls.append("default"))
+    return handlers
+
+
+# (説明, イベント, 呼ばれるはずの処理関数)
+ROUTE_CASES = [
+    ("メッセージの種類で選ぶ", text_event, "text"),
+    ("種類の登録がなければイベントで選ぶ", sticker_event, "message"),
+    ("メッセージ以外のイベント", FollowEvent.construct, "follow"),
+    ("どれにも当たらなければ default", UnfollowEvent.construct, "default"),
+]
+
+
+def check(name, want):
+    got = calls[:]
+    calls.clear()
+    ok = got == [want]
+    print(f"{'ok' if ok else 'NG'}  {name}")
+    if not ok:
+        print(f"      {got!r}（期待値 {[want]!r}）")
+    return ok
+
+
+def main():
+    failed = 0
+    for name, func, count in ARG_CASES:
+        event = text_event()
+        handlers = EventHandlers()
+        handlers.add(MessageEvent, message=TextMessageContent)(func)
+        handlers.dispatch(event, DESTINATION)
+        failed += not check(name, (event, DESTINATION)[:count])
+
+    handlers = routing_handlers()
+    for name, make_event, want in ROUTE_CASES:
+        handlers.dispatch(make_event(), DESTINATION)
+        failed += not check(name, want)
+
+    # 登録も default もなければ何も呼ばない
+    EventHandlers().dispatch(text_event(), DESTINATION)
+    ok = not calls
+    failed += not ok
+    print(f"{'ok' if ok else 'NG'}  処理関数がなければ何もしない")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+/callback の負荷試験と、記録したトラフィックの再生。
+
+    $ python bench/load_test.py --rps 100 --duration 30
+    $ python bench/load_test.py --rps 200 --mix "map=5,weapon=40,add=5,chatter=50" --line-latency 0.2
+    $ python bench/load_test.py --replay traffic.jsonl --speed 2
+    $ python bench/load_test.py --url http://localhost:5000/callback --rps 50   # 起動済みのサーバー
+
+LINE_CHANNEL_SECRET（無ければ負荷試験用の値）で署名した Webhook を、--rps の一定間隔で送る
+（前の応答を待たずに送るので、サーバーが詰まっても送る速さは落ちない）。
+--url を指定しなければ、LINE と Apex API のスタブ（bench/stubs.py）を立て、一時ディレクトリに
+複製した辞書 DB でボットを起動して、そこに向けて送るので外部には一切アクセスしない。
+
+Webhook の応答時間（ack）と、スタブに返信が届くまでの時間（reply）の p50 / p95 / p99 を出す。
+どちらも「送るはずだった時刻」から測る（送るのが遅れた分も遅延に含める）。
+
+--replay の JSONL は1行1件で、次のどちらかの形。
+- {"text": "?マップ", "user_id": "U1", "at": 1.5}: メッセージ1件（user_id と at は省略可）
+- Webhook の本文そのもの（{"destination": ..., "events": [...]}、"at" を足してもよい）
+at は最初の行からの秒数で、無い行は --rps の間隔で送る。どちらの形でもない行は数えて飛ばす。
+"""
+
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from serving_modes import CHANNEL_SECRET, ROOT, free_port, make_body, percentile, sign, start_app
+from stubs import ApexStub, LineStub
+
+# 既定のコマンドの割合（普段のグループでは雑談が大半で、?マップ や武器の問い合わせが続く）
+DEFAULT_MIX = "map=10,border=5,weapon=25,help=2,add=3,lookup=5,chatter=50"
+CHATTER = ["おはよう", "今日ランクいく？", "了解", "www", "それな", "今から入れる人いる？", "おつかれ", "ナイス！"]
+
+
+def knowledge_keys(kind):
+    with open(os.path.join(ROOT, "data", "knowledge.json"), encoding="utf-8") as f:
+        return [entry["key"] for entry in json.load(f)[kind]]
+
+
+class CommandMix:
+    """--mix の割合でメッセージの本文を作る（random.Random(seed) なので毎回同じ並びになる）"""
+
+    def __init__(self, spec, seed=0):
+        self._random = random.Random(seed)
+        self._weapons = knowledge_keys("weapons")
+        self._kinds = []
+        self._weights = []
+        for part in spec.split(","):
+            kind, _, weight = part.partition("=")
+            if not hasattr(self, "_" + kind.strip()):
+                raise SystemExit(f"--mix の {kind!r} は分かりません（map, border, weapon, help, add, lookup, chatter）")
+            self._kinds.append(getattr(self, "_" + kind.strip()))
+            self._weights.append(float(weight or 1))
+
+    def text(self, i):
+        return self._random.choices(self._kinds, self._weights)[0](i)
+
+    def _map(self, i):
+        return "?マップ"
+
+    def _border(self, i):
+        return "?ボーダー"
+
+    def _weapon(self, i):
+        return self._random.choice(self._weapons)
+
+    def _help(self, i):
+        return "?ヘルプ"
+
+    def _add(self, i):
+        return f"辞書 追加 loadtest{i % 500} 負荷試験で追加した単語 {i}"
+
+    def _lookup(self, i):
+        # add で入れた単語を引く（まだ入っていなければ雑談と同じく返信しない）
+        return f"loadtest{self._random.randrange(500)}"
+
+    def _chatter(self, i):
+        return self._random.choice(CHATTER)
+
+
+def generated(mix, rps, duration):
+    """(送る時刻, 本文, reply token のリスト) を duration 秒分作る"""
+    for i in range(int(rps * duration)):
+        yield i / rps, make_body(i, mix.text(i)), [f"token{i}"]
+
+
+def replayed(path, rps, speed):
+    """記録した JSONL から (送る時刻, 本文, reply token のリスト) を作る"""
+    skipped = 0
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not isinstance(record, dict):
+                skipped += 1
+                continue
+            at = record.pop("at", None)
+            at = len(items) / rps if at is None else float(at) / speed
+            if isinstance(record.get("text"), str):
+                items.append((at, make_body(line_no, record["text"], record.get("user_id")), [f"token{line_no}"]))
+            elif isinstance(record.get("events"), list):
+                # 返信を突き合わせられるよう、reply token は送るたびに振り直す
+                tokens = []
+                for j, event in enumerate(record["events"]):
+                    if isinstance(event, dict) and "replyToken" in event:
+                        event["replyToken"] = f"token{line_no}-{j}"
+                        tokens.append(event["replyToken"])
+                items.append((at, json.dumps(record, ensure_ascii=False), tokens))
+            else:
+                skipped += 1
+    if skipped:
+        print(f"{path}: 形式の合わない {skipped} 行を飛ばしました")
+    items.sort(key=lambda item: item[0])
+    return items
+
+
+async def drive(url, items, secret, max_in_flight):
+    """items を予定の時刻どおりに送り、(予定時刻, ack の遅延, ステータス) のリストと経過秒を返す"""
+    results = []
+    scheduled = {}
+
+    async def send(session, due, body, tokens):
+        for token in tokens:
+            scheduled[token] = due
+        headers = {"X-Line-Signature": sign(body, secret), "Content-Type": "application/json"}
+        try:
+            async with session.post(url, data=body.encode("utf-8"), headers=headers) as resp:
+                await resp.read()
+                status = resp.status
+        except aiohttp.ClientError as e:
+            status = type(e).__name__
+        results.append((due, time.perf_counter() - due, status))
+
+    connector = aiohttp.TCPConnector(limit=max_in_flight)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = []
+        base = time.perf_counter() + 0.1
+        for at, body, tokens in items:
+            delay = base + at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(session, base + at, body, tokens)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - base
+    return results, scheduled, elapsed
+
+
+def summarize(results, scheduled, replies, elapsed):
+    acks = [latency for _, latency, status in results if status == 200]
+    statuses = {}
+    for _, _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    reply_lat = [replies[token] - due for token, due in scheduled.items() if token in replies]
+    summary = {
+        "sent": len(results),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(acks) / elapsed, 1) if elapsed > 0 else 0.0,
+        "statuses": statuses,
+        "replies": len(reply_lat),
+    }
+    for name, values in (("ack", acks), ("reply", reply_lat)):
+        for p in (50, 95, 99):
+            summary[f"{name}_p{p}_ms"] = round(percentile(values, p) * 1000, 2)
+    return summary
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rps", type=float, default=50, help="1秒あたりに送る Webhook の数")
+    parser.add_argument("--duration", type=float, default=10, help="送り続ける秒数（--replay のときは使わない）")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="コマンドの割合（既定: %(default)s）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", metavar="JSONL", help="記録したトラフィックを再生する")
+    parser.add_argument("--speed", type=float, default=1.0, help="--replay の at を何倍速で再生するか")
+    parser.add_argument("--url", help="起動済みのサーバーの /callback に送る（スタブとボットは立てない）")
+    parser.add_argument("--mode", choices=("sync", "asgi"), default="sync", help="立てるボットの種類")
+    parser.add_argument("--line-latency", type=float, default=0.05, help="LINE スタブの応答遅延（秒）")
+    parser.add_argument("--apex-latency", type=float, default=0.3, help="Apex スタブの応答遅延（秒）")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="同時に開く接続の上限")
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="送り終えてから返信を待つ秒数")
+    parser.add_argument("--json", metavar="PATH", help="結果を JSON でも書き出す")
+    args = parser.parse_args()
+
+    secret = os.getenv("LINE_CHANNEL_SECRET") or CHANNEL_SECRET
+    if args.replay:
+        items = replayed(args.replay, args.rps, args.speed)
+    else:
+        items = list(generated(CommandMix(args.mix, args.seed), args.rps, args.duration))
+    if not items:
+        raise SystemExit("送るものがありません")
+
+    line = apex = proc = workdir = None
+    url = args.url
+    try:
+        if url is None:
+            line = LineStub(latency=args.line_latency).start()
+            apex = ApexStub(latency=args.apex_latency).start()
+            workdir = tempfile.mkdtemp(prefix="load-test-")
+            if os.path.exists(os.path.join(ROOT, "dictionary.db")):
+                shutil.copy(os.path.join(ROOT, "dictionary.db"), workdir)
+            port = free_port()
+            proc = start_app(args.mode, port, line.url, apex.url, workdir, secret)
+            url = f"http://127.0.0.1:{port}/callback"
+
+        print(f"{len(items)} 件を {url} に送ります")
+        results, scheduled, elapsed = asyncio.run(drive(url, items, secret, args.max_in_flight))
+        replies = {}
+        if line is not None:
+            # 返信が止まるまで待つ（雑談など返信しないものもあるので、件数では待てない）
+            deadline = time.time() + args.drain_timeout
+            count = -1
+            while time.time() < deadline and count != len(line.replies):
+                count = len(line.replies)
+                time.sleep(0.5)
+            with line.lock:
+                replies = dict(line.replies)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(10)
+        for stub in (line, apex):
+            if stub is not None:
+                stub.stop()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = summarize(results, scheduled, replies, elapsed)
+    if apex is not None:
+        summary["apex_calls"] = apex.calls
+    print(f"送信 {summary['sent']} 件 / {summary['elapsed_s']} 秒（{summary['throughput_rps']} 件/秒）"
+          f"  ステータス: {summary['statuses']}")
+    print(f"ack   p50 {summary['ack_p50_ms']:>8} ms  p95 {summary['ack_p95_ms']:>8} ms  p99 {summary['ack_p99_ms']:>8} ms")
+    if line is not None:
+        print(f"reply p50 {summary['reply_p50_ms']:>8} ms  p95 {summary['reply_p95_ms']:>8} ms"
+              f"  p99 {summary['reply_p99_ms']:>8} ms  （返信 {summary['replies']} 件）")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(dict(summary, args=vars(args)), f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
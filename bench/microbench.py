@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""
+よく通る処理のマイクロベンチマークと、基準値（JSON）との比較。
+
+    $ python bench/microbench.py --save                # 測って bench/baseline.json に保存する
+    $ python bench/microbench.py                       # 測って基準値と比べる（遅くなっていたら終了コード 1）
+    $ python bench/microbench.py --threshold 10 --only listing
+    $ python bench/microbench.py --save --processes 5        # ぶれの見積もりを増やして保存する
+    $ python bench/microbench.py --sizes 1000,100000 --fixtures /tmp/microbench  # 1M 行を省く・DB を使い回す
+
+測るもの（名前は「グループ.処理」）
+- app: handle_message での静的なコマンドの振り分け（?ヘルプ・武器）と、/predator の応答の解釈。
+  LINE への送信は、送るはずの本文を作るところまでにしている（ネットワークは測らない）
+- dictionary: 単語の引き当て（登録あり・なし）と add_dictionary_entry（1スレッド・8スレッド）
+- listing-<行数>: 「辞書」の一覧の1ページ目・最後のページと、ページ位置の数え直し（cold）
+
+グループごとに別プロセス・別の一時 DB で測る。各処理は 1 回が --min-time 秒以上になるよう
+回数を決めて --repeat 回測る。共有のマシンでは時間とともにマシン全体の速さが 2〜5 割も揺れるので、
+毎回その直後に決まった量の Python の処理（calibration_loop）も測り、その比（relative）の中央値を使う。
+同じ計測を --processes 個のプロセスで行い、relative の中央値を基準値と比べる。
+
+しきい値は --threshold。ただし、--save のときにプロセス間の relative のぶれ（noise_pct）が
+それより大きかった処理は、ぶれまで広げて判定し、その旨を表示する。
+差が --noise-floor µs（ただし基準値の 1 割まで）未満なら遅くなったとはみなさない。
+しきい値を超えたものは --retries 回まで測り直し、それまでのプロセスと合わせた中央値で判定する。
+基準値は測ったマシンに依存するので、マシンや Python を変えたら --save で取り直し、
+保存した直後に比べて通ることを確かめておく。
+"""
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import SUPPRESS, ArgumentParser
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, "bench", "baseline.json")
+DEFAULT_SIZES = (1000, 100_000, 1_000_000)
+# 差の下限（--noise-floor）は、基準値に対してこの割合より大きくしない
+NOISE_FLOOR_RATIO = 0.1
+# calibration_loop を 1 回の計測あたりこの秒数だけ回す
+CALIBRATION_TIME = 0.05
+
+GROUPS = {}
+
+
+def group(name):
+    def register(func):
+        GROUPS[name] = func
+        return func
+    return register
+
+
+def calibration_loop():
+    """マシン全体の速さの目安にする、決まった量の Python の処理（辞書と文字列）"""
+    counts = {}
+    for i in range(200):
+        counts[str(i)] = i
+    return sum(counts.values())
+
+
+def loops(func, min_time):
+    """1 回の計測が min_time 秒以上になる呼び出し回数"""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return number
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.2))
+
+
+def timed(func, number):
+    """number 回呼んだときの 1 回あたりの秒数"""
+    started = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - started) / number
+
+
+def measure(func, min_time, repeat, calibration):
+    """
+    (best, median, relative) を返す。best と median は 1 回あたりの秒数、relative は
+    毎回の計測とその直後の calibration() との比の中央値（マシン全体の速さの揺れを打ち消したもの）。
+    """
+    number = loops(func, min_time)
+    times = []
+    ratios = []
+    for _ in range(repeat):
+        elapsed = timed(func, number)
+        times.append(elapsed)
+        ratios.append(elapsed / calibration())
+    return min(times), median(times), median(ratios)
+
+
+def size_label(size):
+    for unit, suffix in ((1_000_000, "m"), (1000, "k")):
+        if size >= unit and size % unit == 0:
+            return f"{size // unit}{suffix}"
+    return str(size)
+
+
+@group("app")
+def app_benchmarks(size):
+    sys.path.insert(0, os.path.join(ROOT, "bench"))
+    import app
+    import apex_api
+    from replies import reply_body
+    from serving_modes import make_body, sign
+
+    # 送信の代わりに本文だけ作る（組み立て済みの返信を送る手前まで）
+    app.send_prebuilt_reply = lambda api_client, token, reply: reply_body(token, reply)
+
+    def event(text):
+        body = make_body(0, text)
+        return app.payload_parser.parse(body, sign(body), as_payload=True).events[0]
+
+    help_event = event("?ヘルプ")
+    weapon_event = event("?R-99")
+    app.handle_message(weapon_event)  # data/knowledge.json の読み込みは測らない
+
+    predator = json.dumps({"RP": {
+        "PC": {"val": 15000, "totalMastersAndPreds": 30000},
+        "PS4": {"val": 12000, "totalMastersAndPreds": 25000},
+        "X1": {"val": 11000, "totalMastersAndPreds": 9000},
+    }})
+    return {
+        "dispatch_help": lambda: app.handle_message(help_event),
+        "dispatch_weapon": lambda: app.handle_message(weapon_event),
+        "parse_predator_border": lambda: apex_api.format_predator_border(json.loads(predator)),
+    }
+
+
+@group("dictionary")
+def dictionary_benchmarks(size):
+    import dictionary
+
+    fill(dictionary, 1000)
+    counter = iter(range(10 ** 9))
+
+    def add():
+        dictionary.add_dictionary_entry(f"bench-add-{next(counter) % 1000}", "content", "U-bench", False)
+
+    def add_threads(threads=8, adds=25):
+        def run(n):
+            for i in range(adds):
+                dictionary.add_dictionary_entry(f"bench-thread-{n}-{i}", "content", f"U{n}", i % 2 == 0)
+        workers = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+
+    dictionary.lookup_dictionary_entry("term0000500", "U1")
+    return {
+        "lookup_hit": lambda: dictionary.lookup_dictionary_entry("term0000500", "U1"),
+        "lookup_miss": lambda: dictionary.lookup_dictionary_entry("おはよう", "U1"),
+        "add": add,
+        # 1 回で 8 スレッド × 25 件（200 件）を追加する
+        "add_8_threads_x200": add_threads,
+    }
+
+
+@group("listing")
+def listing_benchmarks(size):
+    import dictionary
+
+    fill(dictionary, size)
+    total = dictionary.list_dictionary_entries(None, 1, "U1")[2]
+
+    def cold():
+        # 辞書が書き換えられたときと同じく、ページ位置を数え直させる
+        dictionary.term_cache.invalidate("bench-cold", "")
+        dictionary.list_dictionary_entries(None, 1, "U1")
+
+    return {
+        "page_first": lambda: dictionary.list_dictionary_entries(None, 1, "U1"),
+        "page_last": lambda: dictionary.list_dictionary_entries(None, total, "U1"),
+        "cold": cold,
+    }
+
+
+def fill(dictionary, size):
+    """size 行の辞書を用意する（--fixtures で使い回した DB にすでにあれば何もしない）"""
+    from dictionary_io import import_rows
+
+    with dictionary.connection() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM dictionary").fetchone()[0]
+        if count >= size:
+            return
+        # 10 件に 1 件は誰かの自分専用（一覧で他の人の分を読み飛ばす手間も含めて測る）
+        rows = ((f"term{i:07d}", f"U{i % 7}" if i % 10 == 9 else "", f"内容 {i}", "U0") for i in range(count, size))
+        import_rows(dictionary.store, conn, rows, batch=50000, rebuild_search_index=True)
+    dictionary.term_cache.clear()
+
+
+def child(name, size, min_time, repeat, only):
+    sys.path.insert(0, ROOT)
+    benchmarks = GROUPS[name.split("-")[0]](size)
+    calibration_number = loops(calibration_loop, CALIBRATION_TIME)
+    results = {}
+    for bench_name, func in benchmarks.items():
+        full_name = f"{name}.{bench_name}"
+        if only and not any(pattern in full_name for pattern in only):
+            continue
+        best, mid, relative = measure(func, min_time, repeat, lambda: timed(calibration_loop, calibration_number))
+        results[full_name] = {"best_us": round(best * 1e6, 3), "median_us": round(mid * 1e6, 3),
+                              "relative": round(relative, 6)}
+    print(json.dumps(results))
+    # 書き込み待ちを残さない（終了時の atexit でも書き切るが、その時間は測らない）
+    if "dictionary" in sys.modules:
+        sys.modules["dictionary"].writer.shutdown(10)
+
+
+def run_group(name, size, args, fixtures, only):
+    db_path = os.path.join(fixtures, f"{name}.db")
+    env = dict(
+        os.environ,
+        DATABASE_URL="",
+        DICTIONARY_DB_PATH=db_path,
+        LINE_CHANNEL_SECRET="bench-channel-secret",
+        LINE_CHANNEL_ACCESS_TOKEN="bench-token",
+        APEX_PREFETCH="0",
+        WEBHOOK_WORKERS="0",
+        LOG_LEVEL="WARNING",
+    )
+    if name == "dictionary" and os.path.exists(db_path):
+        # 追加の計測で行が増えていくので、引き当て・追加は毎回まっさらな DB で測る
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", name, "--size", str(size),
+           "--min-time", str(args.min_time), "--repeat", str(args.repeat)]
+    for pattern in only or ():
+        cmd += ["--only", pattern]
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    if proc.returncode != 0 or not proc.stdout.strip():
+        raise SystemExit(f"{name} の計測が異常終了しました\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def select_groups(groups, only):
+    """only で絞れるならそのグループだけにする（処理名だけなら全グループで探す）"""
+    if not only:
+        return groups
+    return [(name, size) for name, size in groups
+            if any(pattern in name or pattern.startswith(name + ".") for pattern in only)] or groups
+
+
+def measure_groups(groups, args, fixtures, only, samples):
+    """各グループを --processes 個のプロセスで測り、処理ごとの結果を samples に足していく"""
+    for name, size in select_groups(groups, only):
+        started = time.perf_counter()
+        for _ in range(args.processes):
+            for bench_name, result in run_group(name, size, args, fixtures, only).items():
+                samples.setdefault(bench_name, []).append(result)
+        print(f"--  {name}（{time.perf_counter() - started:.1f} 秒）", file=sys.stderr)
+    return samples
+
+
+def summarize(samples):
+    """プロセスごとの結果を、中央値とプロセス間の relative のぶれにまとめる"""
+    results = {}
+    for name, runs in samples.items():
+        relatives = [run["relative"] for run in runs]
+        mid = median(relatives)
+        results[name] = {
+            "best_us": min(run["best_us"] for run in runs),
+            "median_us": round(median(run["median_us"] for run in runs), 3),
+            "relative": round(mid, 6),
+            "noise_pct": round((max(relatives) - min(relatives)) / mid * 100, 1),
+        }
+    return results
+
+
+def change(result, base):
+    return (result["relative"] / base["relative"] - 1) * 100
+
+
+def limit(base, threshold):
+    """この処理のしきい値（%）。基準値を測ったときのぶれがしきい値より大きければ、ぶれまで広げる。"""
+    return max(threshold, base.get("noise_pct", 0))
+
+
+def regressed(result, base, threshold, noise_floor):
+    percent = change(result, base)
+    # 差も relative から求める（生の µs はマシン全体の速さの揺れを含むため）
+    slower_us = base["median_us"] * percent / 100
+    return percent > limit(base, threshold) and slower_us >= min(noise_floor, base["median_us"] * NOISE_FLOOR_RATIO)
+
+
+def regressions(results, baseline, threshold, noise_floor):
+    return [name for name, result in results.items()
+            if name in baseline and regressed(result, baseline[name], threshold, noise_floor)]
+
+
+def report(results, baseline, threshold, noise_floor):
+    print(f"{'benchmark':<34} {'baseline µs':>12} {'now µs':>12} {'change':>8} {'limit':>7}")
+    widened = 0
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<34} {'-':>12} {result['median_us']:>12.2f} {'new':>8}")
+            continue
+        effective = limit(base, threshold)
+        widened += effective > threshold
+        print(f"{name:<34} {base['median_us']:>12.2f} {result['median_us']:>12.2f}"
+              f" {change(result, base):>+7.1f}% {effective:>6.0f}%"
+              + ("*" if effective > threshold else " ")
+              + (" NG" if regressed(result, base, threshold, noise_floor) else ""))
+    if widened:
+        print(f"* {widened} 件は基準値を測ったときのぶれが大きかったため、しきい値を {threshold:g}% から広げています"
+              "（--save で取り直すと狭まることがあります）")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基準値の JSON（既定: %(default)s）")
+    parser.add_argument("--save", action="store_true", help="比べずに、測った値を基準値として保存する")
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("MICROBENCH_THRESHOLD", "25")),
+                        help="これ以上（%%）遅くなったら失敗にする（既定: %(default)s）")
+    parser.add_argument("--noise-floor", type=float, default=float(os.getenv("MICROBENCH_NOISE_FLOOR", "5")),
+                        help="遅くなった差がこれ（µs。ただし基準値の 1 割まで）未満なら失敗にしない（既定: %(default)s）")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="一覧を測る辞書の行数")
+    parser.add_argument("--only", action="append", help="名前にこの文字列を含むものだけ測る（複数可）")
+    parser.add_argument("--min-time", type=float, default=0.2, help="1 回の計測の最短秒数")
+    parser.add_argument("--repeat", type=int, default=9, help="1 プロセスで測る回数")
+    parser.add_argument("--processes", type=int, default=3, help="グループごとに測るプロセスの数")
+    parser.add_argument("--retries", type=int, default=2,
+                        help="しきい値を超えたものを測り直す回数（それまでの結果と合わせて判定する）")
+    parser.add_argument("--fixtures", help="一覧用の DB を置いて使い回すディレクトリ（既定は一時ディレクトリ）")
+    parser.add_argument("--child", help=SUPPRESS)
+    parser.add_argument("--size", type=int, default=0, help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.size, args.min_time, args.repeat, args.only)
+        return
+
+    groups = [("app", 0), ("dictionary", 0)]
+    groups += [(f"listing-{size_label(size)}", size) for size in map(int, args.sizes.split(","))]
+
+    baseline = {}
+    if not args.save:
+        if not os.path.exists(args.baseline):
+            raise SystemExit(f"基準値 {args.baseline} がありません（--save で作ってください）")
+        with open(args.baseline, encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("machine", {}).get("python") != platform.python_version():
+            print(f"注意: 基準値は Python {saved.get('machine', {}).get('python')} で測ったものです", file=sys.stderr)
+        baseline = {name: base for name, base in saved.get("results", {}).items() if "relative" in base}
+        if len(baseline) < len(saved.get("results", {})):
+            print("注意: relative の無い古い基準値は比べません（--save で取り直してください）", file=sys.stderr)
+
+    fixtures = args.fixtures or tempfile.mkdtemp(prefix="microbench-")
+    os.makedirs(fixtures, exist_ok=True)
+    try:
+        samples = measure_groups(groups, args, fixtures, args.only, {})
+        results = summarize(samples)
+        for _ in range(args.retries if not args.save else 0):
+            names = regressions(results, baseline, args.threshold, args.noise_floor)
+            if not names:
+                break
+            print(f"--  しきい値を超えた {len(names)} 件を測り直します", file=sys.stderr)
+            results = summarize(measure_groups(groups, args, fixtures, names, samples))
+    finally:
+        if not args.fixtures:
+            shutil.rmtree(fixtures, ignore_errors=True)
+
+    if args.save:
+        # 前回の基準値のうち今回測らなかったものは残す
+        saved = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                saved = json.load(f).get("results", {})
+        saved.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                            "processor": platform.processor() or platform.machine(), "cpus": os.cpu_count()},
+                "results": dict(sorted(saved.items())),
+            }, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        for name, result in results.items():
+            print(f"{name:<34} {result['median_us']:>12.2f} µs  （ぶれ {result['noise_pct']:.0f}%）"
+                  + ("  ※しきい値より大きい" if result["noise_pct"] > args.threshold else ""))
+        print(f"基準値を {args.baseline} に保存しました")
+        return
+
+    report(results, baseline, args.threshold, args.noise_floor)
+    failed = regressions(results, baseline, args.threshold, args.noise_floor)
+    if failed:
+        print(f"{len(failed)} 件がしきい値を超えて遅くなりました")
+        sys.exit(1)
+    print(f"ok（しきい値 {args.threshold:g}%）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+辞書のよく使うクエリが索引を使っているかの確認（EXPLAIN QUERY PLAN）。
+
+    $ python bench/query_plans.py                 # 一時 DB に最新のスキーマを作って確かめる
+    $ python bench/query_plans.py --db dictionary.db
+
+スキーマやクエリを変えて、表の全件走査や一時 B-tree での並べ替えが起きるようになったら
+終了コード 1 で抜ける。
+"""
+
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import dictionary
+import migrations
+import search
+
+USER = "U-me"
+
+SEARCH_SQL, SEARCH_PARAMS = search.search_query(["ハウンド", "追"], USER, 10)
+
+# (名前, クエリ, パラメーター, 計画に含まれていなければならない文字列[, FORBIDDEN のうち許すもの])
+CHECKS = [
+    ("公開の単語を引く", dictionary.ENTRY_SQL, ("term1", ""),
+     "SEARCH dictionary USING PRIMARY KEY (term=? AND owner=?)"),
+    ("自分専用の単語を引く", dictionary.ENTRY_SQL, ("term1", USER),
+     "SEARCH dictionary USING PRIMARY KEY (term=? AND owner=?)"),
+    ("登録済みの (単語, owner) の集合", dictionary.KEYS_SQL, (),
+     "COVERING INDEX dictionary_listing"),
+    ("削除できる登録を探す", dictionary.OWN_ENTRY_SQL, ("term1", USER, USER),
+     "SEARCH dictionary USING PRIMARY KEY (term=? AND owner=?)"),
+    ("一覧の区切り", dictionary.PUBLIC_BLOCKS_SQL, (64,),
+     "SCAN dictionary USING COVERING INDEX dictionary_public"),
+    ("区切りの中の件数", dictionary.PUBLIC_COUNT_SQL.format(upper=" AND term < ?"), ("t", "u"),
+     "SEARCH dictionary USING COVERING INDEX dictionary_public (term>? AND term<?)"),
+    ("区切りの中の単語", dictionary.PUBLIC_TERMS_SQL.format(upper=" AND term < ?"), ("t", "u"),
+     "SEARCH dictionary USING COVERING INDEX dictionary_public (term>? AND term<?)"),
+    ("区切りの中の n 番目", dictionary.PUBLIC_NTH_SQL, ("t", 5),
+     "SEARCH dictionary USING COVERING INDEX dictionary_public (term>?)"),
+    ("自分専用の単語（頭文字）", dictionary.PRIVATE_TERMS_SQL.format(range=dictionary.TERM_RANGE_SQL), (USER, "t", "u"),
+     "SEARCH dictionary USING COVERING INDEX dictionary_private (owner=? AND term>? AND term<?)"),
+    ("一覧の1ページ", dictionary.LISTING_PAGE_SQL.format(range=""), ("term1", "", USER, 10),
+     "SEARCH dictionary USING PRIMARY KEY ((term,owner)>(?,?))"),
+    ("一覧の1ページ（頭文字）", dictionary.LISTING_PAGE_SQL.format(range=dictionary.TERM_RANGE_SQL),
+     ("term1", "", "t", "u", USER, 10), "SEARCH dictionary USING PRIMARY KEY ((term,owner)>(?,?) AND term<?)"),
+    ("削除の投票先を確かめる", dictionary.PUBLIC_ENTRY_SQL, ("term1",),
+     "SEARCH dictionary USING PRIMARY KEY (term=? AND owner=?)"),
+    ("削除の票数", dictionary.VOTE_COUNT_SQL, ("term1",),
+     "SEARCH delete_vote_counts USING PRIMARY KEY (term=?)"),
+    # 関連度順に並べるので一時 B-tree は避けられない（並べるのは全文検索に当たった行だけ）
+    ("全文検索", SEARCH_SQL, SEARCH_PARAMS, "SEARCH s USING INTEGER PRIMARY KEY (rowid=?)", ("USE TEMP B-TREE",)),
+]
+
+# どのクエリの計画にも出てきてはいけないもの（並べ替え用の一時 B-tree と、索引を使わない全件走査）
+FORBIDDEN = ("USE TEMP B-TREE", "SCAN dictionary\n")
+
+
+def fill(conn, rows, seed=1):
+    """ANALYZE したときに実際の使われ方に近い統計が出るよう、公開と自分専用を混ぜて入れる"""
+    rng = random.Random(seed)
+    users = [f"U{i}" for i in range(50)] + [USER]
+    with conn:
+        conn.executemany(
+            "INSERT INTO dictionary (term, owner, content, added_by) VALUES (?, ?, ?, ?)",
+            (
+                (f"term{i}", user if rng.random() < 0.2 else "", f"content{i}", user)
+                for i in range(rows)
+                for user in (rng.choice(users),)
+            ),
+        )
+        conn.execute("ANALYZE")
+
+
+def query_plan(conn, sql, params):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", help="確かめる DB（省略時は一時 DB に --rows 件入れて確かめる）")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("-v", "--verbose", action="store_true", help="すべての計画を表示する")
+    args = parser.parse_args()
+
+    if args.db:
+        conn = sqlite3.connect(args.db)
+        if migrations.current_version(conn) < migrations.latest_version():
+            sys.exit(f"{args.db} のスキーマが古いので、先に python migrations.py --db {args.db} を実行してください")
+    else:
+        tmpdir = tempfile.mkdtemp(prefix="dictionary-plans-")
+        conn = sqlite3.connect(os.path.join(tmpdir, "dictionary.db"))
+        migrations.migrate(conn)
+        fill(conn, args.rows)
+
+    failures = 0
+    for name, sql, params, expected, *allowed in CHECKS:
+        if "dictionary_fts" in sql and not search.has_search_index(conn):
+            print(f"--  {name}（全文検索の索引がありません）")
+            continue
+        allowed = allowed[0] if allowed else ()
+        plan = query_plan(conn, sql, params)
+        text = "\n".join(plan) + "\n"
+        problems = []
+        if expected not in text:
+            problems.append(f"「{expected}」がありません")
+        problems.extend(f"「{f.strip()}」があります" for f in FORBIDDEN if f in text and f not in allowed)
+        failures += bool(problems)
+        print(f"{'NG' if problems else 'ok'}  {name}")
+        for problem in problems:
+            print(f"      {problem}")
+        if problems or args.verbose:
+            for line in plan:
+                print(f"      | {line}")
+    conn.close()
+    if not args.db:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
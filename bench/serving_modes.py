@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+同期モード（python app.py）と ASGI モード（uvicorn asgi_app:application）の負荷比較。
+
+    $ pip install uvicorn
+    $ python bench/serving_modes.py --requests 2000 --concurrency 200 --line-latency 0.2
+
+LINE と Apex API はスタブサーバーに向けるので外部には一切アクセスしない。
+Webhook の応答時間（ack）と、スタブに返信が届くまでの時間（reply）をそれぞれ集計する。
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stubs import LineStub, ApexStub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHANNEL_SECRET = "bench-channel-secret"
+MESSAGES = ["?R-99", "?マップ", "?ボーダー", "?ヘルプ", "おはよう", "?ウィングマン"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_body(i, text, user_id=None):
+    return json.dumps({
+        "destination": "Ubench",
+        "events": [{
+            "type": "message",
+            "mode": "active",
+            "timestamp": int(time.time() * 1000),
+            "webhookEventId": f"bench{i}",
+            "deliveryContext": {"isRedelivery": False},
+            "replyToken": f"token{i}",
+            "source": {"type": "user", "userId": user_id or f"U{i % 50}"},
+            "message": {"type": "text", "id": str(i), "text": text, "quoteToken": "q"},
+        }],
+    }, ensure_ascii=False)
+
+
+def sign(body, secret=CHANNEL_SECRET):
+    digest = hmac.new(secret.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+
+def start_app(mode, port, line_url, apex_url, workdir, secret=CHANNEL_SECRET):
+    # 手元の DICTIONARY_DB_PATH や DATABASE_URL（同梱の dictionary.db など）に書き込まないよう、
+    # 辞書は必ず workdir にコピーした SQLite を使わせる
+    env = dict(os.environ,
+               DATABASE_URL="",
+               DICTIONARY_DB_PATH=os.path.join(workdir, "dictionary.db"),
+               LINE_CHANNEL_SECRET=secret,
+               LINE_CHANNEL_ACCESS_TOKEN="bench-token",
+               LINE_API_ENDPOINT=line_url,
+               APEX_API_BASE=apex_url,
+               APEX_API_KEY="bench",
+               PORT=str(port),
+               PYTHONPATH=ROOT)
+    if mode == "sync":
+        cmd = [sys.executable, os.path.join(ROOT, "app.py")]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi_app:application",
+               "--port", str(port), "--log-level", "warning", "--backlog", "4096"]
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{mode} モードのサーバーが起動しませんでした")
+
+
+async def drive(url, total, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    sent = {}
+    acks = []
+    errors = 0
+
+    async def one(session, i):
+        nonlocal errors
+        body = make_body(i, MESSAGES[i % len(MESSAGES)])
+        headers = {"X-Line-Signature": sign(body), "Content-Type": "application/json"}
+        async with sem:
+            start = time.perf_counter()
+            sent[f"token{i}"] = start
+            try:
+                async with session.post(url, data=body.encode("utf-8"), headers=headers) as resp:
+                    await resp.read()
+                    if resp.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            acks.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(session, i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+    return sent, acks, errors, elapsed
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run_mode(mode, args):
+    line = LineStub(latency=args.line_latency).start()
+    apex = ApexStub(latency=args.apex_latency).start()
+    workdir = tempfile.mkdtemp()
+    shutil.copy(os.path.join(ROOT, "dictionary.db"), workdir)
+    port = free_port()
+    proc = start_app(mode, port, line.url, apex.url, workdir)
+    try:
+        sent, acks, errors, elapsed = asyncio.run(drive(f"http://127.0.0.1:{port}/callback", args.requests, args.concurrency))
+        # 返信がすべて届くまで待つ（「おはよう」は辞書に無いので返信されない）
+        expected = sum(1 for i in range(args.requests) if MESSAGES[i % len(MESSAGES)] != "おはよう")
+        deadline = time.time() + args.drain_timeout
+        while len(line.replies) < expected and time.time() < deadline:
+            time.sleep(0.05)
+        reply_lat = [line.replies[t] - sent[t] for t in line.replies if t in sent]
+    finally:
+        proc.terminate()
+        proc.wait(10)
+        line.stop()
+        apex.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "mode": mode,
+        "webhooks/s": args.requests / elapsed,
+        "errors": errors,
+        "ack p50": percentile(acks, 50) * 1000,
+        "ack p99": percentile(acks, 99) * 1000,
+        "replies": f"{len(reply_lat)}/{expected}",
+        "reply p50": percentile(reply_lat, 50) * 1000,
+        "reply p99": percentile(reply_lat, 99) * 1000,
+        "apex calls": apex.calls,
+    }
+
+
+def main():
+    parser = ArgumentParser(description="同期モードと ASGI モードの負荷比較")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--line-latency", type=float, default=0.1, help="LINE スタブの応答遅延（秒）")
+    parser.add_argument("--apex-latency", type=float, default=0.3, help="Apex スタブの応答遅延（秒）")
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--modes", default="sync,asgi")
+    args = parser.parse_args()
+
+    results = [run_mode(mode, args) for mode in args.modes.split(",")]
+    for r in results:
+        print(" | ".join(f"{k}: {v:.1f}" if isinstance(v, float) else f"{k}: {v}" for k, v in r.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+辞書の保存先（SQLite / PostgreSQL）がどちらも同じように動くかの確認。
+
+    $ python bench/store_suite.py                                        # SQLite（一時 DB）
+    $ python bench/store_suite.py --postgres postgresql://localhost/test  # SQLite と PostgreSQL
+
+dictionary.py の公開関数（追加・削除・削除投票・引き当て・一覧・検索・もしかして）と、
+別の dyno から書き込まれたときにキャッシュが追従するかを、保存先ごとに別プロセスで確かめる。
+PostgreSQL では使い捨てのスキーマを作ってその中で確かめ、終わったら消す。
+どれかが期待と食い違ったら終了コード 1 で抜ける。
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import SUPPRESS, ArgumentParser
+from urllib.parse import quote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHECKS = []
+
+
+def check(func):
+    CHECKS.append(func)
+    return func
+
+
+class Failures(list):
+    def expect(self, name, got, want):
+        if got != want:
+            self.append(f"{name}: {got!r}（期待値 {want!r}）")
+
+
+@check
+def add_and_lookup(d, failures):
+    d.add_dictionary_entry("apple", "public", "U1", False)
+    d.add_dictionary_entry("apple", "mine", "U2", True)
+    d.add_dictionary_entry("apple", "theirs", "U3", True)
+    failures.expect("公開の登録", d.lookup_dictionary_entry("apple", "U1"), "public")
+    failures.expect("自分専用が優先", d.lookup_dictionary_entry("apple", "U2"), "mine")
+    failures.expect("他の人の自分専用とぶつからない", d.lookup_dictionary_entry("apple", "U3"), "theirs")
+    failures.expect("登録の無い単語", d.lookup_dictionary_entry("no-such-term", "U1"), None)
+    d.add_dictionary_entry("apple", "public 2", "U1", False)
+    failures.expect("上書き", d.lookup_dictionary_entry("apple", "U4"), "public 2")
+
+
+@check
+def delete(d, failures):
+    d.add_dictionary_entry("cherry", "public", "U1", False)
+    d.add_dictionary_entry("cherry", "mine", "U2", True)
+    failures.expect("自分専用だけ消せる", d.delete_dictionary_entry("cherry", "U2"), True)
+    failures.expect("公開は残る", d.lookup_dictionary_entry("cherry", "U2"), "public")
+    failures.expect("登録していない人は消せない", d.delete_dictionary_entry("cherry", "U3"), None)
+    failures.expect("追加した人は消せる", d.delete_dictionary_entry("cherry", "U1"), False)
+    failures.expect("消えている", d.lookup_dictionary_entry("cherry", "U1"), None)
+    d.add_dictionary_entry("damson", "public", "U1", False)
+    d.add_dictionary_entry("damson", "mine", "U1", True)
+    failures.expect("両方あれば自分専用から消す", d.delete_dictionary_entry("damson", "U1"), True)
+    failures.expect("自分の公開は残る", d.lookup_dictionary_entry("damson", "U1"), "public")
+    failures.expect("次は公開を消す", d.delete_dictionary_entry("damson", "U1"), False)
+    failures.expect("両方消えている", d.lookup_dictionary_entry("damson", "U1"), None)
+
+
+@check
+def delete_votes(d, failures):
+    required = d.DICTIONARY_DELETE_VOTES
+    d.add_dictionary_entry("vote", "v1", "U1", False)
+    failures.expect("1票目", d.vote_dictionary_delete("vote", "V1"), (True, 1))
+    failures.expect("二重投票", d.vote_dictionary_delete("vote", "V1"), (False, 1))
+    d.add_dictionary_entry("vote", "v2", "U1", False)
+    failures.expect("書き換えで票が消える", d.vote_dictionary_delete("vote", "V2"), (True, 1))
+    for i in range(2, required):
+        d.vote_dictionary_delete("vote", f"V{i + 1}")
+    failures.expect("規定数の手前", d.lookup_dictionary_entry("vote", "U1"), "v2")
+    failures.expect("規定数に達した", d.vote_dictionary_delete("vote", "V-last"), (True, required))
+    failures.expect("消えている", d.lookup_dictionary_entry("vote", "U1"), None)
+    failures.expect("登録の無い単語", d.vote_dictionary_delete("vote", "V1"), None)
+    d.add_dictionary_entry("vote-private", "p", "U1", True)
+    failures.expect("自分専用には投票できない", d.vote_dictionary_delete("vote-private", "V1"), None)
+
+
+@check
+def listing(d, failures):
+    for i in range(25):
+        d.add_dictionary_entry(f"L{i:02d}", f"content {i}", "U1", i % 10 == 9)
+    rows, page, total = d.list_dictionary_entries("L", 1, "U1")
+    failures.expect("1ページ目", ([r["term"] for r in rows], page, total), ([f"L{i:02d}" for i in range(10)], 1, 3))
+    failures.expect("自分専用の印", [bool(r["is_private"]) for r in rows], [i == 9 for i in range(10)])
+    rows, page, total = d.list_dictionary_entries("L", 99, "U1")
+    failures.expect("最後のページに丸める", ([r["term"] for r in rows], page), ([f"L{i:02d}" for i in range(20, 25)], 3))
+    rows, page, total = d.list_dictionary_entries("L", 1, "U2")
+    failures.expect("他の人の自分専用は見えない", (len(rows), total), (10, 3))
+    failures.expect("他の人の自分専用は見えない（2ページ目）",
+                    [r["term"] for r in d.list_dictionary_entries("L", 2, "U2")[0]],
+                    ["L11", "L12", "L13", "L14", "L15", "L16", "L17", "L18", "L20", "L21"])
+    failures.expect("一致なし", d.list_dictionary_entries("Q", 1, "U1"), ([], 0, 0))
+
+
+@check
+def listing_after_writes(d, failures):
+    def terms(page, user_id):
+        rows, _, total = d.list_dictionary_entries("M", page, user_id)
+        return [r["term"] for r in rows], total
+
+    for i in range(0, 40, 2):
+        d.add_dictionary_entry(f"M{i:02d}", "public", "U1", False)
+    failures.expect("数えた直後", terms(2, "U1"), ([f"M{i:02d}" for i in range(20, 40, 2)], 2))
+    d.add_dictionary_entry("M01", "public", "U1", False)
+    d.add_dictionary_entry("M03", "mine", "U2", True)
+    failures.expect("公開の追加で後ろにずれる", terms(2, "U1"), ([f"M{i:02d}" for i in range(18, 38, 2)], 3))
+    failures.expect("自分専用も数える", terms(2, "U2"), ([f"M{i:02d}" for i in range(16, 36, 2)], 3))
+    d.delete_dictionary_entry("M00", "U1")
+    failures.expect("削除で前に詰まる", terms(2, "U1"), ([f"M{i:02d}" for i in range(20, 40, 2)], 2))
+
+
+@check
+def search(d, failures):
+    d.add_dictionary_entry("ハウンド", "追跡が得意なレジェンド", "U1", False)
+    d.add_dictionary_entry("ブラッドハウンド", "スキャンで敵を追う", "U1", False)
+    d.add_dictionary_entry("ハウンド秘密", "自分だけのメモ", "U2", True)
+
+    def terms(query, user_id):
+        return sorted(r["term"] for r in d.search_dictionary_entries(query, user_id))
+
+    failures.expect("単語で探す", terms("ハウンド", "U1"), ["ハウンド", "ブラッドハウンド"])
+    failures.expect("自分専用も見える", terms("ハウンド", "U2"), ["ハウンド", "ハウンド秘密", "ブラッドハウンド"])
+    failures.expect("内容で探す（短い語）", terms("追", "U1"), ["ハウンド", "ブラッドハウンド"])
+    failures.expect("すべての語を含む", terms("ハウンド スキャン", "U1"), ["ブラッドハウンド"])
+    failures.expect("LIKE の記号はそのまま探す", terms("100%", "U1"), [])
+
+
+@check
+def suggestions(d, failures):
+    d.add_dictionary_entry("banana", "yellow", "U1", False)
+    d.add_dictionary_entry("bandana", "cloth", "U2", True)
+    failures.expect("近い単語", d.suggest_dictionary_terms("bananx", "U1"), ["banana"])
+    failures.expect("他の人の自分専用は出さない", "bandana" in d.suggest_dictionary_terms("bandanx", "U1"), False)
+
+
+@check
+def other_instance(d, failures):
+    # 別の dyno と同じく、このプロセスのキャッシュを通らずに同じ DB へ書き込む
+    import store
+    from db import ConnectionManager
+
+    if isinstance(d.store, store.SQLiteStore):
+        other = store.SQLiteStore(ConnectionManager(d.store._connections.path))
+    else:
+        other = store.PostgresStore(os.environ["DATABASE_URL"], min_size=1, max_size=1)
+
+    def write(op, *args):
+        with other.connection() as conn:
+            other.begin(conn)
+            op(conn, *args)
+            conn.commit()
+
+    d.add_dictionary_entry("remote", "before", "U1", False)
+    failures.expect("キャッシュに載せる", d.lookup_dictionary_entry("remote", "U1"), "before")
+    write(d._add_entry, "remote", "after", "U1", False)
+    write(d._add_entry, "remote-new", "new", "U1", False)
+    time.sleep(d.store._sync_interval if hasattr(d.store, "_sync_interval") else 0)
+    failures.expect("別の接続の上書き", d.lookup_dictionary_entry("remote", "U1"), "after")
+    failures.expect("別の接続の追加", d.lookup_dictionary_entry("remote-new", "U1"), "new")
+    write(d._delete_entry, "remote", "U1")
+    time.sleep(d.store._sync_interval if hasattr(d.store, "_sync_interval") else 0)
+    failures.expect("別の接続の削除", d.lookup_dictionary_entry("remote", "U1"), None)
+    other.close()
+
+
+@check
+def concurrent_writes(d, failures):
+    def run(n):
+        for i in range(50):
+            d.add_dictionary_entry(f"c-{n}-{i}", f"{n}/{i}", f"U{n}", i % 2 == 0)
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    missing = [(n, i) for n in range(8) for i in range(50) if d.lookup_dictionary_entry(f"c-{n}-{i}", f"U{n}") != f"{n}/{i}"]
+    failures.expect("同時に追加した分がすべて引ける", missing, [])
+
+
+def child():
+    sys.path.insert(0, ROOT)
+    import dictionary
+
+    results = {}
+    for func in CHECKS:
+        failures = Failures()
+        try:
+            func(dictionary, failures)
+        except Exception as e:
+            failures.append(f"{type(e).__name__}: {e}")
+        results[func.__name__] = failures
+    dictionary.writer.shutdown(10)
+    print(json.dumps(results, ensure_ascii=False))
+
+
+def run_backend(name, env):
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child"],
+        env=dict(os.environ, **env), capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if proc.returncode != 0 or not proc.stdout.strip():
+        print(f"NG  {name}: 子プロセスが異常終了しました\n{proc.stderr}")
+        return 1
+    results = json.loads(proc.stdout.strip().splitlines()[-1])
+    failed = 0
+    for check_name, failures in results.items():
+        failed += bool(failures)
+        print(f"{'NG' if failures else 'ok'}  {name} {check_name}")
+        for failure in failures:
+            print(f"      {failure}")
+    print(f"--  {name}: {len(results) - failed}/{len(results)} ok（{elapsed:.1f} 秒）")
+    return failed
+
+
+def postgres_schema(url):
+    """使い捨てのスキーマを作り、(そのスキーマを使う URL, 片付ける関数) を返す"""
+    import psycopg
+
+    schema = f"dictionary_suite_{os.getpid()}"
+    with psycopg.connect(url, autocommit=True) as conn:
+        conn.execute(f"CREATE SCHEMA {schema}")
+    scoped = url + ("&" if "?" in url else "?") + "options=" + quote(f"-csearch_path={schema}")
+
+    def drop():
+        with psycopg.connect(url, autocommit=True) as conn:
+            conn.execute(f"DROP SCHEMA {schema} CASCADE")
+    return scoped, drop
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--postgres", metavar="URL", help="PostgreSQL でも確かめる（スキーマを作れる権限が必要）")
+    parser.add_argument("--child", action="store_true", help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return
+
+    common = {"DICTIONARY_DELETE_VOTES": "3", "DICTIONARY_SYNC_INTERVAL": "0"}
+    failed = 0
+    tmpdir = tempfile.mkdtemp(prefix="dictionary-store-")
+    try:
+        failed += run_backend("sqlite", dict(
+            common, DATABASE_URL="", DICTIONARY_DB_PATH=os.path.join(tmpdir, "dictionary.db"),
+        ))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if args.postgres:
+        url, drop = postgres_schema(args.postgres)
+        try:
+            failed += run_backend("postgres", dict(common, DATABASE_URL=url))
+        finally:
+            drop()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
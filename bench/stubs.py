@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+負荷試験用のスタブサーバー（LINE Messaging API と mozambiquehe.re の代わり）。
+どちらも ThreadingHTTPServer で動き、latency 秒だけ待ってから応答する。
+"""
+
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, handler_class, latency=0.0):
+        super().__init__(("127.0.0.1", 0), handler_class)
+        self.latency = latency
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # ヘッダーと本文は別々に書き出されるので、Nagle が効いていると keep-alive の接続では
+    # 相手の遅延 ACK を待って1往復ごとに数十ミリ秒止まる（接続を使い回すクライアントだけが遅く見える）
+    disable_nagle_algorithm = True
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _LineHandler(_JsonHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = json.loads(self.rfile.read(length) or b"{}")
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.path.startswith("/v2/bot/message/reply"):
+            with self.server.lock:
+                self.server.replies[data.get("replyToken")] = time.perf_counter()
+        # 本物と同じく送ったメッセージごとに1件返す（空だと SDK が応答の検証で例外にする）
+        messages = data.get("messages") or [None]
+        self._send_json({"sentMessages": [{"id": str(i), "quoteToken": f"q{i}"} for i in range(len(messages))]})
+
+
+class LineStub(_StubServer):
+    """返信を受け取った時刻を reply token ごとに replies に記録する。"""
+
+    def __init__(self, latency=0.0):
+        super().__init__(_LineHandler, latency)
+        self.replies = {}
+
+
+class _ApexHandler(_JsonHandler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.calls += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        now = int(time.time())
+        if self.path.startswith("/maprotation"):
+            self._send_json({
+                "battle_royale": {
+                    "current": {"map": "Olympus", "start": now - 600, "end": now + 3000, "remainingTimer": "00:50:00"},
+                    "next": {"map": "Storm Point"},
+                },
+                "ranked": {
+                    "current": {"map": "E-District", "start": now - 600, "end": now + 6600, "remainingTimer": "01:50:00"},
+                    "next": {"map": "Broken Moon"},
+                },
+                "ltm": {
+                    "current": {"map": "Skulltown", "eventName": "Gun Run", "start": now - 60, "end": now + 840, "remainingTimer": "00:14:00"},
+                    "next": {"map": "Monument", "eventName": "Control"},
+                },
+            })
+        elif self.path.startswith("/predator"):
+            self._send_json({"RP": {
+                "PC": {"val": 15000, "totalMastersAndPreds": 30000},
+                "PS4": {"val": 12000, "totalMastersAndPreds": 25000},
+                "X1": {"val": 11000, "totalMastersAndPreds": 9000},
+            }})
+        else:
+            self._send_json({"Error": "not found"}, status=404)
+
+
+class ApexStub(_StubServer):
+    """/maprotation と /predator だけを返す。calls に呼び出し回数を数える。"""
+
+    def __init__(self, latency=0.0):
+        super().__init__(_ApexHandler, latency)
+        self.calls = 0
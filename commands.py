@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+_END = object()
+
+
+def normalize_command(text):
+    """コマンド照合用のキー。前後の空白だけを取り除く（文中の空白や改行はそのまま）。"""
+    return text.strip()
+
+
+class CommandRouter:
+    """
+    メッセージ → 処理関数の振り分け表。
+    完全一致のコマンドは dict を1回引くだけ、「辞書 追加」のような引数付きコマンドは
+    接頭辞のトライ木をメッセージの先頭からたどるだけで決まるので、
+    武器やレジェンドの登録数が増えても振り分けのコストは変わらない。
+
+    処理関数は (event, arg) を受け取り、返信メッセージのリスト（返信しないなら None）を返す。
+    arg は完全一致ならキーそのもの、接頭辞一致なら接頭辞より後ろの文字列、
+    どれにも当たらず fallback に回った場合は正規化したメッセージ全体。
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._tables = []
+        self._trie = {}
+        self._fallback = None
+
+    def add(self, key, func):
+        self._exact[normalize_command(key)] = func
+
+    def add_table(self, table, func):
+        """
+        キーの集合（`in` で引けるもの）をまとめて完全一致のコマンドとして登録する。
+        後から中身が入れ替わる表（読み直されるデータファイルなど）向け。
+        """
+        self._tables.append((table, func))
+
+    def add_prefix(self, prefix, func):
+        node = self._trie
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        node[_END] = func
+
+    def command(self, *keys):
+        """完全一致のコマンドとして登録するデコレーター"""
+        def decorator(func):
+            for key in keys:
+                self.add(key, func)
+            return func
+        return decorator
+
+    def prefix(self, prefix):
+        """接頭辞一致のコマンドとして登録するデコレーター（長い接頭辞が優先される）"""
+        def decorator(func):
+            self.add_prefix(prefix, func)
+            return func
+        return decorator
+
+    def fallback(self, func):
+        """どのコマンドにも当たらなかったときの処理として登録するデコレーター"""
+        self._fallback = func
+        return func
+
+    def match(self, text):
+        """
+        (処理関数, 引数, 当たったコマンド) を返す。当たったコマンドは完全一致ならキー、
+        接頭辞一致なら接頭辞で、fallback に回ったときは None（ログに利用者の発言を残さないため）。
+        """
+        key = normalize_command(text)
+        func = self._exact.get(key)
+        if func is not None:
+            return func, key, key
+        for table, func in self._tables:
+            if key in table:
+                return func, key, key
+
+        found = None
+        node = self._trie
+        for i, ch in enumerate(key):
+            node = node.get(ch)
+            if node is None:
+                break
+            if _END in node:
+                found = (node[_END], key[i + 1:], key[:i + 1])
+        if found is not None:
+            return found
+        return self._fallback, key, None
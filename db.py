@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import os
+import sqlite3
+import threading
+import weakref
+import logging
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("DICTIONARY_DB_PATH", "dictionary.db")
+
+# 接続ごとに設定する PRAGMA
+# WAL にしておくと書き込み中でも読み込みがブロックされない
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")),  # FULL ならコミットごとに fsync する
+    ("busy_timeout", os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    ("mmap_size", os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024))),
+    ("cache_size", os.getenv("SQLITE_CACHE_SIZE", "-8000")),  # 負の値は KiB 単位（約8MB）
+    ("temp_store", "MEMORY"),
+)
+# 接続ごとにキャッシュしておくプリペアドステートメントの数
+CACHED_STATEMENTS = 256
+
+
+class _Slot:
+    """スレッドローカルに置く接続の入れ物。スレッドが終わると捨てられるので、それを合図に接続を閉じる。"""
+
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+class ConnectionManager:
+    """
+    スレッドごとに1本の SQLite 接続を開いたまま使い回す。
+    接続は最初に使うときに開き、そのスレッドが終わったとき（リクエストごとにスレッドを立てる
+    Flask の開発サーバーなど）か、プロセス終了時に閉じる。
+    """
+
+    def __init__(self, path=DB_PATH, pragmas=PRAGMAS):
+        self._path = path
+        self._pragmas = pragmas
+        self._local = threading.local()
+        # スレッドの終了時に閉じる処理は、どのスレッドのどこで走るか分からないので再入できるロックにする
+        self._lock = threading.RLock()
+        self._connections = set()
+
+    @property
+    def path(self):
+        return self._path
+
+    def get(self):
+        slot = getattr(self._local, "slot", None)
+        if slot is None:
+            slot = self._local.slot = _Slot(self._connect())
+            weakref.finalize(slot, self._release, slot.conn)
+        return slot.conn
+
+    def _connect(self):
+        # 閉じるのはスレッドの終了時や atexit（別スレッド）からなので check_same_thread は外しておく
+        conn = sqlite3.connect(
+            self._path,
+            timeout=int(dict(self._pragmas).get("busy_timeout", 5000)) / 1000,
+            check_same_thread=False,
+            cached_statements=CACHED_STATEMENTS,
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self._pragmas:
+            conn.execute(f"PRAGMA {name} = {value}")
+        with self._lock:
+            self._connections.add(conn)
+        return conn
+
+    def _release(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+        _close(conn)
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            _close(conn)
+        self._local = threading.local()
+
+
+def _close(conn):
+    try:
+        conn.close()
+    except sqlite3.Error as e:
+        logger.warning("SQLite 接続を閉じられませんでした: %s", e)
+
+
+connections = ConnectionManager()
+atexit.register(connections.close_all)
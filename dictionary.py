@@ -0,0 +1,590 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+
+import metrics
+from search import NgramIndex, search_query
+from store import open_store, record_change
+from tracing import span
+from write_queue import WriteBehindQueue
+
+# よく引かれる単語を覚えておく件数
+DICTIONARY_CACHE_SIZE = int(os.getenv("DICTIONARY_CACHE_SIZE", "4096"))
+# 一覧表示の1ページの件数
+DICTIONARY_PAGE_SIZE = 10
+# 一覧のページ位置を求めるために、公開の単語を何件ずつの区切りにして数えておくか
+DICTIONARY_PAGE_BLOCK_SIZE = int(os.getenv("DICTIONARY_PAGE_BLOCK_SIZE", "64"))
+# 一覧のために自分専用の単語を覚えておく利用者の数
+DICTIONARY_PAGE_INDEX_SIZE = int(os.getenv("DICTIONARY_PAGE_INDEX_SIZE", "256"))
+# 「辞書 検索」で返す件数
+DICTIONARY_SEARCH_LIMIT = 10
+# 追加・削除をライタースレッドにまとめて書かせるか（0 なら呼び出したスレッドでその場で書く）
+DICTIONARY_WRITE_BEHIND = os.getenv("DICTIONARY_WRITE_BEHIND", "1") != "0"
+# 1トランザクションにまとめる書き込みの上限と、後続を待つ時間（ミリ秒）
+DICTIONARY_WRITE_BATCH = int(os.getenv("DICTIONARY_WRITE_BATCH", "256"))
+DICTIONARY_WRITE_DELAY_MS = float(os.getenv("DICTIONARY_WRITE_DELAY_MS", "0"))
+# 公開の単語を何票で消すか（追加した本人以外が「辞書 削除」すると1票になる）
+DICTIONARY_DELETE_VOTES = int(os.getenv("DICTIONARY_DELETE_VOTES", "3"))
+
+# よく使うクエリ（bench/query_plans.py で索引が使われているかを確かめている）。
+# SQLite と PostgreSQL のどちらでも動く書き方にしておくこと（store.py を参照）
+# owner は公開なら ''、自分専用なら登録した人の user_id
+ENTRY_SQL = "SELECT content FROM dictionary WHERE term = ? AND owner = ?"
+KEYS_SQL = "SELECT term, owner FROM dictionary"
+# 自分専用と公開の両方を登録していたら、引いたときに出る自分専用の方から消す
+OWN_ENTRY_SQL = (
+    "SELECT owner FROM dictionary WHERE term = ? AND owner IN ('', ?) AND added_by = ?"
+    " ORDER BY owner DESC LIMIT 1"
+)
+TERM_RANGE_SQL = " AND term >= ? AND term < ?"
+PUBLIC_ENTRY_SQL = "SELECT 1 FROM dictionary WHERE term = ? AND owner = ''"
+VOTE_SQL = "INSERT INTO delete_votes (term, voter_id) VALUES (?, ?) ON CONFLICT (term, voter_id) DO NOTHING"
+VOTE_COUNT_SQL = "SELECT votes FROM delete_vote_counts WHERE term = ?"
+# 一覧のページ位置（PageIndex）用。どれも公開の単語か自分専用の登録だけの部分索引の範囲検索になる
+# （owner != '' は部分索引を使えると DB に分からせるためのもので、結果は変わらない）
+PUBLIC_BLOCKS_SQL = (
+    "SELECT term FROM ("
+    " SELECT term, row_number() OVER (ORDER BY term) AS n FROM dictionary WHERE owner = ''"
+    ") AS blocks WHERE (n - 1) % ? = 0"
+)
+PUBLIC_COUNT_SQL = "SELECT COUNT(*) FROM dictionary WHERE owner = '' AND term >= ?{upper}"
+PUBLIC_TERMS_SQL = "SELECT term FROM dictionary WHERE owner = '' AND term >= ?{upper} ORDER BY term"
+PUBLIC_NTH_SQL = "SELECT term FROM dictionary WHERE owner = '' AND term >= ? ORDER BY term LIMIT 1 OFFSET ?"
+PRIVATE_TERMS_SQL = "SELECT term FROM dictionary WHERE owner = ? AND owner != ''{range} ORDER BY term"
+LISTING_PAGE_SQL = (
+    "SELECT term, content, added_by, owner != '' AS is_private FROM dictionary"
+    " WHERE (term, owner) >= (?, ?){range} AND owner IN ('', ?)"
+    " ORDER BY term, owner LIMIT ?"
+)
+
+
+# /metrics で出す DB の所要時間（op ごと。entry と keys はキャッシュに無かったときの読み込み）
+db_seconds = metrics.histogram(
+    "bot_db_query_duration_seconds", "辞書の DB の問い合わせにかかった時間（write はライターの1バッチ）",
+    ("op",), metrics.DB_BUCKETS)
+write_batch_size = metrics.histogram(
+    "bot_db_write_batch_size", "1トランザクションにまとめた書き込みの数", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+cache_requests = metrics.cache_requests
+
+
+store = open_store()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+# 保存先の接続を借りる context manager を返す（with の中だけで使うこと）
+def connection():
+    if not _schema_ready:
+        _ensure_schema()
+    return store.connection()
+
+
+def _ensure_schema():
+    # プロセスで最初に使うときにスキーマを最新にしておく
+    global _schema_ready
+    with _schema_lock:
+        if not _schema_ready:
+            with store.connection() as conn:
+                store.prepare(conn)
+            _schema_ready = True
+
+
+class TermCache:
+    """
+    辞書引きの前に置くメモリ上のキャッシュ。
+
+    - 登録されている (単語, owner) の集合を丸ごと持っておき、集合に無い単語（普通の雑談はほぼこれ）は
+      DB を見ずに「無い」と返す。
+    - 集合にあるものは、その内容を (単語, owner) ごとに LRU で覚えておく。
+
+    add / delete のたびに invalidate() を呼ぶこと。集合は「登録されているかもしれない」
+    ものの上位集合であればよいので、削除では集合から外さず LRU だけ捨てる。
+    listener を渡すと、集合に単語が増えるたびに listener.add(単語)、キャッシュを丸ごと
+    捨てたときに listener.reset() を呼ぶ。watch(func) で登録した関数は、(単語, owner) が
+    書き換えられるたびに func(単語, owner)、丸ごと捨てたときに func(None, None) と呼ばれる。
+
+    同じ DB を使う別のプロセス（gunicorn のワーカーや別の dyno）の書き込みは、
+    引くたびに store.change_token()（SQLite なら PRAGMA data_version）を見て、変わっていたら
+    dictionary_changes のまだ見ていない行の分だけ捨てる。表を丸ごと読み直すのは、
+    履歴が消されていて追いつけなかったときだけ。
+    """
+
+    def __init__(self, store, maxsize=DICTIONARY_CACHE_SIZE, listener=None):
+        self._store = store
+        self._maxsize = maxsize
+        self._listener = listener
+        self._lock = threading.Lock()
+        self._keys = None
+        self._rows = OrderedDict()
+        self._generation = 0
+        self._last_change = None
+        self._local = threading.local()
+        self._watchers = []
+
+    def watch(self, func):
+        self._watchers.append(func)
+
+    def lookup(self, conn, term, user_id):
+        """この利用者から見える内容を返す（自分専用の登録があればそちらを優先）。無ければ None。"""
+        self.sync(conn)
+        keys = self._keys
+        if keys is None:
+            keys = self._load_keys(conn)
+        registered = False
+        for owner in (user_id, ""):
+            if (term, owner) in keys:
+                registered = True
+                content = self._content(conn, (term, owner))
+                if content is not None:
+                    return content
+        if not registered:
+            # 集合だけで「無い」と分かった（DB に行かずに済んだ）
+            cache_requests.inc("dictionary", "absent")
+        return None
+
+    def terms(self, conn):
+        """今登録されている（かもしれない）単語の集合の写し"""
+        self.sync(conn)
+        keys = self._keys
+        if keys is None:
+            keys = self._load_keys(conn)
+        with self._lock:
+            return {term for term, _ in keys}
+
+    def _content(self, conn, key):
+        with self._lock:
+            if key in self._rows:
+                self._rows.move_to_end(key)
+                cache_requests.inc("dictionary", "hit")
+                return self._rows[key]
+            generation = self._generation
+
+        cache_requests.inc("dictionary", "miss")
+        with db_seconds.time("entry"), span("db.entry"):
+            row = conn.execute(ENTRY_SQL, key).fetchone()
+        content = row[0] if row else None
+        with self._lock:
+            # 読んでいる間に追加・削除があったら、古いかもしれないのでキャッシュしない
+            if generation == self._generation:
+                self._rows[key] = content
+                if len(self._rows) > self._maxsize:
+                    self._rows.popitem(last=False)
+        return content
+
+    def invalidate(self, term, owner, added=False):
+        with self._lock:
+            self._generation += 1
+            self._rows.pop((term, owner), None)
+            if added and self._keys is not None:
+                self._keys.add((term, owner))
+        if added and self._listener is not None:
+            self._listener.add(term)
+        for func in self._watchers:
+            func(term, owner)
+
+    def clear(self):
+        """キャッシュを丸ごと捨てる（集合も次の引きで読み直す）。"""
+        with self._lock:
+            self._generation += 1
+            self._rows.clear()
+            self._keys = None
+        if self._listener is not None:
+            self._listener.reset()
+        for func in self._watchers:
+            func(None, None)
+
+    def sync(self, conn):
+        """他の接続（別のプロセスや別スレッド）が書き込んでいたら、その分をキャッシュから捨てる。"""
+        token = self._store.change_token(conn)
+        local = self._local
+        if getattr(local, "token", None) == token:
+            return
+        local.token = token
+
+        last_change = self._last_change
+        if last_change is None:
+            # まだ何もキャッシュしていないので、ここから先の変更だけ見ればよい
+            row = conn.execute("SELECT MAX(id) FROM dictionary_changes").fetchone()
+            with self._lock:
+                if self._last_change is None:
+                    self._last_change = row[0] or 0
+            return
+
+        rows = conn.execute(
+            "SELECT id, term, owner FROM dictionary_changes WHERE id > ? ORDER BY id", (last_change,)
+        ).fetchall()
+        if not rows:
+            return
+        # 見ていない間の履歴が消されていたか、owner の無い行（まとめての書き換えや古い形式の履歴）なら、
+        # 何が変わったか分からない
+        lost = rows[0][0] != last_change + 1 and (
+            conn.execute("SELECT MIN(id) FROM dictionary_changes").fetchone()[0] or 0
+        ) > last_change + 1
+        if lost or any(owner is None for _, _, owner in rows):
+            self.clear()
+            with self._lock:
+                self._last_change = max(self._last_change, rows[-1][0])
+            return
+
+        with self._lock:
+            self._generation += 1
+            for _, term, owner in rows:
+                self._rows.pop((term, owner), None)
+                if self._keys is not None:
+                    self._keys.add((term, owner))
+            self._last_change = max(self._last_change, rows[-1][0])
+        if self._listener is not None:
+            for _, term, _ in rows:
+                self._listener.add(term)
+        for func in self._watchers:
+            for _, term, owner in rows:
+                func(term, owner)
+
+    def _load_keys(self, conn):
+        with self._lock:
+            generation = self._generation
+        with db_seconds.time("keys"), span("db.keys"):
+            keys = {(row[0], row[1]) for row in conn.execute(KEYS_SQL)}
+        with self._lock:
+            if self._keys is None and generation == self._generation:
+                self._keys = keys
+            return self._keys if self._keys is not None else keys
+
+
+def _term_range(initial):
+    """頭文字で絞り込むときの term の範囲（LIKE と違って term の索引で範囲検索できる）"""
+    if not initial:
+        return "", ()
+    return TERM_RANGE_SQL, (initial, initial[:-1] + chr(ord(initial[-1]) + 1))
+
+
+class _Blocks:
+    """公開の単語の区切り。starts[i] は i 番目の区切りの先頭の単語（最初は ""）、counts[i] はその件数"""
+
+    __slots__ = ("starts", "counts", "offsets")
+
+    def __init__(self, starts, counts):
+        self.starts = starts
+        self.counts = counts
+        # offsets[i] は i 番目の区切りより前にある公開の単語の数（最後の値が全件数）
+        self.offsets = list(accumulate(counts, initial=0))
+
+    @property
+    def total(self):
+        return self.offsets[-1]
+
+
+class _PrivateTerms:
+    """
+    利用者1人の自分専用の単語（term の順）。ranks は (区切り, {単語: その単語までの公開の単語の数})
+    で、区切りが作り直されたら数え直す
+    """
+
+    __slots__ = ("terms", "ranks")
+
+    def __init__(self, terms):
+        self.terms = terms
+        self.ranks = (None, {})
+
+
+class PageIndex:
+    """
+    一覧表示のページ位置の表。
+
+    公開の単語を block_size 件ずつの区切り（先頭の単語と件数）に分けて全員で共有しておき、
+    N ページ目の先頭は区切りの件数の累計と、区切りの中を数件たどるだけで求める。
+    利用者ごとの自分専用の単語（少ない）は別に覚えておき、公開の並びのどこに入るかを二分探索で数える。
+    OFFSET で読み飛ばすのは区切りの中の数十件だけなので、何ページ目でも、どの頭文字でも同じ手間で済む。
+
+    区切りを全部数えるのは最初と、キャッシュが丸ごと捨てられたとき（まとめての取り込みなど）だけ。
+    公開の単語が追加・削除されたら（TermCache.watch）、その単語を含む区切りだけ数え直し、
+    大きくなりすぎた区切りは分け、空になった区切りは前の区切りにまとめる。
+    自分専用の登録が書き換えられたら、その利用者の分だけ読み直す。
+    """
+
+    def __init__(self, cache, page_size=DICTIONARY_PAGE_SIZE, block_size=DICTIONARY_PAGE_BLOCK_SIZE,
+                 maxsize=DICTIONARY_PAGE_INDEX_SIZE):
+        self._cache = cache
+        self._page_size = page_size
+        self._block_size = block_size
+        self._maxsize = maxsize
+        self._blocks = None
+        # 数え直しが必要な公開の単語と、全部数え直すか（書き込んだスレッドから積まれる）。
+        # 自分専用の単語を覚えている利用者と、それを捨てるたびに増える番号も同じロックで守る
+        self._lock = threading.Lock()
+        self._changed = set()
+        self._stale = False
+        self._private = OrderedDict()
+        self._private_version = 0
+        # 区切りを作り直すのは1スレッドずつ
+        self._refresh_lock = threading.Lock()
+        cache.watch(self._on_change)
+
+    def page(self, conn, initial, user_id, page):
+        """
+        (その利用者から見える行のリスト, ページ番号, 総ページ数) を返す。
+        ページ番号は 1〜総ページ数 に丸める。1件も無ければ ([], 0, 0)。
+        """
+        self._cache.sync(conn)
+        blocks = self._current(conn)
+        entry = self._private_terms(conn, user_id)
+        where, params = _term_range(initial)
+        if initial:
+            first = self._rank(conn, blocks, params[0])
+            public = self._rank(conn, blocks, params[1]) - first
+            private = entry.terms[bisect_left(entry.terms, params[0]):bisect_left(entry.terms, params[1])]
+        else:
+            first, public = 0, blocks.total
+            private = entry.terms
+        ranks = entry.ranks
+        if ranks[0] is not blocks:
+            ranks = entry.ranks = (blocks, {})
+        total = public + len(private)
+        if not total:
+            return [], 0, 0
+        total_pages = -(-total // self._page_size)
+        page = max(1, min(page, total_pages))
+
+        start = self._start(conn, blocks, first, private, ranks[1], user_id, (page - 1) * self._page_size)
+        if start is None:
+            # 別の dyno の削除をまだ数え直していないときなど。頭文字の範囲の先頭から出す
+            start = (params[0] if initial else "", "")
+        rows = conn.execute(
+            LISTING_PAGE_SQL.format(range=where),
+            start + params + (user_id, self._page_size),
+        ).fetchall()
+        return rows, page, total_pages
+
+    def _start(self, conn, blocks, first, private, ranks, user_id, index):
+        """見える行（頭文字の範囲の公開の単語と private）の index 番目の (term, owner)"""
+
+        def position(j):
+            # 自分専用の j 番目の、見える行の中での位置（その前にある公開の単語の数 + j）
+            term = private[j]
+            rank = ranks.get(term)
+            if rank is None:
+                rank = ranks[term] = self._rank(conn, blocks, term, inclusive=True)
+            return rank - first + j
+
+        lo, hi = 0, len(private)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if position(mid) < index:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(private) and position(lo) == index:
+            return private[lo], user_id
+        # index 番目は公開の単語で、その前に自分専用が lo 件ある
+        term = self._nth(conn, blocks, first + index - lo)
+        return None if term is None else (term, "")
+
+    def _rank(self, conn, blocks, term, inclusive=False):
+        """term より前（inclusive なら term も含む）にある公開の単語の数"""
+        i = bisect_right(blocks.starts, term) - 1
+        if blocks.starts[i] == term and not inclusive:
+            return blocks.offsets[i]
+        upper = " AND term <= ?" if inclusive else " AND term < ?"
+        return blocks.offsets[i] + conn.execute(
+            PUBLIC_COUNT_SQL.format(upper=upper), (blocks.starts[i], term)
+        ).fetchone()[0]
+
+    def _nth(self, conn, blocks, rank):
+        """公開の単語の rank 番目（0 から）。数が古くて無ければ None"""
+        i = min(bisect_right(blocks.offsets, rank) - 1, len(blocks.starts) - 1)
+        row = conn.execute(PUBLIC_NTH_SQL, (blocks.starts[i], rank - blocks.offsets[i])).fetchone()
+        return row[0] if row else None
+
+    def _private_terms(self, conn, user_id):
+        with self._lock:
+            entry = self._private.get(user_id)
+            if entry is not None:
+                self._private.move_to_end(user_id)
+                return entry
+            version = self._private_version
+        entry = _PrivateTerms([row[0] for row in conn.execute(PRIVATE_TERMS_SQL.format(range=""), (user_id,))])
+        with self._lock:
+            # 読んでいる間に自分専用の登録が書き換えられていたら覚えない
+            if version == self._private_version:
+                self._private[user_id] = entry
+                if len(self._private) > self._maxsize:
+                    self._private.popitem(last=False)
+        return entry
+
+    def _on_change(self, term, owner):
+        with self._lock:
+            if term is None:
+                self._stale = True
+                self._private.clear()
+                self._private_version += 1
+            elif owner:
+                # 自分専用の登録は区切りには関係ない
+                self._private.pop(owner, None)
+                self._private_version += 1
+            else:
+                self._changed.add(term)
+
+    def _current(self, conn):
+        blocks = self._blocks
+        if blocks is not None and not self._stale and not self._changed:
+            return blocks
+        with self._refresh_lock:
+            with self._lock:
+                stale, self._stale = self._stale, False
+                changed, self._changed = self._changed, set()
+            blocks = self._blocks
+            if blocks is None or stale:
+                blocks = self._build(conn)
+            elif changed:
+                blocks = self._recount(conn, blocks, changed)
+            # 数えている間に書き換えられた分は _changed に残っているので、次に数え直す
+            self._blocks = blocks
+            return blocks
+
+    def _build(self, conn):
+        with span("db.page_index"):
+            # 最初の区切りは "" から始める（今の先頭より前に追加された単語もそこに入る）
+            starts = [""] + [row[0] for row in conn.execute(PUBLIC_BLOCKS_SQL, (self._block_size,))][1:]
+            # 最後の区切りだけは端数なので数える（読んでいる間の書き込みは _changed から数え直す）
+            last = conn.execute(PUBLIC_COUNT_SQL.format(upper=""), (starts[-1],)).fetchone()[0]
+        return _Blocks(starts, [self._block_size] * (len(starts) - 1) + [last])
+
+    def _recount(self, conn, blocks, changed):
+        size = self._block_size
+        starts = list(blocks.starts)
+        counts = list(blocks.counts)
+        # 後ろの区切りから直すので、分けたりまとめたりしても前の区切りの番号はずれない
+        for i in sorted({bisect_right(starts, term) - 1 for term in changed}, reverse=True):
+            upper, params = ("", ()) if i + 1 == len(starts) else (" AND term < ?", (starts[i + 1],))
+            count = conn.execute(PUBLIC_COUNT_SQL.format(upper=upper), (starts[i],) + params).fetchone()[0]
+            if count > 2 * size:
+                terms = [row[0] for row in conn.execute(PUBLIC_TERMS_SQL.format(upper=upper), (starts[i],) + params)]
+                starts[i:i + 1] = [starts[i]] + terms[size::size]
+                counts[i:i + 1] = [min(size, len(terms) - j) for j in range(0, len(terms), size)] or [0]
+            elif count == 0 and i > 0:
+                del starts[i]
+                del counts[i]
+            else:
+                counts[i] = count
+        return _Blocks(starts, counts)
+
+
+suggestion_index = NgramIndex()
+term_cache = TermCache(store, listener=suggestion_index)
+page_index = PageIndex(term_cache)
+
+
+def _observe_write_batch(size, seconds):
+    db_seconds.observe(seconds, "write")
+    write_batch_size.observe(size)
+
+
+writer = WriteBehindQueue(
+    connection,
+    begin=store.begin,
+    max_batch=DICTIONARY_WRITE_BATCH,
+    max_delay=DICTIONARY_WRITE_DELAY_MS / 1000,
+    enabled=DICTIONARY_WRITE_BEHIND,
+    on_batch=_observe_write_batch,
+)
+metrics.gauge("bot_dictionary_write_queue_depth", "ライターの書き込み待ちの数", lambda: writer.depth)
+# 接続を閉じる前に（atexit は登録と逆順に呼ばれる）キューに残っている分を書き切る
+atexit.register(store.close)
+atexit.register(writer.shutdown, 10)
+
+
+def _add_entry(conn, term, content, user_id, is_private):
+    owner = user_id if is_private else ""
+    # 検索用の写しをトリガーで追従させているので INSERT OR REPLACE ではなく UPSERT にする
+    conn.execute(
+        "INSERT INTO dictionary (term, owner, content, added_by) VALUES (?, ?, ?, ?)"
+        " ON CONFLICT (term, owner) DO UPDATE SET content = excluded.content, added_by = excluded.added_by",
+        (term, owner, content, user_id)
+    )
+    record_change(conn, term, owner)
+    return None, lambda: term_cache.invalidate(term, owner, added=True)
+
+
+def _delete_entry(conn, term, user_id):
+    row = conn.execute(OWN_ENTRY_SQL, (term, user_id, user_id)).fetchone()
+    if row is None:
+        return None, None
+    owner = row[0]
+    conn.execute("DELETE FROM dictionary WHERE term = ? AND owner = ?", (term, owner))
+    record_change(conn, term, owner)
+    return owner != "", lambda: term_cache.invalidate(term, owner)
+
+
+def _vote_delete(conn, term, user_id):
+    if conn.execute(PUBLIC_ENTRY_SQL, (term,)).fetchone() is None:
+        return None, None
+    # 票数はトリガーで delete_vote_counts に足されるので、主キーで1行読むだけでよい
+    voted = conn.execute(VOTE_SQL, (term, user_id)).rowcount > 0
+    row = conn.execute(VOTE_COUNT_SQL, (term,)).fetchone()
+    votes = row[0] if row else 0
+    if votes < DICTIONARY_DELETE_VOTES:
+        return (voted, votes), None
+    # 登録を消すと票もトリガーで消える
+    conn.execute("DELETE FROM dictionary WHERE term = ? AND owner = ''", (term,))
+    record_change(conn, term, "")
+    return (voted, votes), lambda: term_cache.invalidate(term, "")
+
+
+# 追加・削除をライターに積んで Future を返す関数（result() はコミットされてから返る）
+def submit_dictionary_add(term, content, user_id, is_private):
+    return writer.submit(_add_entry, term, content, user_id, is_private)
+
+def submit_dictionary_delete(term, user_id):
+    return writer.submit(_delete_entry, term, user_id)
+
+def submit_dictionary_delete_vote(term, user_id):
+    return writer.submit(_vote_delete, term, user_id)
+
+# 以下の書き込みはライターがコミットするまで待つので、その待ち時間を db.write として記録する
+# 辞書を追加する関数（自分専用なら同じ単語でも他の人の登録とは別に持つ）
+def add_dictionary_entry(term, content, user_id, is_private):
+    with span("db.write"):
+        submit_dictionary_add(term, content, user_id, is_private).result()
+
+# 辞書を削除する関数。自分専用の登録か、無ければ自分が公開した登録を1つだけ消す。
+# 消せなければ None、消したら自分専用だったかを返す
+def delete_dictionary_entry(term, user_id):
+    with span("db.write"):
+        return submit_dictionary_delete(term, user_id).result()
+
+# 公開の単語の削除に1票入れる関数。公開の登録が無ければ None、あれば (今回票が増えたか, 票数) を返す。
+# 票数が DICTIONARY_DELETE_VOTES に達したらその場で消す
+def vote_dictionary_delete(term, user_id):
+    with span("db.write"):
+        return submit_dictionary_delete_vote(term, user_id).result()
+
+# 単語を引く関数（公開されているか、自分が追加したものだけ）
+def lookup_dictionary_entry(term, user_id):
+    with connection() as conn:
+        return term_cache.lookup(conn, term, user_id)
+
+# 一覧の1ページ分を返す関数（initial で頭文字を絞り込む）
+def list_dictionary_entries(initial, page, user_id):
+    with connection() as conn, db_seconds.time("list"), span("db.list"):
+        return page_index.page(conn, initial, user_id, page)
+
+# 単語と内容から探す関数（空白区切りの語をすべて含むもの）
+def search_dictionary_entries(query, user_id, limit=DICTIONARY_SEARCH_LIMIT):
+    with connection() as conn, db_seconds.time("search"), span("db.search"):
+        sql, params = search_query(query.split(), user_id, limit, fts=store.full_text_search)
+        return conn.execute(sql, params).fetchall()
+
+# 見つからなかった単語に近い、その利用者から見える単語を返す関数（「もしかして」用）
+def suggest_dictionary_terms(term, user_id, limit=3):
+    with connection() as conn, db_seconds.time("suggest"), span("db.suggest"):
+        return suggestion_index.suggest(
+            term,
+            load=lambda: term_cache.terms(conn),
+            accept=lambda candidate: term_cache.lookup(conn, candidate, user_id) is not None,
+            limit=limit,
+        )
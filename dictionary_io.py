@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+辞書のまとめての取り込み・書き出し（JSONL / CSV）。
+
+    $ python dictionary_io.py export backup.jsonl
+    $ python dictionary_io.py import backup.jsonl
+    $ python dictionary_io.py import entries.csv --skip-existing
+    $ cat entries.jsonl | python dictionary_io.py import - --format jsonl
+
+1行が1件で、列は term, owner, content, added_by。owner は公開なら空、自分専用なら
+その利用者の user_id。owner の代わりに is_private を書いた行は、added_by の自分専用として扱う。
+ファイルは1行ずつ読み書きし、取り込みは --batch 件ずつ executemany で1トランザクションにするので、
+件数が多くてもメモリの使用量は変わらない。(term, owner) が同じ行は上書きする（--skip-existing なら残す）。
+対象はボットと同じ保存先（store.py: DATABASE_URL があれば PostgreSQL、無ければ SQLite）。
+--db を指定するとその SQLite ファイルを使う。
+"""
+
+import csv
+import io
+import json
+import logging
+import sys
+import time
+from argparse import ArgumentParser
+from itertools import islice
+
+from db import DB_PATH, ConnectionManager
+from store import PostgresStore, SQLiteStore, open_store, record_bulk_change
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("term", "owner", "content", "added_by")
+# 返信は「単語：内容」の1メッセージなので、LINE のテキストメッセージの上限に収める
+MAX_REPLY_LENGTH = 5000
+
+UPSERT_SQL = (
+    "INSERT INTO dictionary (term, owner, content, added_by) VALUES (?, ?, ?, ?)"
+    " ON CONFLICT (term, owner) DO UPDATE SET content = excluded.content, added_by = excluded.added_by"
+)
+INSERT_NEW_SQL = (
+    "INSERT INTO dictionary (term, owner, content, added_by) VALUES (?, ?, ?, ?)"
+    " ON CONFLICT (term, owner) DO NOTHING"
+)
+# 書き出すときに1回で読む件数（(term, owner) の続きから読むので、何回目でも同じ手間）
+EXPORT_PAGE_SQL = (
+    "SELECT term, owner, content, added_by FROM dictionary"
+    " WHERE (term, owner) > (?, ?) ORDER BY term, owner LIMIT ?"
+)
+EXPORT_PAGE_SIZE = 10000
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def _text(record, field, default=None):
+    value = record.get(field, default)
+    if value is None:
+        raise InvalidRow(f"{field} がありません")
+    if not isinstance(value, str):
+        raise InvalidRow(f"{field} が文字列ではありません")
+    return value
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def validate(record):
+    """1件を検証して (term, owner, content, added_by) を返す。おかしければ InvalidRow。"""
+    if not isinstance(record, dict):
+        raise InvalidRow("オブジェクトではありません")
+    term = _text(record, "term")
+    if not term or term != term.strip() or any(ch.isspace() for ch in term):
+        # チャットからは空白を含む単語は登録も呼び出しもできない
+        raise InvalidRow("term が空か空白を含んでいます")
+    content = _text(record, "content")
+    if not content.strip():
+        raise InvalidRow("content が空です")
+    if len(term) + 1 + len(content) > MAX_REPLY_LENGTH:
+        raise InvalidRow(f"term と content を合わせて {MAX_REPLY_LENGTH} 文字を超えています")
+
+    added_by = record.get("added_by")
+    if "owner" in record and record["owner"] is not None:
+        owner = _text(record, "owner")
+        added_by = owner if added_by in (None, "") else added_by
+    elif _flag(record.get("is_private", False)):
+        owner = _text(record, "added_by")
+        if not owner:
+            raise InvalidRow("is_private なのに added_by がありません")
+    else:
+        owner = ""
+    if added_by is None:
+        added_by = ""
+    if not isinstance(added_by, str):
+        raise InvalidRow("added_by が文字列ではありません")
+    return term, owner, content, added_by
+
+
+def read_jsonl(f):
+    for line_no, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, InvalidRow(f"JSON として読めません: {e}")
+
+
+def read_csv(f):
+    reader = csv.DictReader(f)
+    if reader.fieldnames is None or "term" not in reader.fieldnames:
+        raise SystemExit("CSV の1行目に term, content などの見出しが必要です")
+    for record in reader:
+        # 空欄は「指定なし」として扱う
+        yield reader.line_num, {k: v for k, v in record.items() if k is not None and v != ""}
+
+
+READERS = {"jsonl": read_jsonl, "csv": read_csv}
+
+
+def guess_format(path, fmt):
+    if fmt:
+        return fmt
+    if path.endswith(".csv"):
+        return "csv"
+    if path.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    raise SystemExit(f"{path} の形式が分からないので --format を指定してください")
+
+
+def valid_rows(records, stats, strict):
+    for line_no, record in records:
+        stats["read"] += 1
+        try:
+            if isinstance(record, InvalidRow):
+                raise record
+            yield validate(record)
+        except InvalidRow as e:
+            stats["invalid"] += 1
+            if strict:
+                raise SystemExit(f"{line_no} 行目: {e}")
+            logger.warning("%d 行目を飛ばしました: %s", line_no, e)
+
+
+def import_rows(store, conn, rows, batch=10000, skip_existing=False, rebuild_search_index=False):
+    """
+    rows（(term, owner, content, added_by) の iterable）を batch 件ずつ書き込み、書き込んだ件数を返す。
+    conn は store から借りた接続（スキーマは store.prepare() 済みのもの）。
+
+    rebuild_search_index=True なら、全文検索の索引を1行ずつ更新するのをやめて最後に作り直す
+    （大量に取り込むときはこちらの方が何倍も速い。SQLite の FTS5 の索引があるときだけ）。
+    トリガーを外している間に他の書き込みが紛れ込まないよう、このときは全体を1トランザクションで行う。
+    """
+    sql = INSERT_NEW_SQL if skip_existing else UPSERT_SQL
+    rows = iter(rows)
+    written = 0
+
+    if rebuild_search_index and store.full_text_search:
+        store.begin(conn)
+        try:
+            triggers = conn.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'dictionary_search'"
+            ).fetchall()
+            for name, _ in triggers:
+                conn.execute(f"DROP TRIGGER {name}")
+            while True:
+                chunk = list(islice(rows, batch))
+                if not chunk:
+                    break
+                # rowcount にはトリガーで書いた検索用の行は含まれない
+                written += conn.executemany(sql, chunk).rowcount
+            conn.execute("INSERT INTO dictionary_fts (dictionary_fts) VALUES ('rebuild')")
+            for _, trigger_sql in triggers:
+                conn.execute(trigger_sql)
+            record_bulk_change(conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return written
+
+    while True:
+        chunk = list(islice(rows, batch))
+        if not chunk:
+            break
+        store.begin(conn)
+        try:
+            written += conn.executemany(sql, chunk).rowcount
+            # 動いているボットのキャッシュを捨てさせる
+            record_bulk_change(conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return written
+
+
+def dictionary_rows(conn, page_size=EXPORT_PAGE_SIZE):
+    """
+    辞書を (term, owner) の順に page_size 件ずつ読んで1行ずつ返す（PostgreSQL でも全件を一度に読まない）。
+    ページごとの読み込みなので、書き出している間の書き込みは含まれることも含まれないこともある。
+    """
+    last = ("", "")
+    while True:
+        rows = conn.execute(EXPORT_PAGE_SQL, last + (page_size,)).fetchall()
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last = (rows[-1][0], rows[-1][1])
+
+
+def export_rows(conn, f, fmt):
+    """辞書を (term, owner) の順に書き出して件数を返す。"""
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        for row in dictionary_rows(conn):
+            writer.writerow(tuple(row))
+            count += 1
+    else:
+        for row in dictionary_rows(conn):
+            f.write(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def _open(path, mode):
+    if path == "-":
+        stream = sys.stdin if mode == "r" else sys.stdout
+        return io.TextIOWrapper(stream.buffer, encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = ArgumentParser(description="辞書の JSONL / CSV での取り込み・書き出し")
+    parser.add_argument("--db", help="この SQLite ファイルを使う（既定はボットと同じ保存先）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("import", help="ファイルから取り込む")
+    p.add_argument("path", help="ファイル（- なら標準入力）")
+    p.add_argument("--format", choices=sorted(READERS))
+    p.add_argument("--batch", type=int, default=10000, help="1トランザクションの件数")
+    p.add_argument("--skip-existing", action="store_true", help="同じ (term, owner) がある行は上書きしない")
+    p.add_argument("--strict", action="store_true", help="おかしな行があったらそこで止める（それより前のバッチは書き込み済み）")
+    p.add_argument("--rebuild-search-index", action="store_true",
+                   help="全文検索の索引を最後にまとめて作り直す（全体が1トランザクションになる）")
+
+    p = sub.add_parser("export", help="ファイルに書き出す")
+    p.add_argument("path", help="ファイル（- なら標準出力）")
+    p.add_argument("--format", choices=sorted(READERS))
+    args = parser.parse_args()
+
+    fmt = guess_format(args.path, args.format) if args.path != "-" else (args.format or "jsonl")
+    if args.db:
+        connections = ConnectionManager(args.db)
+        store = SQLiteStore(connections)
+    else:
+        connections = None
+        store = open_store()
+    logger.info("保存先: %s", "PostgreSQL（DATABASE_URL）" if isinstance(store, PostgresStore) else args.db or DB_PATH)
+    try:
+        with store.connection() as conn:
+            store.prepare(conn)
+            started = time.perf_counter()
+            if args.command == "import":
+                stats = {"read": 0, "invalid": 0}
+                with _open(args.path, "r") as f:
+                    rows = valid_rows(READERS[fmt](f), stats, args.strict)
+                    written = import_rows(
+                        store, conn, rows, args.batch, args.skip_existing, args.rebuild_search_index)
+                logger.info(
+                    "✅ %d 件を読み、%d 件を書き込みました（不正 %d 件, %.1f 秒）",
+                    stats["read"], written, stats["invalid"], time.perf_counter() - started,
+                )
+            else:
+                with _open(args.path, "w") as f:
+                    count = export_rows(conn, f, fmt)
+                logger.info("✅ %d 件を書き出しました（%.1f 秒）", count, time.perf_counter() - started)
+    finally:
+        store.close()
+        if connections is not None:
+            connections.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+import time
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# リトライ対象のステータスコード（レート制限とサーバー側エラー）
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いていて、上流へのリクエストを送らなかったときの例外。"""
+
+
+class CircuitBreaker:
+    """
+    連続で failure_threshold 回失敗したら reset_timeout 秒間リクエストを止める。
+    時間が経ったら1回だけ試しに通し（half-open）、成功すれば元に戻す。
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def before_call(self):
+        """リクエストを送ってよいか確認する。ダメなら CircuitOpenError を投げる。"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._probing or self._clock() - self._opened_at < self._reset_timeout:
+                raise CircuitOpenError("上流APIが応答しないため、一時的にリクエストを止めています。")
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self._failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("サーキットブレーカーを開きました（連続失敗 %d 回）", self._failures)
+                self._opened_at = self._clock()
+            self._probing = False
+
+
+class HttpClient:
+    """
+    コネクションプール付きの requests.Session をまとめたクライアント。
+    keep-alive で接続を使い回し、タイムアウト・ジッター付きリトライ・サーキットブレーカーを掛ける。
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=10, retries=2,
+                 backoff=0.5, max_backoff=5.0, breaker=None):
+        self._timeout = (connect_timeout, read_timeout)
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get_json(self, url):
+        """GET して JSON を返す。リトライしても失敗した場合は例外を投げる。"""
+        self.breaker.before_call()
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.get(url, timeout=self._timeout)
+            except requests.RequestException as e:
+                if attempt < self._retries:
+                    logger.info("HTTPリトライ(%d): %s", attempt + 1, e)
+                    time.sleep(self.retry_delay(attempt))
+                    attempt += 1
+                    continue
+                self.breaker.record_failure()
+                raise
+
+            if resp.status_code in RETRY_STATUSES:
+                if attempt < self._retries:
+                    time.sleep(self.retry_delay(attempt, resp.headers.get("Retry-After")))
+                    attempt += 1
+                    continue
+                self.breaker.record_failure()
+                resp.raise_for_status()
+
+            # 応答が返ってきている限り上流は生きているとみなす
+            self.breaker.record_success()
+            resp.raise_for_status()
+            return resp.json()
+
+    @property
+    def retries(self):
+        return self._retries
+
+    def retry_delay(self, attempt, retry_after=None):
+        """attempt 回目のリトライまで待つ秒数。Retry-After があればそれに従い、無ければ指数バックオフ（フルジッター）。"""
+        if retry_after is not None:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                delay = self._backoff
+        else:
+            delay = random.uniform(0, self._backoff * (2 ** attempt))
+        return min(delay, self._max_backoff)
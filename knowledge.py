@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+武器・レジェンド・アビリティのデータ（data/knowledge.json）と、その返信テキストの組み立て。
+
+データは項目ごとのフィールドで持ち、返信テキストは必要になったときにフィールドから組み立てて
+キャッシュする。ファイルは最初に引かれたときに読み込み、更新されていたら読み直すので、
+データの修正だけならデプロイし直さなくても反映される。
+"""
+
+import json
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_PATH = os.getenv(
+    "KNOWLEDGE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "knowledge.json"),
+)
+# ファイルの更新を確認する間隔（秒）。0 なら毎回確認する
+KNOWLEDGE_RELOAD_INTERVAL = float(os.getenv("KNOWLEDGE_RELOAD_INTERVAL", "30"))
+
+# 1つの武器に複数の形態（二丁拳銃など）があるときの区切り
+VARIANT_SEPARATOR = "- "
+
+
+def render_value(value):
+    """
+    数値の段階表記を文字列に戻す。
+    {"素": "18", "白": "21"} → "素18 白21"。文字列はそのまま返す。
+    """
+    if isinstance(value, dict):
+        return " ".join(f"{tier}{v}" for tier, v in value.items())
+    return str(value)
+
+
+def render_stat(stat):
+    if "text" in stat:
+        return stat["text"]
+    return f"- {stat['label']}: {render_value(stat['value'])}"
+
+
+def render_weapon(entry):
+    blocks = []
+    for variant in entry["variants"]:
+        lines = [f"{variant.get('icon', '🔫')} {variant['name']}"]
+        if variant.get("note"):
+            lines.append(variant["note"])
+        lines.extend(render_stat(s) for s in variant["stats"])
+        blocks.append("\n".join(lines))
+    return f"\n{VARIANT_SEPARATOR}\n".join(blocks)
+
+
+def render_legend(entry):
+    lines = [entry["name"], f"「{entry['quote']}」", entry["title"], ""]
+    lines.extend(f"{label}: {value}" for label, value in entry["profile"])
+    lines.append("")
+    lines.append(f"クラス: {entry['class']}")
+    for ability in entry["abilities"]:
+        lines.append(f"{ability['slot']}: 「{ability['name']}」")
+        lines.append(ability["summary"])
+        lines.append(f"(詳細な情報は「{ability['command']}」で表示)")
+        lines.append("")
+    return "\n".join(lines).rstrip("\n")
+
+
+def render_ability(entry):
+    lines = [f"{entry['legend']}の{entry['slot']}"]
+    lines.extend(entry["description"])
+    lines.append("")
+    lines.extend(entry["details"])
+    return "\n".join(lines)
+
+
+RENDERERS = {
+    "weapons": render_weapon,
+    "legends": render_legend,
+    "abilities": render_ability,
+}
+
+
+class KnowledgeBase:
+    """
+    コマンド（"?R-99" など）→ 項目データの表。
+    build を渡すと、組み立てたテキストと画像 URL から作った返信（PrebuiltReply など）をキャッシュする。
+    """
+
+    def __init__(self, path=KNOWLEDGE_PATH, reload_interval=KNOWLEDGE_RELOAD_INTERVAL, build=None, clock=time.monotonic):
+        self._path = path
+        self._reload_interval = reload_interval
+        self._build = build
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = None
+        self._replies = {}
+        self._mtime = None
+        self._checked_at = 0.0
+
+    def __contains__(self, key):
+        return key in self._current()
+
+    def get(self, key):
+        """build で作った返信を返す（初回だけ組み立てる）。無ければ None。"""
+        entries = self._current()
+        reply = self._replies.get(key)
+        if reply is not None:
+            return reply
+        item = entries.get(key)
+        if item is None:
+            return None
+        kind, entry = item
+        reply = self._build(RENDERERS[kind](entry), entry.get("image"))
+        with self._lock:
+            # 組み立て中に読み直されていたら古いデータの返信はキャッシュしない
+            if entries is self._entries:
+                self._replies[key] = reply
+        return reply
+
+    def _current(self):
+        now = self._clock()
+        if self._entries is not None and now - self._checked_at < self._reload_interval:
+            return self._entries
+        with self._lock:
+            if self._entries is None or now - self._checked_at >= self._reload_interval:
+                self._checked_at = now
+                try:
+                    mtime = os.stat(self._path).st_mtime_ns
+                except OSError as e:
+                    logger.error("データファイルを確認できません: %s", e)
+                    mtime = self._mtime
+                if self._entries is None or mtime != self._mtime:
+                    self._load()
+            return self._entries
+
+    def _load(self):
+        try:
+            mtime = os.stat(self._path).st_mtime_ns
+            with open(self._path, encoding="utf-8") as f:
+                data = json.load(f)
+            entries = {}
+            for kind in RENDERERS:
+                for entry in data.get(kind, []):
+                    entries[entry["key"]] = (kind, entry)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.error("データファイルの読み込みに失敗しました: %s", e)
+            if self._entries is None:
+                self._entries = {}
+            return
+
+        self._entries = entries
+        self._replies = {}
+        self._mtime = mtime
+        logger.info("データファイルを読み込みました（%d 件）", len(entries))
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+ログの設定。
+
+ログを出したスレッドでは LogRecord をキューに積むだけにして、整形と書き出しは
+バックグラウンドのスレッド（QueueListener）で行う。1行1件の JSON で、処理中のイベントの
+event_id やコマンド名（log_context() で設定したもの）を自動で付ける。
+
+- LOG_LEVEL: 出力するレベル（既定 INFO）
+- LOG_FORMAT: json または text（既定 json）
+- LOG_QUEUE_SIZE: 書き出し待ちの上限。溢れた分は捨てて数だけ数える
+- LOG_FLUSH_INTERVAL: 書き出すスレッドがキューを見に行く間隔（秒、既定 0.05）
+- LOG_PAYLOAD_SAMPLE_RATE: Webhook の本文や API の応答を丸ごと出す割合（既定 0 = 出さない）
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0"))
+# 書き出すスレッドがキューを見に行く間隔（秒）
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.05"))
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_context = contextvars.ContextVar("log_context", default=None)
+# LogRecord が元から持っている属性（これ以外は extra やコンテキストで足されたもの）
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+@contextmanager
+def log_context(**fields):
+    """with の中で出したログに fields を付ける（スレッドやタスクごとに別々）"""
+    current = _context.get()
+    token = _context.set(dict(current, **fields) if current else fields)
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def add_log_context(**fields):
+    """今の log_context() に項目を足す（コマンドが決まったときなど）。外側の with が終わるまで付く。"""
+    current = _context.get()
+    if current is not None:
+        # 同じ dict を持っている呼び出し元（別スレッドで build_reply を呼んだ asyncio のタスクなど）にも見せる
+        current.update(fields)
+
+
+def log_payload(logger, label, payload, rate=None):
+    """payload を LOG_PAYLOAD_SAMPLE_RATE の割合だけログに出す（メッセージの本文を含むので既定では出さない）。"""
+    rate = LOG_PAYLOAD_SAMPLE_RATE if rate is None else rate
+    if rate > 0 and (rate >= 1 or random.random() < rate):
+        logger.info(label, extra={"payload": payload})
+
+
+class ContextFilter(logging.Filter):
+    """log_context() の項目を LogRecord の属性にする（ログを出したスレッドで呼ばれる）"""
+
+    def filter(self, record):
+        fields = _context.get()
+        if fields:
+            for key, value in fields.items():
+                if key not in record.__dict__:
+                    setattr(record, key, value)
+        return True
+
+
+def _extra_fields(record):
+    return [(key, value) for key, value in record.__dict__.items() if key not in _RECORD_ATTRS and not key.startswith("_")]
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """人が読む用。event_id などの項目は「key=value」で行末に付ける"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def formatMessage(self, record):
+        text = super().formatMessage(record)
+        fields = _extra_fields(record)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields)
+        return text
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    キューに積むだけのハンドラー。maxsize 件溜まっていたら待たずに捨てて dropped を数える
+    （ログのためにリクエストを止めない）。キューはロックの軽い SimpleQueue なので、上限は目安。
+    """
+
+    def __init__(self, maxsize):
+        super().__init__(queue.SimpleQueue())
+        self.maxsize = maxsize
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 引数の埋め込みと例外の整形だけはここで行う（書き出すまでに引数の中身が変わるかもしれないので）。
+        # JSON にするのは書き出すスレッド。書き換えても他のハンドラーの出力は変わらないのでコピーはしない
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+class PollingQueueListener(QueueListener):
+    """
+    interval 秒ごとにキューに溜まった分をまとめて書き出す QueueListener。
+    1件ごとに書き出すスレッドを起こさないので、ログを出すスレッドが GIL を取り返す待ちが減る。
+    """
+
+    def __init__(self, log_queue, *handlers, interval=LOG_FLUSH_INTERVAL, respect_handler_level=False):
+        super().__init__(log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self.interval = interval
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get_nowait()
+            except queue.Empty:
+                if not block:
+                    raise
+                time.sleep(self.interval)
+
+
+_listener = None
+queue_handler = None
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, queue_size=LOG_QUEUE_SIZE):
+    """
+    ルートロガーにキューのハンドラーを付け、書き出しを別スレッドに移す（何度呼んでも1回だけ）。
+    すでにルートにハンドラーがあれば（gunicorn の設定など）、それをキューの先に付け替える。
+    """
+    global _listener, queue_handler
+    if _listener is not None:
+        return
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    if not handlers:
+        stream = logging.StreamHandler(sys.stderr)
+        stream.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        handlers = [stream]
+    for handler in handlers:
+        root.removeHandler(handler)
+
+    queue_handler = DroppingQueueHandler(queue_size)
+    queue_handler.addFilter(ContextFilter())
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = PollingQueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    metrics.gauge("bot_log_queue_depth", "書き出し待ちのログの件数", lambda: queue_handler.queue.qsize())
+    metrics.gauge("bot_log_dropped_total", "キューが一杯で捨てたログの件数", lambda: queue_handler.dropped, type="counter")
+    # 他の atexit（キューの処理し切りなど）が出すログも書き出せるよう、最初に登録して最後に止める
+    atexit.register(_stop_listener)
+
+
+def _stop_listener():
+    if queue_handler is not None and queue_handler.dropped:
+        logging.getLogger(__name__).warning("ログのキューが一杯で %d 件捨てました", queue_handler.dropped)
+    _listener.stop()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+/metrics で Prometheus のテキスト形式に出すメトリクス。
+
+prometheus_client は使わず、プロセス内にカウンターとヒストグラムを持つだけの小さな実装。
+記録はメトリクスごとのロックを取って数を足すだけなので、Webhook ワーカーなど
+どのスレッドから呼んでもよい。gunicorn などで複数プロセスにしたときは、値はプロセスごとになる。
+
+    requests = metrics.counter("bot_xxx_total", "説明", ("command",))
+    requests.inc("?マップ")
+    with latency.time("?マップ", errors=failures):
+        ...
+
+- METRICS_TOKEN: 設定すると /metrics に「Authorization: Bearer <値>」が必要になる
+"""
+
+import hmac
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒のヒストグラムの既定の区切り（上流の API や LINE への返信向け）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# DB の1クエリ向けの細かい区切り
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if value.is_integer():
+            return str(int(value))
+    return repr(value)
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """増えるだけの数。ラベルの値ごとに別々に数える"""
+
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._add(labels, amount)
+
+    def _add(self, labels, amount):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, _labels(self.labelnames, labels), value) for labels, value in values]
+
+
+class _Timer:
+    """Histogram.time() が返す context manager（with を抜けたときに経過時間を記録する）"""
+
+    __slots__ = ("_histogram", "_labels", "_errors", "_started")
+
+    def __init__(self, histogram, labels, errors):
+        self._histogram = histogram
+        self._labels = labels
+        self._errors = errors
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._histogram._add(self._labels, time.perf_counter() - self._started)
+        if exc_type is not None and self._errors is not None:
+            self._errors._add(self._labels, 1)
+        return False
+
+
+class Histogram:
+    """値（主に秒）の分布。区切りごとの件数と合計・件数を持つ"""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # ラベルの値 → [区切りごとの件数..., +Inf の件数, 合計]
+        self._values = {}
+
+    def observe(self, value, *labels):
+        self._add(labels, value)
+
+    def _add(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def time(self, *labels, errors=None):
+        """with の中の経過時間を記録する。例外で抜けたら errors（Counter）を同じラベルで数える"""
+        return _Timer(self, labels, errors)
+
+    def count(self, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            return sum(state[:-1]) if state else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, state[:]) for labels, state in self._values.items())
+        samples = []
+        for labels, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state):
+                cumulative += count
+                samples.append((
+                    self.name + "_bucket",
+                    _labels(self.labelnames, labels, f'le="{_number(float(bound))}"'),
+                    cumulative,
+                ))
+            samples.append((self.name + "_sum", _labels(self.labelnames, labels), state[-1]))
+            samples.append((self.name + "_count", _labels(self.labelnames, labels), cumulative))
+        return samples
+
+
+class Gauge:
+    """出力するときに func() を呼んで値を読む（キューの長さなど、記録しなくても分かるもの）"""
+
+    def __init__(self, name, help, func, type="gauge"):
+        self.name = name
+        self.help = help
+        self.type = type
+        self._func = func
+
+    def samples(self):
+        return [(self.name, "", self._func())]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        """metric を登録して返す。同じ名前・同じ種類のものがすでにあればそちらを返す"""
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is None or isinstance(metric, Gauge):
+                self._metrics[metric.name] = metric
+                return metric
+        if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+            raise ValueError(f"メトリクス {metric.name} が別の種類・ラベルで登録されています")
+        return existing
+
+    def render(self):
+        """Prometheus のテキスト形式（0.0.4）にする"""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for name, metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # キューが閉じられた後など。他のメトリクスは出す
+                lines.append(f"# {name}: {type(e).__name__}")
+                continue
+            lines.append(f"# HELP {name} {_escape(metric.help)}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labelnames=()):
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+def gauge(name, help, func, type="gauge"):
+    return REGISTRY.register(Gauge(name, help, func, type))
+
+
+def render():
+    return REGISTRY.render()
+
+
+# キャッシュの当たり外れ（?マップ・?ボーダー・辞書引きで共通）
+cache_requests = counter(
+    "bot_cache_requests_total", "キャッシュを引いた回数（result=hit なら上流や DB に行かずに済んだ）", ("cache", "result"))
+
+
+def authorized(header):
+    """Authorization ヘッダーの値が METRICS_TOKEN に合っているか（未設定なら誰でも見られる）"""
+    return not METRICS_TOKEN or hmac.compare_digest((header or "").encode(), f"Bearer {METRICS_TOKEN}".encode())
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+辞書 DB のスキーマのバージョン管理。
+
+DB のバージョンは PRAGMA user_version に入れておき、migrate() がまだ当たっていない
+マイグレーションを番号順に1つずつ（それぞれ1トランザクションで）当てる。
+スキーマを変えるときは、既存のマイグレーションは書き換えずに末尾に新しい番号で追加すること。
+
+    $ python migrations.py            # DICTIONARY_DB_PATH（既定は dictionary.db）を最新にする
+    $ python migrations.py --status   # 今のバージョンを表示するだけ
+"""
+
+import logging
+import sqlite3
+from argparse import ArgumentParser
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """マイグレーションとして登録するデコレーター。関数は接続を受け取り、トランザクションの中で呼ばれる。"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+@migration(1, "term を主キーにした辞書と変更履歴")
+def _baseline(conn):
+    # マイグレーション導入前に同梱していた dictionary.db と同じ形。
+    # init_db.py で作った keyword 形式の表はそのまま残し、次のマイグレーションで移す
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS dictionary (
+            term TEXT PRIMARY KEY,
+            content TEXT,
+            added_by TEXT,
+            is_private INTEGER DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS dictionary_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            term TEXT NOT NULL
+        )
+    """)
+
+
+@migration(2, "(term, owner) を主キーにして、自分専用の登録が他の人の登録とぶつからないようにする")
+def _term_owner(conn):
+    # owner は公開なら ''、自分専用なら登録した人の user_id。
+    # 単語の引き当ても一覧も主キーの (term, owner) をたどるだけで済むよう WITHOUT ROWID にする
+    conn.execute("ALTER TABLE dictionary RENAME TO dictionary_old")
+    conn.execute("""
+        CREATE TABLE dictionary (
+            term TEXT NOT NULL,
+            owner TEXT NOT NULL DEFAULT '',
+            content TEXT NOT NULL,
+            added_by TEXT NOT NULL DEFAULT '',
+            PRIMARY KEY (term, owner)
+        ) WITHOUT ROWID
+    """)
+
+    columns = table_columns(conn, "dictionary_old")
+    if "keyword" in columns:
+        # init_db.py の形式（同じ単語が複数あれば新しいものを残す）
+        conn.execute("""
+            INSERT OR REPLACE INTO dictionary (term, owner, content, added_by)
+            SELECT keyword, CASE WHEN private THEN user_id ELSE '' END, content, user_id
+            FROM dictionary_old ORDER BY id
+        """)
+    else:
+        conn.execute("""
+            INSERT OR REPLACE INTO dictionary (term, owner, content, added_by)
+            SELECT term,
+                   CASE WHEN is_private THEN COALESCE(added_by, '') ELSE '' END,
+                   COALESCE(content, ''),
+                   COALESCE(added_by, '')
+            FROM dictionary_old
+        """)
+    conn.execute("DROP TABLE dictionary_old")
+
+    # 一覧の件数・ページ位置を数えるための索引（content を含まないので小さい）
+    conn.execute("CREATE INDEX dictionary_listing ON dictionary (term, owner)")
+    # 変更履歴にも owner を持たせる（これより前の行は owner が NULL）
+    if "owner" not in table_columns(conn, "dictionary_changes"):
+        conn.execute("ALTER TABLE dictionary_changes ADD COLUMN owner TEXT")
+
+
+def fts5_trigram_available(conn):
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_trigram_probe USING fts5(x, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        return False
+    conn.execute("DROP TABLE temp.fts5_trigram_probe")
+    return True
+
+
+@migration(3, "単語と内容の全文検索（FTS5 の trigram）")
+def _full_text_search(conn):
+    # WITHOUT ROWID の表は FTS5 の外部コンテンツにできないので、rowid のある写しを挟む。
+    # 写しと索引はトリガーで追従させる。REPLACE で消える行には削除トリガーが走らないので、
+    # dictionary への書き込みは INSERT OR REPLACE ではなく UPSERT を使うこと
+    if not fts5_trigram_available(conn):
+        logger.warning("この SQLite では FTS5 の trigram が使えないので、全文検索の索引は作りません")
+        return
+    conn.execute("""
+        CREATE TABLE dictionary_search (
+            id INTEGER PRIMARY KEY,
+            term TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            content TEXT NOT NULL,
+            UNIQUE (term, owner)
+        )
+    """)
+    conn.execute("""
+        CREATE VIRTUAL TABLE dictionary_fts USING fts5(
+            term, content, content='dictionary_search', content_rowid='id', tokenize='trigram'
+        )
+    """)
+    # executescript() は途中で COMMIT してしまうので1文ずつ実行する
+    triggers = (
+        """
+        CREATE TRIGGER dictionary_search_ai AFTER INSERT ON dictionary BEGIN
+            INSERT INTO dictionary_search (term, owner, content) VALUES (new.term, new.owner, new.content);
+        END
+        """,
+        """
+        CREATE TRIGGER dictionary_search_ad AFTER DELETE ON dictionary BEGIN
+            DELETE FROM dictionary_search WHERE term = old.term AND owner = old.owner;
+        END
+        """,
+        """
+        CREATE TRIGGER dictionary_search_au AFTER UPDATE ON dictionary BEGIN
+            UPDATE dictionary_search SET term = new.term, owner = new.owner, content = new.content
+            WHERE term = old.term AND owner = old.owner;
+        END
+        """,
+        """
+        CREATE TRIGGER dictionary_fts_ai AFTER INSERT ON dictionary_search BEGIN
+            INSERT INTO dictionary_fts (rowid, term, content) VALUES (new.id, new.term, new.content);
+        END
+        """,
+        """
+        CREATE TRIGGER dictionary_fts_ad AFTER DELETE ON dictionary_search BEGIN
+            INSERT INTO dictionary_fts (dictionary_fts, rowid, term, content) VALUES ('delete', old.id, old.term, old.content);
+        END
+        """,
+        """
+        CREATE TRIGGER dictionary_fts_au AFTER UPDATE ON dictionary_search BEGIN
+            INSERT INTO dictionary_fts (dictionary_fts, rowid, term, content) VALUES ('delete', old.id, old.term, old.content);
+            INSERT INTO dictionary_fts (rowid, term, content) VALUES (new.id, new.term, new.content);
+        END
+        """,
+    )
+    for trigger in triggers:
+        conn.execute(trigger)
+    conn.execute("INSERT INTO dictionary_search (term, owner, content) SELECT term, owner, content FROM dictionary")
+
+
+@migration(4, "公開の単語の削除投票（1人1票、票数は集計表で持つ）")
+def _delete_votes(conn):
+    # 票は (term, voter_id) を主キーにして二重投票を弾き、票数は delete_vote_counts にトリガーで
+    # 足し引きしておく（投票のたびに COUNT(*) しなくてよいように）。
+    # 投票できるのは公開の登録だけで、公開の登録が消えたり内容が書き換わったりしたら票は捨てる
+    if "keyword" in table_columns(conn, "delete_votes"):
+        # init_db.py で作っていた表（使われていなかった）
+        conn.execute("ALTER TABLE delete_votes RENAME TO delete_votes_old")
+    conn.execute("""
+        CREATE TABLE delete_votes (
+            term TEXT NOT NULL,
+            voter_id TEXT NOT NULL,
+            PRIMARY KEY (term, voter_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE delete_vote_counts (
+            term TEXT PRIMARY KEY,
+            votes INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    triggers = (
+        """
+        CREATE TRIGGER delete_vote_counts_ai AFTER INSERT ON delete_votes BEGIN
+            INSERT INTO delete_vote_counts (term, votes) VALUES (new.term, 1)
+            ON CONFLICT (term) DO UPDATE SET votes = votes + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER delete_vote_counts_ad AFTER DELETE ON delete_votes BEGIN
+            UPDATE delete_vote_counts SET votes = votes - 1 WHERE term = old.term;
+            DELETE FROM delete_vote_counts WHERE term = old.term AND votes <= 0;
+        END
+        """,
+        """
+        CREATE TRIGGER delete_votes_entry_ad AFTER DELETE ON dictionary WHEN old.owner = '' BEGIN
+            DELETE FROM delete_votes WHERE term = old.term;
+        END
+        """,
+        """
+        CREATE TRIGGER delete_votes_entry_au AFTER UPDATE OF content ON dictionary
+        WHEN old.owner = '' AND new.content IS NOT old.content BEGIN
+            DELETE FROM delete_votes WHERE term = old.term;
+        END
+        """,
+    )
+    for trigger in triggers:
+        conn.execute(trigger)
+    if "keyword" in table_columns(conn, "delete_votes_old"):
+        conn.execute("""
+            INSERT OR IGNORE INTO delete_votes (term, voter_id)
+            SELECT keyword, voter_id FROM delete_votes_old
+            WHERE keyword IN (SELECT term FROM dictionary WHERE owner = '')
+        """)
+        conn.execute("DROP TABLE delete_votes_old")
+
+
+@migration(5, "一覧のページ位置を数えるための、公開の単語と自分専用の登録の部分索引")
+def _listing_partial_indexes(conn):
+    # 公開の単語だけ、ある利用者の自分専用だけを term の順にたどる。部分索引にしておくと、
+    # 両方を見る一覧の1ページ（owner IN ('', ?)）はこれまでどおり主キーを順にたどる
+    conn.execute("CREATE INDEX dictionary_public ON dictionary (term) WHERE owner = ''")
+    conn.execute("CREATE INDEX dictionary_private ON dictionary (owner, term) WHERE owner != ''")
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def migrate(conn, target=None):
+    """
+    target（省略時は最新）まで当てて、当てたバージョンのリストを返す。
+    複数のプロセスが同時に呼んでも、書き込みロックを取ってからバージョンを確かめるので二重には当たらない。
+    """
+    target = latest_version() if target is None else target
+    applied = []
+    if current_version(conn) >= target:
+        return applied
+
+    for version, description, func in MIGRATIONS:
+        if version > target:
+            break
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            func(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        logger.info("辞書 DB をバージョン %d にしました: %s", version, description)
+        applied.append(version)
+    return applied
+
+
+def main():
+    from db import DB_PATH
+
+    parser = ArgumentParser(description="辞書 DB のスキーマを最新にする")
+    parser.add_argument("--db", default=DB_PATH, help="DB ファイル（既定: %(default)s）")
+    parser.add_argument("--target", type=int, help="このバージョンまで当てる")
+    parser.add_argument("--status", action="store_true", help="今のバージョンを表示するだけ")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.status:
+            print(f"{args.db}: バージョン {current_version(conn)}（最新 {latest_version()}）")
+            return
+        applied = migrate(conn, args.target)
+        for version, description, _ in MIGRATIONS:
+            if version in applied:
+                print(f"  {version}: {description}")
+        print(f"✅ {args.db}: バージョン {current_version(conn)}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
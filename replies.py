@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import json
+from typing import NamedTuple
+
+from linebot.v3.messaging import rest, async_rest
+from linebot.v3.messaging.exceptions import ApiException
+
+LINE_API_HOST = "https://api.line.me"
+REPLY_PATH = "/v2/bot/message/reply"
+
+
+class PrebuiltReply(NamedTuple):
+    """
+    起動時に一度だけ組み立てておく静的な返信。
+    検証済みの SDK メッセージと、それを JSON にした messages 配列をセットで持つ。
+    """
+    messages: tuple
+    messages_json: bytes
+
+
+def prebuild_reply(messages):
+    """メッセージを検証済みのまま固定し、送信用の JSON も先に作っておく。"""
+    messages = tuple(messages)
+    encoded = json.dumps([m.to_dict() for m in messages], ensure_ascii=False, separators=(",", ":"))
+    return PrebuiltReply(messages, encoded.encode("utf-8"))
+
+
+def reply_body(reply_token, reply):
+    """reply token だけ埋め込んで、返信 API のリクエストボディを作る。"""
+    return b'{"replyToken":' + json.dumps(reply_token).encode("utf-8") + b',"messages":' + reply.messages_json + b"}"
+
+
+def _reply_request(api_client, reply_token, reply):
+    url = (api_client.configuration.host or LINE_API_HOST) + REPLY_PATH
+    headers = dict(api_client.default_headers)
+    headers["Content-Type"] = "application/json"
+    return url, reply_body(reply_token, reply), headers
+
+
+def send_prebuilt_reply(api_client, reply_token, reply):
+    """
+    組み立て済みの JSON を SDK の接続プールでそのまま送る。
+    ReplyMessageRequest のモデル生成とシリアライズを丸ごと飛ばせる。
+    """
+    url, body, headers = _reply_request(api_client, reply_token, reply)
+    r = api_client.rest_client.pool_manager.request("POST", url, body=body, headers=headers)
+    if not 200 <= r.status <= 299:
+        raise ApiException(http_resp=rest.RESTResponse(r))
+
+
+async def async_send_prebuilt_reply(api_client, reply_token, reply):
+    """send_prebuilt_reply() の AsyncApiClient 版"""
+    url, body, headers = _reply_request(api_client, reply_token, reply)
+    async with api_client.rest_client.pool_manager.post(url, data=body, headers=headers) as r:
+        data = await r.read()
+        if not 200 <= r.status <= 299:
+            raise ApiException(http_resp=async_rest.RESTResponse(r, data))
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+辞書の検索（「辞書 検索」）と、見つからなかったときの「もしかして」の候補出し。
+
+検索は FTS5 の trigram 索引（migrations.py のバージョン 3）で行う。trigram は3文字未満の語を
+引けないので、短い語は LIKE で絞り込む。この SQLite で FTS5 が使えず索引が無ければ、全部 LIKE で探す。
+
+「もしかして」は単語の文字 bigram の転置索引をメモリ上に持ち、bigram を多く共有する単語だけ
+編集距離を計算する。
+"""
+
+import threading
+from collections import Counter, defaultdict
+
+# FTS5 の trigram で引ける最短の長さ
+TRIGRAM_MIN = 3
+# 編集距離を計算する候補の数
+SUGGEST_CANDIDATES = 50
+
+
+def _fts_phrase(word):
+    return '"' + word.replace('"', '""') + '"'
+
+
+def _like_pattern(word):
+    return "%" + word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def search_query(words, user_id, limit, fts=True):
+    """
+    空白で区切った語をすべて含む（単語か内容に）行を探す (SQL, パラメーター) を返す。
+    列は term, content, is_private。FTS を使えるときは関連度順、使えないときは単語順。
+    """
+    long_words = [w for w in words if len(w) >= TRIGRAM_MIN] if fts else []
+    short_words = [w for w in words if w not in long_words]
+    likes = "".join(" AND (s.term LIKE ? ESCAPE '\\' OR s.content LIKE ? ESCAPE '\\')" for _ in short_words)
+    like_params = tuple(p for w in short_words for p in (_like_pattern(w),) * 2)
+
+    if long_words:
+        sql = (
+            "SELECT s.term, s.content, s.owner != '' AS is_private"
+            " FROM dictionary_fts JOIN dictionary_search AS s ON s.id = dictionary_fts.rowid"
+            " WHERE dictionary_fts MATCH ? AND s.owner IN ('', ?)" + likes +
+            # 単語に当たったものを内容に当たったものより上にする
+            " ORDER BY bm25(dictionary_fts, 10.0, 1.0) LIMIT ?"
+        )
+        params = (" AND ".join(_fts_phrase(w) for w in long_words), user_id) + like_params + (limit,)
+    else:
+        table = "dictionary_search" if fts else "dictionary"
+        sql = (
+            f"SELECT s.term, s.content, s.owner != '' AS is_private FROM {table} AS s"
+            " WHERE s.owner IN ('', ?)" + likes + " ORDER BY s.term LIMIT ?"
+        )
+        params = (user_id,) + like_params + (limit,)
+    return sql, params
+
+
+def has_search_index(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dictionary_fts'"
+    ).fetchone() is not None
+
+
+def ngrams(text, n=2):
+    # 前後に印を付けて、1〜2文字の単語や先頭・末尾の一致も数えられるようにする
+    padded = f"\x02{text}\x03"
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def edit_distance(a, b, limit):
+    """a と b のレーベンシュタイン距離。limit を超えると分かった時点で limit + 1 を返す。"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def max_distance(word):
+    """「もしかして」に出す編集距離の上限（短い語ほど厳しくする）"""
+    return 1 if len(word) <= 4 else 2
+
+
+class NgramIndex:
+    """
+    単語の bigram → 単語の集合。
+
+    TermCache の listener として渡しておくと、単語が増えるたびに add() が、キャッシュが
+    丸ごと捨てられたときに reset() が呼ばれる。索引そのものは最初に suggest() されたときに
+    load で単語を全部もらって作る（作っている間に増えた単語は後から足す）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = defaultdict(set)
+        self._terms = set()
+        self._ready = False
+        self._pending = []
+
+    def add(self, term):
+        with self._lock:
+            if self._ready:
+                self._index(term)
+            else:
+                self._pending.append(term)
+
+    def reset(self):
+        with self._lock:
+            self._postings = defaultdict(set)
+            self._terms = set()
+            self._ready = False
+            self._pending = []
+
+    def suggest(self, word, load, accept=None, limit=3):
+        """
+        word に近い単語を近い順に最大 limit 個返す。word 自身は含めない。
+        load は索引がまだ無いときに全単語を返す関数、accept は候補を出してよいかの判定。
+        """
+        if not self._ready:
+            terms = load()
+            with self._lock:
+                if not self._ready:
+                    for term in terms:
+                        self._index(term)
+                    self._ready = True
+                for term in self._pending:
+                    self._index(term)
+                self._pending = []
+
+        limit_distance = max_distance(word)
+        with self._lock:
+            shared = Counter()
+            for gram in ngrams(word):
+                shared.update(self._postings.get(gram, ()))
+            candidates = [term for term, _ in shared.most_common(SUGGEST_CANDIDATES) if term != word]
+
+        scored = []
+        for term in candidates:
+            distance = edit_distance(word, term, limit_distance)
+            if distance <= limit_distance:
+                scored.append((distance, -shared[term], term))
+        scored.sort()
+
+        suggestions = []
+        for _, _, term in scored:
+            if accept is None or accept(term):
+                suggestions.append(term)
+                if len(suggestions) >= limit:
+                    break
+        return suggestions
+
+    def _index(self, term):
+        if term in self._terms:
+            return
+        self._terms.add(term)
+        for gram in ngrams(term):
+            self._postings[gram].add(term)
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+辞書の保存先（SQLite / PostgreSQL）。
+
+DATABASE_URL（postgres://...）が設定されていれば PostgreSQL を、無ければ DICTIONARY_DB_PATH の
+SQLite を使う。dyno やワーカーを複数立てるときは、全員が同じ DB を見られる PostgreSQL にすること
+（SQLite のファイルは dyno ごとに別々で、再起動で消える）。
+
+どちらの保存先も、dictionary.py のクエリ（? のパラメーター）をそのまま実行できる接続を貸し出す。
+違うのは次の点だけで、これを Store のメソッドにしてある。
+
+- connection(): 接続を貸す context manager。SQLite はスレッドごとの接続、PostgreSQL はプールから借りる
+- prepare(conn): スキーマを最新にする
+- begin(conn): 書き込みのトランザクションを始める
+- change_token(conn): 他の接続が書き込んだら変わる値（TermCache がキャッシュを確かめるのに使う）
+- full_text_search: FTS5 の索引で検索できるか（search.search_query の fts）
+
+書き込むときは、同じトランザクションで record_change() / record_bulk_change() を呼んで
+変更履歴（dictionary_changes）に積むこと。他のプロセスの TermCache はこれを見てキャッシュを捨てる。
+
+PostgreSQL を使うには psycopg と psycopg_pool が必要（pip install "psycopg[binary,pool]"）。
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+import migrations
+from db import connections as sqlite_connections
+from search import has_search_index
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+# プールに置いておく接続の数（最小・最大）
+POSTGRES_POOL_MIN = int(os.getenv("DICTIONARY_PG_POOL_MIN", "1"))
+POSTGRES_POOL_MAX = int(os.getenv("DICTIONARY_PG_POOL_MAX", "10"))
+# 他の dyno の書き込みを見に行く間隔（秒）。自分のプロセスの書き込みはすぐ反映される
+POSTGRES_SYNC_INTERVAL = float(os.getenv("DICTIONARY_SYNC_INTERVAL", "1.0"))
+# 変更履歴（他のプロセスにキャッシュを捨てさせるためのもの）を残しておく件数
+DICTIONARY_CHANGE_LOG_SIZE = int(os.getenv("DICTIONARY_CHANGE_LOG_SIZE", "10000"))
+# 何回書き込むごとに古い変更履歴を消すか
+CHANGE_LOG_PRUNE_EVERY = 100
+
+
+class _ThreadConnection:
+    """スレッドごとに開いたままの接続を貸す（返すときは何もしない）"""
+
+    __slots__ = ("_connections",)
+
+    def __init__(self, connections):
+        self._connections = connections
+
+    def __enter__(self):
+        return self._connections.get()
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class SQLiteStore:
+    """db.py のスレッドごとの接続を使う保存先（スキーマは migrations.py）"""
+
+    def __init__(self, connections=sqlite_connections):
+        self._connections = connections
+        # 辞書引きのたびに通るので、generator の context manager ではなく使い回せるものにしておく
+        self._lease = _ThreadConnection(connections)
+        self.full_text_search = False
+
+    def connection(self):
+        return self._lease
+
+    def prepare(self, conn):
+        migrations.migrate(conn)
+        self.full_text_search = has_search_index(conn)
+
+    def begin(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+
+    def change_token(self, conn):
+        # data_version は接続ごとの値なので接続と組にする
+        return conn, conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        pass
+
+
+# PostgreSQL のスキーマ。何度流しても同じ結果になるように書き、prepare() が毎回流す。
+# term を COLLATE "C" にして、並び順と頭文字の範囲検索を SQLite（バイト順）と揃える
+POSTGRES_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS dictionary (
+        term TEXT COLLATE "C" NOT NULL,
+        owner TEXT COLLATE "C" NOT NULL DEFAULT '',
+        content TEXT NOT NULL,
+        added_by TEXT NOT NULL DEFAULT '',
+        PRIMARY KEY (term, owner)
+    )
+    """,
+    # 一覧のページ位置を数えるための部分索引（migrations.py の 5 と同じ）
+    "CREATE INDEX IF NOT EXISTS dictionary_public ON dictionary (term) WHERE owner = ''",
+    "CREATE INDEX IF NOT EXISTS dictionary_private ON dictionary (owner, term) WHERE owner != ''",
+    """
+    CREATE TABLE IF NOT EXISTS dictionary_changes (
+        id BIGSERIAL PRIMARY KEY,
+        term TEXT NOT NULL,
+        owner TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS delete_votes (
+        term TEXT COLLATE "C" NOT NULL,
+        voter_id TEXT NOT NULL,
+        PRIMARY KEY (term, voter_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS delete_vote_counts (
+        term TEXT COLLATE "C" PRIMARY KEY,
+        votes INTEGER NOT NULL
+    )
+    """,
+    # 票数の集計と、登録が消えたり書き換わったりしたときに票を捨てるのは SQLite と同じくトリガーで行う
+    """
+    CREATE OR REPLACE FUNCTION delete_vote_counts_ai() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO delete_vote_counts (term, votes) VALUES (NEW.term, 1)
+        ON CONFLICT (term) DO UPDATE SET votes = delete_vote_counts.votes + 1;
+        RETURN NULL;
+    END $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION delete_vote_counts_ad() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE delete_vote_counts SET votes = votes - 1 WHERE term = OLD.term;
+        DELETE FROM delete_vote_counts WHERE term = OLD.term AND votes <= 0;
+        RETURN NULL;
+    END $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION delete_votes_entry_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF OLD.owner = '' AND (TG_OP = 'DELETE' OR NEW.content IS DISTINCT FROM OLD.content) THEN
+            DELETE FROM delete_votes WHERE term = OLD.term;
+        END IF;
+        RETURN NULL;
+    END $$
+    """,
+    "DROP TRIGGER IF EXISTS delete_vote_counts_ai ON delete_votes",
+    "CREATE TRIGGER delete_vote_counts_ai AFTER INSERT ON delete_votes"
+    " FOR EACH ROW EXECUTE FUNCTION delete_vote_counts_ai()",
+    "DROP TRIGGER IF EXISTS delete_vote_counts_ad ON delete_votes",
+    "CREATE TRIGGER delete_vote_counts_ad AFTER DELETE ON delete_votes"
+    " FOR EACH ROW EXECUTE FUNCTION delete_vote_counts_ad()",
+    "DROP TRIGGER IF EXISTS delete_votes_entry_changed ON dictionary",
+    "CREATE TRIGGER delete_votes_entry_changed AFTER DELETE OR UPDATE OF content ON dictionary"
+    " FOR EACH ROW EXECUTE FUNCTION delete_votes_entry_changed()",
+)
+# 「辞書 検索」の LIKE '%語%' を速くする索引（pg_trgm が使えるときだけ）
+POSTGRES_TRIGRAM_INDEXES = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS dictionary_term_trgm ON dictionary USING gin (term gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS dictionary_content_trgm ON dictionary USING gin (content gin_trgm_ops)",
+)
+# 複数の dyno が同時に起動してもスキーマを流すのは1つずつにする
+POSTGRES_SCHEMA_LOCK = 0x6A697368
+# 書き込みのトランザクションを1つずつにする（PostgresStore.begin を参照）
+POSTGRES_WRITE_LOCK = 0x6A697369
+
+
+@lru_cache(maxsize=256)
+def _pg_query(sql):
+    """? のパラメーターを psycopg の %s に直す（% 演算子は %% にする）"""
+    return sql.replace("%", "%%").replace("?", "%s")
+
+
+class Row:
+    """sqlite3.Row と同じく、番号でも列名でも引ける行"""
+
+    __slots__ = ("_values", "_index")
+
+    def __init__(self, values, index):
+        self._values = values
+        self._index = index
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def keys(self):
+        return list(self._index)
+
+
+def _row_factory(cursor):
+    index = {column.name: i for i, column in enumerate(cursor.description or ())}
+    return lambda values: Row(values, index)
+
+
+class PostgresConnection:
+    """psycopg の接続を sqlite3.Connection と同じ書き方（? のパラメーター）で使うための薄い包み"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, sql, params=()):
+        return self._conn.execute(_pg_query(sql), tuple(params))
+
+    def executemany(self, sql, seq_of_params):
+        cursor = self._conn.cursor()
+        cursor.executemany(_pg_query(sql), [tuple(params) for params in seq_of_params])
+        return cursor
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+
+class PostgresStore:
+    """
+    psycopg_pool の接続プールを使う保存先。
+
+    接続は autocommit にしておき、読み込みは1文ずつ、書き込みは begin() から commit() までを
+    1トランザクションにする（プールに返すときに開いたままのトランザクションが残らない）。
+
+    書き込みはどの dyno からでも1つずつ行う。dictionary_changes の id は INSERT した時点で振られるので、
+    同時に書くと小さい id が後からコミットされることがあり、TermCache.sync は「ここまで見た」
+    番号より小さい id を読まないため、その変更を見落としてしまう。
+    """
+
+    def __init__(self, url, min_size=POSTGRES_POOL_MIN, max_size=POSTGRES_POOL_MAX,
+                 sync_interval=POSTGRES_SYNC_INTERVAL):
+        try:
+            from psycopg_pool import ConnectionPool
+        except ImportError as e:
+            raise ImportError('PostgreSQL を使うには pip install "psycopg[binary,pool]" が必要です') from e
+        # プールを開くのは最初に使うとき（dictionary を import しただけでは繋がない）
+        self._pool = ConnectionPool(
+            url,
+            min_size=min_size,
+            max_size=max_size,
+            kwargs={"autocommit": True, "row_factory": _row_factory},
+            open=False,
+            name="dictionary",
+        )
+        self._pool_lock = threading.Lock()
+        self._opened = False
+        self._sync_interval = sync_interval
+        self._token = None
+        self._checked_at = None
+        self.full_text_search = False
+
+    @contextmanager
+    def connection(self):
+        if not self._opened:
+            with self._pool_lock:
+                if not self._opened:
+                    self._pool.open(wait=True)
+                    self._opened = True
+        with self._pool.connection() as conn:
+            yield PostgresConnection(conn)
+
+    def prepare(self, conn):
+        conn.execute("BEGIN")
+        try:
+            conn.execute("SELECT pg_advisory_xact_lock(?)", (POSTGRES_SCHEMA_LOCK,))
+            for statement in POSTGRES_SCHEMA:
+                conn.execute(statement)
+            conn.execute("SAVEPOINT trigram_indexes")
+            try:
+                for statement in POSTGRES_TRIGRAM_INDEXES:
+                    conn.execute(statement)
+            except Exception as e:
+                # 拡張を入れる権限が無いなど。検索は索引無しの LIKE で動く
+                conn.execute("ROLLBACK TO trigram_indexes")
+                logger.warning("pg_trgm の索引を作れませんでした（検索は全件走査になります）: %s", e)
+            conn.execute("RELEASE trigram_indexes")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def begin(self, conn):
+        conn.execute("BEGIN")
+        # ロックはコミット（またはロールバック）で外れるので、次に書く人には必ずこの id が見えている
+        conn.execute("SELECT pg_advisory_xact_lock(?)", (POSTGRES_WRITE_LOCK,))
+
+    def change_token(self, conn):
+        # 変更履歴の最新の番号。問い合わせは sync_interval 秒に1回にして、普段の辞書引きは
+        # DB に行かずにキャッシュだけで済ませる
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self._sync_interval:
+            self._token = conn.execute("SELECT COALESCE(MAX(id), 0) FROM dictionary_changes").fetchone()[0]
+            self._checked_at = now
+        return self._token
+
+    def close(self):
+        if self._opened:
+            self._pool.close()
+
+
+def record_change(conn, term, owner):
+    """
+    変更履歴に1行積む。追加・削除と同じトランザクションの中で呼ぶこと。
+    ときどき古い履歴を消して、表が際限なく大きくならないようにする。
+    """
+    change_id = conn.execute(
+        "INSERT INTO dictionary_changes (term, owner) VALUES (?, ?) RETURNING id", (term, owner)
+    ).fetchone()[0]
+    if change_id % CHANGE_LOG_PRUNE_EVERY == 0:
+        conn.execute("DELETE FROM dictionary_changes WHERE id <= ?", (change_id - DICTIONARY_CHANGE_LOG_SIZE,))
+
+
+def record_bulk_change(conn):
+    """
+    まとめて書き換えたことを変更履歴に積む（owner が NULL の行）。
+    これを見たプロセスは、どの単語が変わったかを追わずにキャッシュを丸ごと捨てる。
+    """
+    conn.execute("INSERT INTO dictionary_changes (term, owner) VALUES ('', NULL)")
+
+
+def open_store(url=DATABASE_URL):
+    """設定に合った保存先を返す"""
+    if url.startswith(("postgres://", "postgresql://")):
+        return PostgresStore(url)
+    return SQLiteStore()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+イベントごとの処理の内訳（どの段階で時間が掛かったか）の記録。
+
+Webhook を受け取ってから返信し終えるまでを、署名検証・パース・キュー待ち・コマンドの処理・
+DB・Apex API・LINE への返信などの段階（span）に分けて測り、TRACE_SLOW_MS より遅かった
+イベントだけを logger "slow_events" に内訳付きで出す。イベントごとに trace_id を振り、
+処理中に出た他のログにも付ける。
+
+- TRACE_EVENTS: 1 で有効（既定 0）。無効のときの span() は何もしない共有のオブジェクトを返すだけ
+- TRACE_SLOW_MS: 遅いイベントとして出す閾値（ミリ秒、既定 1000。0 なら全件出す）
+
+    trace = tracing.start_trace()          # 受け取った時点（無効なら None）
+    with tracing.activate(trace):
+        with tracing.span("verify"):
+            ...
+    # ワーカーでイベントごとに
+    with log_context(...), tracing.event_trace(trace):
+        with tracing.span("dispatch"):
+            ...
+"""
+
+import contextvars
+import logging
+import os
+import time
+
+from log_setup import add_log_context
+
+TRACE_EVENTS = os.getenv("TRACE_EVENTS", "0") == "1"
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+
+slow_logger = logging.getLogger("slow_events")
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """1件分の記録。spans は (段階名, 開始, 終了)（time.perf_counter() の値）のリスト"""
+
+    __slots__ = ("trace_id", "started", "spans")
+
+    def __init__(self, started=None, spans=None):
+        self.trace_id = os.urandom(8).hex()
+        self.started = time.perf_counter() if started is None else started
+        self.spans = [] if spans is None else spans
+
+    def fork(self):
+        """ペイロード単位の記録（署名検証など）を引き継いだ、イベント1件分の記録を作る"""
+        return Trace(self.started, list(self.spans))
+
+    def stages(self):
+        # 入れ子の段階は内側から先に終わるので、始まった順に並べ直す
+        return [
+            {"stage": name, "start_ms": round((start - self.started) * 1000, 2), "ms": round((end - start) * 1000, 2)}
+            for name, start, end in sorted(self.spans, key=lambda span: span[1])
+        ]
+
+
+class _Noop:
+    """無効なときの span() などが返す、何もしない context manager"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP = _Noop()
+
+
+class _Span:
+    __slots__ = ("_trace", "_name", "_started")
+
+    def __init__(self, trace, name):
+        self._trace = trace
+        self._name = name
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        # list.append は1命令なので、別スレッド（asyncio の run_in_executor）から足してもよい
+        self._trace.spans.append((self._name, self._started, time.perf_counter()))
+        return False
+
+
+class _Activate:
+    __slots__ = ("_trace", "_token")
+
+    def __init__(self, trace):
+        self._trace = trace
+
+    def __enter__(self):
+        self._token = _current.set(self._trace)
+        return self._trace
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._token)
+        return False
+
+
+class _EventTrace(_Activate):
+    """event_trace() が返す context manager。抜けるときに遅ければ内訳をログに出す"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        trace = self._trace
+        add_log_context(trace_id=trace.trace_id)
+        return super().__enter__()
+
+    def __exit__(self, *exc_info):
+        super().__exit__(*exc_info)
+        trace = self._trace
+        total_ms = (time.perf_counter() - trace.started) * 1000
+        if total_ms >= TRACE_SLOW_MS:
+            slow_logger.warning(
+                "遅いイベント（%.0f ms）", total_ms,
+                extra={"total_ms": round(total_ms, 2), "stages": trace.stages()},
+            )
+        return False
+
+
+def start_trace():
+    """Webhook を受け取った時点から記録を始める。無効なら None を返す"""
+    return Trace() if TRACE_EVENTS else None
+
+
+def activate(trace):
+    """with の中の span() を trace に記録する（trace が None なら何もしない）"""
+    return _NOOP if trace is None else _Activate(trace)
+
+
+def event_trace(parent):
+    """
+    イベント1件分の記録を parent（start_trace() の戻り値）から分けて始める。
+    parent の最後の段階からここまでを「queue」（ワーカーの空き待ち）として記録する。
+    log_context() の中で使うこと（trace_id をログに付ける）。
+    """
+    if parent is None:
+        return _NOOP
+    trace = parent.fork()
+    now = time.perf_counter()
+    trace.spans.append(("queue", trace.spans[-1][2] if trace.spans else trace.started, now))
+    return _EventTrace(trace)
+
+
+def span(name):
+    """with の中の時間を今のイベントの段階 name として記録する（記録中でなければ何もしない）"""
+    trace = _current.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name)
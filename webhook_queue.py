@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import inspect
+import queue
+import threading
+import time
+import logging
+
+from linebot.v3.webhooks import MessageEvent
+
+import tracing
+from log_setup import log_context
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class EventHandlers:
+    """
+    イベントの種類 → 処理関数の表。WebhookHandler と同じ add() / default() で登録できるが、
+    検証とパースは /callback で済ませるので、ここではパース済みのイベントを振り分けるだけにする。
+
+    処理関数は受け取れる位置引数の数に合わせて (event, destination)・(event)・() のどれかで呼ぶ
+    （*args を受け取るなら (event, destination)。WebhookHandler と同じ決まり）。
+    引数は inspect.signature で数えるので、束縛済みのメソッドや functools.partial でもよい。
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._default = None
+
+    def add(self, event, message=None):
+        """event（MessageEvent なら message の種類も）の処理関数として登録するデコレーター"""
+        def decorator(func):
+            for kind in message if isinstance(message, (list, tuple)) else (message,):
+                self._handlers[(event, kind)] = (func, _arg_count(func))
+            return func
+        return decorator
+
+    def default(self):
+        """どれにも当たらなかったイベントの処理関数として登録するデコレーター"""
+        def decorator(func):
+            self._default = (func, _arg_count(func))
+            return func
+        return decorator
+
+    def dispatch(self, event, destination):
+        entry = None
+        if isinstance(event, MessageEvent):
+            entry = self._handlers.get((type(event), type(event.message)))
+        if entry is None:
+            entry = self._handlers.get((type(event), None), self._default)
+        if entry is None:
+            logger.info("No handler of %s and no default handler", type(event).__name__)
+            return
+        func, count = entry
+        func(*(event, destination)[:count])
+
+
+def _arg_count(func):
+    """処理関数に渡す引数の数（0〜2）"""
+    count = 0
+    for param in inspect.signature(func).parameters.values():
+        if param.kind is param.VAR_POSITIONAL:
+            return 2
+        if param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD):
+            count += 1
+    return min(count, 2)
+
+
+class WebhookEventQueue:
+    """
+    署名検証済みの Webhook ペイロードを受け取り、ワーカースレッドで処理するキュー。
+    /callback はキューに積んだらすぐ 200 を返せるので、LINE 側のタイムアウトや再送を防げる。
+    workers=0 のときはキューを使わずその場で処理する。
+    """
+
+    def __init__(self, handlers, workers=4, maxsize=100, put_timeout=0.5):
+        self._handlers = handlers
+        self._workers = workers
+        self._put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._accepting = True
+        self._lock = threading.Lock()
+        # submit() の途中（受付を確かめてから put し終えるまで）の数。shutdown() はこれが 0 になってから止める
+        self._submitting = 0
+        self._submitted = threading.Condition(self._lock)
+
+    @property
+    def depth(self):
+        """キューに溜まっているペイロード数"""
+        return self._queue.qsize()
+
+    @property
+    def maxsize(self):
+        return self._queue.maxsize
+
+    def start(self):
+        with self._lock:
+            if self._threads or self._workers <= 0:
+                return
+            for i in range(self._workers):
+                t = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, payload, trace=None):
+        """
+        ペイロードをキューに積む。put_timeout 秒待っても空きが無ければ False を返す
+        （呼び出し側は 503 を返して LINE に再送してもらう）。
+        trace は受け取ったときの tracing.start_trace()（イベントごとの内訳はここから分ける）。
+        """
+        with self._lock:
+            if not self._accepting:
+                return False
+            self._submitting += 1
+        try:
+            if self._workers <= 0:
+                self._process(payload, trace)
+                return True
+            self._queue.put((payload, trace), timeout=self._put_timeout)
+        except queue.Full:
+            return False
+        finally:
+            with self._lock:
+                self._submitting -= 1
+                self._submitted.notify_all()
+        return True
+
+    def shutdown(self, timeout=None):
+        """
+        新しいペイロードの受付を止め、キューに残っている分を処理し終えてからワーカーを止める。
+        timeout は全体で待つ秒数（None なら処理し終えるまで待つ）。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining():
+            return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+        with self._lock:
+            self._accepting = False
+            threads, self._threads = self._threads, []
+            # 受付を確かめた後の submit() が停止の印より後ろに積まないよう、積み終えるのを待つ
+            self._submitted.wait_for(lambda: self._submitting == 0, remaining())
+        try:
+            for _ in threads:
+                self._queue.put(_STOP, timeout=remaining())
+        except queue.Full:
+            logger.warning("時間内に Webhook ワーカーを止められませんでした")
+        for t in threads:
+            t.join(remaining())
+        if threads:
+            logger.info("Webhook ワーカーを停止しました（未処理: %d）", self._queue.qsize())
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self._process(*item)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, payload, trace=None):
+        for event in payload.events:
+            # この中で出たログには event_id（と、build_reply で決まったコマンド名・trace_id）が付く
+            with log_context(event_id=getattr(event, "webhook_event_id", None), event_type=event.type), \
+                    tracing.event_trace(trace):
+                started = time.perf_counter()
+                try:
+                    self._handlers.dispatch(event, payload.destination)
+                except Exception:
+                    logger.exception("イベント処理中にエラーが発生しました")
+                    continue
+                logger.info("イベントを処理しました", extra={"elapsed_ms": round((time.perf_counter() - started) * 1000, 2)})
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    DB への書き込みを1本のライタースレッドに集め、溜まった分を1トランザクションで書くキュー。
+
+    connect は接続を貸す context manager を返す関数で、バッチごとに借りて返す。begin(conn) は
+    書き込みのトランザクションを始める関数（省略すると SQLite の BEGIN IMMEDIATE）。
+    on_batch(件数, 秒) を渡すと、バッチをコミットするたびにかかった時間を知らせる。
+
+    submit(op, *args) は concurrent.futures.Future を返す。op は op(conn, *args) の形で
+    トランザクションの中で呼ばれ、(結果, コミット後に呼ぶ関数または None) を返すこと。
+    Future はコミットして後処理（キャッシュを捨てるなど）を済ませてから完了するので、
+    result() が返った時点で他のスレッドからも書き込みが見える。
+
+    - 1本のスレッドが積まれた順に書くので、同じ単語への書き込みの順番は入れ替わらない。
+    - op ごとに SAVEPOINT を切るので、1件が失敗しても同じバッチの他の書き込みは残る。
+    - 前のバッチをコミットしている間に積まれた分が次のバッチにまとまる。
+      max_delay を指定すると、さらにその秒数だけ後続を待ってからコミットする。
+    - enabled=False のときや shutdown() の後は、呼び出したスレッドでその場で書く。
+    """
+
+    def __init__(self, connect, begin=None, max_batch=256, max_delay=0.0, maxsize=10000, enabled=True,
+                 on_batch=None):
+        self._connect = connect
+        self._begin = begin or (lambda conn: conn.execute("BEGIN IMMEDIATE"))
+        self._on_batch = on_batch
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._enabled = enabled
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._accepting = True
+        self._lock = threading.Lock()
+
+    @property
+    def depth(self):
+        """キューに溜まっている書き込みの数"""
+        return self._queue.qsize()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None or not self._enabled or not self._accepting:
+                return
+            self._thread = threading.Thread(target=self._run, name="dictionary-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, op, *args):
+        future = Future()
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            # shutdown() が _STOP を積んだ後に積むと誰も書かないので、受付の確認と積むのは一緒に行う
+            queued = self._accepting and self._thread is not None
+            if queued:
+                self._queue.put((op, args, future))
+        if not queued:
+            with self._connect() as conn:
+                self._apply(conn, [(op, args, future)])
+        return future
+
+    def shutdown(self, timeout=None):
+        """新しい書き込みをキューに積むのをやめ、残っている分を書き終えてからスレッドを止める。"""
+        with self._lock:
+            self._accepting = False
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        logger.info("辞書のライターを停止しました（未処理: %d）", self._queue.qsize())
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self._max_delay
+            while len(batch) < self._max_batch:
+                try:
+                    remaining = deadline - time.monotonic()
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                with self._connect() as conn:
+                    self._apply(conn, batch)
+            except Exception as e:
+                # 接続を借りられなかったときなど。スレッドは止めずに、このバッチだけ失敗させる
+                logger.exception("辞書の接続を用意できませんでした（%d件）", len(batch))
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _apply(self, conn, batch):
+        done = []
+        started = time.perf_counter()
+        try:
+            self._begin(conn)
+            try:
+                for op, args, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    conn.execute("SAVEPOINT write_queue_op")
+                    try:
+                        result, after_commit = op(conn, *args)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write_queue_op")
+                        conn.execute("RELEASE write_queue_op")
+                        future.set_exception(e)
+                        continue
+                    conn.execute("RELEASE write_queue_op")
+                    done.append((future, result, after_commit))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        except Exception as e:
+            logger.exception("辞書への書き込みに失敗しました（%d件）", len(batch))
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        if self._on_batch is not None:
+            self._on_batch(len(batch), time.perf_counter() - started)
+        for future, result, after_commit in done:
+            if after_commit is not None:
+                try:
+                    after_commit()
+                except Exception:
+                    logger.exception("書き込み後の処理でエラーが発生しました")
+            future.set_result(result)